@@ -17,29 +17,46 @@ Versão 21: Aprimora a clareza da interface na aba Black-Scholes. Adiciona uma
 
 import os
 import pandas as pd
-import yfinance as yf
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, date
 from pathlib import Path
 import warnings
 import numpy as np
 import io
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
-from tenacity import retry, wait_exponential, stop_after_attempt, RetryError
-from scipy.stats import norm
-import pandas_ta_classic as ta
+from importacao_tardia import ModuloTardio, com_retentativas, relatorio_importacao
+from indicadores import MotorIndicadores, calcular_universo
+from backtest import DadosBacktest, backtest_sinal, grade_pesos, busca_em_grade, CRITERIOS_BUSCA
+from volatilidade import painel_ohlc, estimar_volatilidades, ESTIMADORES
+from risco import retornos_mensais, beta_correlacao_moveis, relatorio_deriva_beta, JANELAS_BETA
+from fleuriet import PainelContabil, HistoricoFleuriet, calcular_fleuriet, resumo_fleuriet, aplicar_zscore
+from valuation import (
+    CONTAS_VALUATION, series_valuation, calcular_valuation, base_sensibilidade, preco_justo_eva, margem_seguranca,
+    grade_crescimento_wacc, grade_beta_premio, grade_mercado, tornado,
+)
+from opcoes import (
+    black_scholes_vetorizado, binomial_vetorizado, volatilidade_implicita, terceiras_sextas, montar_superficie, grade_cenarios,
+    avaliar_estrategia, ranquear_estrategias, ESTRATEGIAS
+)
 import logging
 from typing import Dict, Any
 import json
-from supabase_client import supabase_client, fetch_transactions, add_transaction, delete_transaction, update_transaction
+from supabase_client import (
+    supabase_client, fetch_transactions, fetch_rollups, add_transaction, delete_transaction, update_transaction,
+    TIPOS_LANCAMENTO, status_sincronizacao, reprocessar_falhas, descartar_falhas, armazenamento_local, USUARIO_LOCAL
+)
 # Ignorar avisos para uma saída mais limpa
 warnings.filterwarnings('ignore')
 
+# Bibliotecas pesadas de análise: carregadas apenas no primeiro uso pela aba que precisa delas
+yf = ModuloTardio('yfinance')
+px = ModuloTardio('plotly.express')
+go = ModuloTardio('plotly.graph_objects')
+
 # ============================================================================
 # Coloque esta função logo após os imports
 # Em analise_financeira_app.py
@@ -126,10 +143,6 @@ def set_neon_theme():
 
 # ============================================================================
 
-@st.cache_data
-def load_transactions_data():
-    """Busca os dados do Supabase e os armazena em cache."""
-    return fetch_transactions()
 # ==============================================================================
 # CONFIGURAÇÕES GERAIS E LAYOUT DA PÁGINA
 # ==============================================================================
@@ -360,11 +373,13 @@ def requests_retry_session(
     session.mount('https://', adapter)
     return session
 
-@st.cache_data
+@st.cache_data(ttl=900)
 def get_stock_data(ticker_sa, period="2y", interval="1d"):
     """
     Busca dados históricos de um ativo com sistema de fallback de 3 níveis.
     Tenta yfinance -> brapi -> Alpha Vantage.
+    O cache expira em 15 minutos, para que o pregão em andamento e os novos pregões cheguem
+    à análise técnica sem reiniciar o processo.
     """
     # 1. Tenta com yfinance
     try:
@@ -424,6 +439,41 @@ def get_stock_data(ticker_sa, period="2y", interval="1d"):
 
     return None
 
+# Uma única série diária (a mais longa usada pelo app) alimenta todos os timeframes e janelas
+PERIODO_HISTORICO_DIARIO = "5y"
+REGRAS_AGREGACAO_BARRAS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'adj close': 'last', 'volume': 'sum'}
+FREQUENCIAS_BARRAS = {'weekly': 'W-SUN', 'monthly': 'M'}
+JANELAS_PERIODO = {"1y": pd.DateOffset(years=1), "2y": pd.DateOffset(years=2), "5y": pd.DateOffset(years=5)}
+
+def reamostrar_barras(df, timeframe):
+    """
+    Barras semanais ('weekly') ou mensais ('monthly') a partir das diárias: abertura do primeiro
+    pregão, máxima e mínima do período, fechamento do último e volume somado. Cada barra é
+    rotulada pelo início do período (segunda-feira / dia 1), como as do yfinance, e a do
+    período em andamento é parcial. Qualquer outro timeframe devolve o próprio df.
+    """
+    if timeframe not in FREQUENCIAS_BARRAS or df is None or df.empty:
+        return df
+    periodos = df.index.to_period(FREQUENCIAS_BARRAS[timeframe])
+    barras = df.groupby(periodos).agg({col: regra for col, regra in REGRAS_AGREGACAO_BARRAS.items() if col in df.columns})
+    barras.index = barras.index.start_time
+    return barras
+
+def recortar_periodo(df, periodo):
+    """Últimos '1y', '2y' ou '5y' de uma série, contados a partir da última barra."""
+    if df is None or df.empty or periodo not in JANELAS_PERIODO:
+        return df
+    return df[df.index > df.index[-1] - JANELAS_PERIODO[periodo]]
+
+def historico_diario(ticker_sa):
+    """Série diária compartilhada pela análise técnica (diária e semanal) e pela volatilidade histórica."""
+    df = get_stock_data(ticker_sa, period=PERIODO_HISTORICO_DIARIO, interval="1d")
+    if df is not None and isinstance(df.columns, pd.MultiIndex):
+        # Garante que não há MultiIndex (sem alterar o DataFrame em cache de get_stock_data)
+        df = df.copy()
+        df.columns = df.columns.droplevel(0)
+    return df
+
 
 @st.cache_data
 def setup_diretorios():
@@ -794,7 +844,7 @@ def carregar_mapeamento_ticker_cvm():
         st.error(f"Falha ao carregar o mapeamento de tickers. Erro: {e}")
         return pd.DataFrame()
 
-@retry(wait=wait_exponential(multiplier=1, min=4, max=10), stop=stop_after_attempt(3))
+@com_retentativas(tentativas=3, multiplicador=1, espera_min=4, espera_max=10)
 def consulta_bc(codigo_bcb):
     """Consulta a API do Banco Central para obter dados como a taxa Selic."""
     try:
@@ -826,6 +876,39 @@ def obter_dados_mercado(periodo_ibov):
         premio_risco_mercado = retorno_anual_mercado - risk_free_rate
     return risk_free_rate, retorno_anual_mercado, premio_risco_mercado, ibov
 
+# Campos de yf.Ticker().info usados pelo valuation e pelo Z-Score de Prado (X4)
+CAMPOS_INFO_MERCADO = ('marketCap', 'currentPrice', 'previousClose', 'longName', 'sharesOutstanding')
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def info_mercado_ativo(ticker_sa):
+    """
+    Dados cadastrais e de mercado de um ativo (só os campos de CAMPOS_INFO_MERCADO presentes
+    no info). Falhas levantam exceção e não entram no cache.
+    """
+    info = yf.Ticker(ticker_sa).info
+    return {campo: info[campo] for campo in CAMPOS_INFO_MERCADO if campo in info}
+
+def snapshot_mercado(tickers_sa, progress_bar=None):
+    """
+    ticker -> info_mercado_ativo para todos os tickers, consultados em paralelo. O valuation e
+    o Fleuriet usam o mesmo cache: rodar uma análise depois da outra não repete as consultas.
+    Tickers cuja consulta falhou ficam de fora.
+    """
+    infos = {}
+    if not tickers_sa:
+        return infos
+    with ThreadPoolExecutor(max_workers=min(8, len(tickers_sa))) as executor:
+        futuros = {executor.submit(info_mercado_ativo, ticker): ticker for ticker in tickers_sa}
+        for i, futuro in enumerate(as_completed(futuros)):
+            ticker = futuros[futuro]
+            if progress_bar is not None:
+                progress_bar.progress((i + 1) / len(futuros), text=f"Dados de mercado {i+1}/{len(futuros)}: {ticker.replace('.SA', '')}")
+            try:
+                infos[ticker] = futuro.result()
+            except Exception:
+                continue
+    return infos
+
 def obter_historico_metrica(df_empresa, codigo_conta):
     """
     Extrai o histórico anual de uma conta contábil específica da CVM.
@@ -871,6 +954,17 @@ def format_large_number(num):
         return f"R$ {num/1_000:.1f}k"
     return f"R$ {num:,.2f}"
 
+def _limite_data(datas, dia):
+    """Converte uma data do filtro para Timestamp no mesmo fuso da coluna de datas."""
+    limite = pd.Timestamp(dia)
+    fuso = getattr(datas.dtype, 'tz', None)
+    return limite.tz_localize(fuso) if fuso is not None else limite
+
+def mascara_periodo(datas, data_inicio, data_fim):
+    """Máscara booleana das datas dentro de [data_inicio, data_fim], sem converter para objetos date."""
+    fim_exclusivo = _limite_data(datas, data_fim) + pd.Timedelta(days=1)
+    return (datas >= _limite_data(datas, data_inicio)) & (datas < fim_exclusivo)
+
 # Adicione esta função ANTES de ui_controle_financeiro, no escopo global
 def limpar_selecao_categoria():
     """Define o valor do widget de categoria como o primeiro da lista de opções."""
@@ -879,12 +973,28 @@ def limpar_selecao_categoria():
     if opcoes:
         st.session_state.categoria_selecionada = opcoes[0]
 
-def ui_controle_financeiro():
-    """Renderiza a interface completa da aba de Controle Financeiro."""
-    user_id = st.session_state.user.user.id
-    st.header("Dashboard de Controle Financeiro Pessoal")
-
-    # Carrega as transações do usuário logado
+def exibir_status_sincronizacao(user_id):
+    """Mostra as alterações ainda não gravadas no banco e as que falharam."""
+    status = status_sincronizacao(user_id)
+    if status['pendentes']:
+        st.caption(f"⏳ {status['pendentes']} alteração(ões) aguardando sincronização com o banco de dados...")
+    if status['falhas']:
+        st.warning(f"⚠️ {len(status['falhas'])} alteração(ões) não puderam ser gravadas. Último erro: {status['falhas'][-1].get('erro', 'desconhecido')}")
+        col_retentar, col_descartar = st.columns(2)
+        if col_retentar.button("Tentar Novamente", use_container_width=True, key="btn_reprocessar_falhas"):
+            reprocessar_falhas(user_id)
+            st.rerun()
+        if col_descartar.button("Descartar Alterações com Falha", use_container_width=True, key="btn_descartar_falhas"):
+            descartar_falhas(user_id)
+            st.rerun()
+
+@st.fragment
+def painel_resumo_financeiro(user_id):
+    """
+    Filtros, cards de resumo e gráficos históricos do Controle Financeiro.
+    Como fragmento, uma mudança nas datas ou no tipo reexecuta apenas este trecho;
+    os dados vêm do cache local da fila de escrita, sem nova consulta ao banco.
+    """
     df_trans = fetch_transactions(user_id=user_id)
 
     # --- Seção de Filtros ---
@@ -895,20 +1005,17 @@ def ui_controle_financeiro():
     st.divider()
 
     # --- Lógica de Filtragem e Cálculo dos Cards ---
-    df_filtrado = pd.DataFrame()
-    if not df_trans.empty:
-        df_trans['Data'] = pd.to_datetime(df_trans['Data'])
-        df_filtrado = df_trans[(df_trans['Data'].dt.date >= data_inicio) & (df_trans['Data'].dt.date <= data_fim)]
-        if tipo_filtro != "Todos":
-            df_filtrado = df_filtrado[df_filtrado['Tipo'] == tipo_filtro]
-
-    if not df_filtrado.empty:
-        total_receitas = df_filtrado[df_filtrado['Tipo'] == 'Receita']['Valor'].sum()
-        total_despesas = df_filtrado[df_filtrado['Tipo'] == 'Despesa']['Valor'].sum()
-        total_investido = df_filtrado[df_filtrado['Tipo'] == 'Investimento']['Valor'].sum()
-        saldo_periodo = total_receitas - total_despesas - total_investido
-    else:
-        total_receitas, total_despesas, total_investido, saldo_periodo = 0, 0, 0, 0
+    # Cards e gráficos leem os rollups mensais/diários: o custo depende do número de meses, não de lançamentos
+    rollups = fetch_rollups(user_id=user_id)
+    tipos_visiveis = TIPOS_LANCAMENTO if tipo_filtro == "Todos" else [tipo_filtro]
+    df_monthly = rollups.totais_mensais(data_inicio, data_fim)[tipos_visiveis]
+    df_monthly = df_monthly.loc[(df_monthly != 0).any(axis=1)]
+
+    totais_tipo = df_monthly.sum()
+    total_receitas = totais_tipo.get('Receita', 0)
+    total_despesas = totais_tipo.get('Despesa', 0)
+    total_investido = totais_tipo.get('Investimento', 0)
+    saldo_periodo = total_receitas - total_despesas - total_investido
 
     st.subheader("Resumo do Período")
     col_card1, col_card2, col_card3, col_card4 = st.columns(4)
@@ -918,6 +1025,71 @@ def ui_controle_financeiro():
     col_card4.metric("Saldo", format_large_number(saldo_periodo))
     st.divider()
 
+    # --- Seção de Gráficos ---
+    st.subheader("Análise Histórica")
+    if not df_monthly.empty:
+        neon_palette = ['#00F6FF', '#39FF14', '#FF5252', '#F2A30F', '#7B2BFF']
+        df_arca = pd.Series(dtype=float)
+        if 'Investimento' in tipos_visiveis:
+            # Máscara booleana sobre o DataFrame em cache, sem cópia filtrada
+            mascara_investimento = mascara_periodo(df_trans['Data'], data_inicio, data_fim) & (df_trans['Tipo'] == 'Investimento')
+            df_arca = df_trans['Valor'][mascara_investimento].groupby(df_trans['Subcategoria ARCA'][mascara_investimento], observed=True).sum()
+        if not df_arca.empty:
+            fig_arca = px.pie(df_arca, values='Valor', names=df_arca.index, title="Composição dos Investimentos (ARCA)", hole=.4, color_discrete_sequence=neon_palette)
+            fig_arca.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_font_color='var(--text-color)', title_font_color='var(--header-color)')
+            fig_arca.update_traces(textinfo='percent+label', textfont_size=14)
+            st.plotly_chart(fig_arca, use_container_width=True)
+        else:
+            st.info("Nenhum investimento ARCA registrado no período selecionado.")
+        
+        st.divider()
+        
+        df_patrimonio_filtrado = pd.Series(dtype=float)
+        if 'Investimento' in tipos_visiveis:
+            patrimonio_inicial = rollups.total_antes(data_inicio, 'Investimento')
+            df_investimento_diario = rollups.serie_diaria('Investimento', data_inicio, data_fim)
+            df_patrimonio_filtrado = df_investimento_diario.cumsum() + patrimonio_inicial
+        if not df_patrimonio_filtrado.empty:
+            fig_evol_patrimonio_investimento = px.line(df_patrimonio_filtrado, y=df_patrimonio_filtrado.values, title="Evolução do Patrimônio (Investimentos)", labels={'index': 'Data', 'y': 'Patrimônio Total'}, markers=True, template="plotly_dark")
+            fig_evol_patrimonio_investimento.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='var(--text-color)', title_font_color='var(--header-color)', yaxis_title='Patrimônio Total (R$)')
+            st.plotly_chart(fig_evol_patrimonio_investimento, use_container_width=True)
+
+        col_graf1, col_graf2 = st.columns(2)
+        with col_graf1:
+            fig_evol_tipo = px.bar(df_monthly, x=df_monthly.index, y=[col for col in ['Receita', 'Despesa', 'Investimento'] if col in df_monthly.columns], title="Evolução Mensal por Tipo", barmode='group', color_discrete_map={'Receita': '#00F6FF', 'Despesa': '#FF5252', 'Investimento': '#39FF14'})
+            fig_evol_tipo.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_font_color='var(--text-color)', title_font_color='var(--header-color)')
+            st.plotly_chart(fig_evol_tipo, use_container_width=True)
+        with col_graf2:
+            df_monthly['Patrimonio'] = (df_monthly.get('Receita', 0) - df_monthly.get('Despesa', 0)).cumsum()
+            fig_evol_patrimonio = px.line(df_monthly, x=df_monthly.index, y='Patrimonio', title="Evolução Patrimonial", markers=True, template="plotly_dark")
+            fig_evol_patrimonio.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_font_color='var(--text-color)', title_font_color='var(--header-color)')
+            st.plotly_chart(fig_evol_patrimonio, use_container_width=True)
+    else:
+        st.info("Nenhuma transação registrada no período. Adicione transações ou ajuste os filtros de data.")
+
+@st.fragment
+def painel_metas():
+    """Painel de metas financeiras, reexecutado isoladamente a cada interação."""
+    with st.expander("🎯 Metas Financeiras", expanded=True):
+        meta_selecionada = st.selectbox("Selecione a meta para definir", options=list(st.session_state.goals.keys()))
+        novo_valor_meta = st.number_input("Definir Valor Alvo (R$)", min_value=0.0, value=st.session_state.goals[meta_selecionada]['meta'], format="%.2f")
+        if st.button("Atualizar Meta"):
+            st.session_state.goals[meta_selecionada]['meta'] = novo_valor_meta
+            st.success(f"Meta '{meta_selecionada}' atualizada!")
+
+def ui_controle_financeiro():
+    """Renderiza a interface completa da aba de Controle Financeiro."""
+    user_id = st.session_state.user.user.id
+    st.header("Dashboard de Controle Financeiro Pessoal")
+    exibir_status_sincronizacao(user_id)
+
+    # Carrega as transações do usuário logado
+    df_trans = fetch_transactions(user_id=user_id)
+
+    # Filtros, cards e gráficos reexecutam sozinhos quando os filtros mudam
+    painel_resumo_financeiro(user_id)
+    st.divider()
+
     # --- Seção de Lançamentos e Metas ---
     col1, col2 = st.columns(2)
     with col1:
@@ -954,81 +1126,45 @@ def ui_controle_financeiro():
                         'Subcategoria ARCA': sub_arca, 'Valor': valor, 'Descrição': descricao
                     }
                     add_transaction(nova_transacao_dict, user_id=user_id)
-                    st.success("Lançamento salvo no banco de dados!")
+                    st.success("Lançamento registrado! A gravação no banco de dados segue em segundo plano.")
                     st.rerun()
     with col2:
-        with st.expander("🎯 Metas Financeiras", expanded=True):
-            meta_selecionada = st.selectbox("Selecione a meta para definir", options=list(st.session_state.goals.keys()))
-            novo_valor_meta = st.number_input("Definir Valor Alvo (R$)", min_value=0.0, value=st.session_state.goals[meta_selecionada]['meta'], format="%.2f")
-            if st.button("Atualizar Meta"):
-                st.session_state.goals[meta_selecionada]['meta'] = novo_valor_meta
-                st.success(f"Meta '{meta_selecionada}' atualizada!")
-    
-    st.divider()
-
-    # --- Seção de Gráficos e Histórico ---
-    st.subheader("Análise Histórica")
-    if not df_filtrado.empty:
-        neon_palette = ['#00F6FF', '#39FF14', '#FF5252', '#F2A30F', '#7B2BFF']
-        df_arca = df_filtrado[df_filtrado['Tipo'] == 'Investimento'].groupby('Subcategoria ARCA')['Valor'].sum()
-        if not df_arca.empty:
-            fig_arca = px.pie(df_arca, values='Valor', names=df_arca.index, title="Composição dos Investimentos (ARCA)", hole=.4, color_discrete_sequence=neon_palette)
-            fig_arca.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_font_color='var(--text-color)', title_font_color='var(--header-color)')
-            fig_arca.update_traces(textinfo='percent+label', textfont_size=14)
-            st.plotly_chart(fig_arca, use_container_width=True)
-        else:
-            st.info("Nenhum investimento ARCA registrado no período selecionado.")
-        
-        st.divider()
-        
-        df_investimento_filtrado = df_filtrado[df_filtrado['Tipo'] == 'Investimento'].copy()
-        patrimonio_inicial = df_trans[(df_trans['Data'].dt.date < data_inicio) & (df_trans['Tipo'] == 'Investimento')]['Valor'].sum()
-        df_investimento_diario = df_investimento_filtrado.set_index('Data').resample('D')['Valor'].sum().fillna(0)
-        df_patrimonio_filtrado = df_investimento_diario.cumsum() + patrimonio_inicial
-        if not df_patrimonio_filtrado.empty:
-            fig_evol_patrimonio_investimento = px.line(df_patrimonio_filtrado, y=df_patrimonio_filtrado.values, title="Evolução do Patrimônio (Investimentos)", labels={'index': 'Data', 'y': 'Patrimônio Total'}, markers=True, template="plotly_dark")
-            fig_evol_patrimonio_investimento.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='var(--text-color)', title_font_color='var(--header-color)', yaxis_title='Patrimônio Total (R$)')
-            st.plotly_chart(fig_evol_patrimonio_investimento, use_container_width=True)
+        painel_metas()
 
-        col_graf1, col_graf2 = st.columns(2)
-        with col_graf1:
-            df_monthly = df_filtrado.set_index('Data').groupby([pd.Grouper(freq='M'), 'Tipo'])['Valor'].sum().unstack(fill_value=0)
-            fig_evol_tipo = px.bar(df_monthly, x=df_monthly.index, y=[col for col in ['Receita', 'Despesa', 'Investimento'] if col in df_monthly.columns], title="Evolução Mensal por Tipo", barmode='group', color_discrete_map={'Receita': '#00F6FF', 'Despesa': '#FF5252', 'Investimento': '#39FF14'})
-            fig_evol_tipo.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_font_color='var(--text-color)', title_font_color='var(--header-color)')
-            st.plotly_chart(fig_evol_tipo, use_container_width=True)
-        with col_graf2:
-            df_monthly['Patrimonio'] = (df_monthly.get('Receita', 0) - df_monthly.get('Despesa', 0)).cumsum()
-            fig_evol_patrimonio = px.line(df_monthly, x=df_monthly.index, y='Patrimonio', title="Evolução Patrimonial", markers=True, template="plotly_dark")
-            fig_evol_patrimonio.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_font_color='var(--text-color)', title_font_color='var(--header-color)')
-            st.plotly_chart(fig_evol_patrimonio, use_container_width=True)
-    else:
-        st.info("Nenhuma transação registrada no período. Adicione transações ou ajuste os filtros de data.")
+    st.divider()
 
     with st.expander("📜 Histórico de Transações", expanded=True):
         if not df_trans.empty:
-            df_para_editar = df_trans.copy()
-            df_para_editar['Excluir'] = False
+            # Cópia apenas para exibição: colunas de texto livre voltam a ser objeto para aceitar novos valores
+            df_para_editar = df_trans.assign(
+                Excluir=False,
+                **{col: df_trans[col].astype(object) for col in ['Categoria', 'Subcategoria ARCA'] if col in df_trans.columns}
+            )
 
-            if 'original_df' not in st.session_state or st.session_state.original_df.empty:
-                st.session_state.original_df = df_para_editar.copy()
+            # As posições de 'edited_rows' se referem ao DataFrame entregue ao editor na execução
+            # anterior. O DataFrame compartilhado pode ter sido reordenado desde então (inclusão
+            # otimista em outra aba, recarga em segundo plano), então os ids vêm dos guardados na sessão
+            ids_editor = st.session_state.get('ids_editor_transacoes')
+            if ids_editor is None:
+                ids_editor = df_para_editar['id'].to_numpy()
+            st.session_state['ids_editor_transacoes'] = df_para_editar['id'].to_numpy()
+            id_da_posicao = lambda posicao: int(ids_editor[int(posicao)])
 
-            edited_df = st.data_editor(df_para_editar, use_container_width=True, column_order=('Excluir', 'Data', 'Tipo', 'Categoria', 'Subcategoria ARCA', 'Valor', 'Descrição'), column_config={"id": None, "created_at": None, "Data": st.column_config.DateColumn("Data", format="DD/MM/YYYY", required=True), "Valor": st.column_config.NumberColumn("Valor (R$)", format="R$ %.2f", required=True), "Tipo": st.column_config.SelectboxColumn("Tipo", options=["Receita", "Despesa", "Investimento"], required=True), "Categoria": st.column_config.TextColumn("Categoria", required=True), "Subcategoria ARCA": st.column_config.TextColumn("ARCA")}, hide_index=True, key="editor_transacoes")
+            st.data_editor(df_para_editar, use_container_width=True, column_order=('Excluir', 'Data', 'Tipo', 'Categoria', 'Subcategoria ARCA', 'Valor', 'Descrição'), column_config={"id": None, "created_at": None, "Data": st.column_config.DateColumn("Data", format="DD/MM/YYYY", required=True), "Valor": st.column_config.NumberColumn("Valor (R$)", format="R$ %.2f", required=True), "Tipo": st.column_config.SelectboxColumn("Tipo", options=["Receita", "Despesa", "Investimento"], required=True), "Categoria": st.column_config.TextColumn("Categoria", required=True), "Subcategoria ARCA": st.column_config.TextColumn("ARCA")}, hide_index=True, key="editor_transacoes")
             
             col_salvar, col_excluir = st.columns(2)
             with col_salvar:
                 if st.button("Salvar Alterações", use_container_width=True, type="primary"):
                     try:
-                        mudancas = st.session_state.original_df.compare(edited_df)
-                        if not mudancas.empty:
-                            count = 0
-                            for index in mudancas.index:
-                                linha_modificada = edited_df.loc[index]
-                                transaction_id = int(linha_modificada['id'])
-                                dados_para_atualizar = linha_modificada.drop(['id', 'created_at', 'Excluir', 'user_id']).to_dict()
+                        # O próprio editor guarda apenas as células alteradas: {posição da linha: {coluna: valor}}
+                        edicoes = st.session_state.editor_transacoes.get('edited_rows', {})
+                        mudancas = {pos: {col: val for col, val in cols.items() if col != 'Excluir'} for pos, cols in edicoes.items()}
+                        mudancas = {pos: cols for pos, cols in mudancas.items() if cols}
+                        if mudancas:
+                            for posicao, dados_para_atualizar in mudancas.items():
+                                transaction_id = id_da_posicao(posicao)
                                 update_transaction(transaction_id, dados_para_atualizar, user_id=user_id)
-                                count += 1
-                            st.success(f"{count} lançamento(s) atualizado(s) com sucesso!")
-                            st.session_state.original_df = edited_df.copy()
+                            st.success(f"{len(mudancas)} lançamento(s) atualizado(s) com sucesso!")
                             st.rerun()
                         else:
                             st.info("Nenhuma alteração foi feita na tabela.")
@@ -1037,14 +1173,12 @@ def ui_controle_financeiro():
 
             with col_excluir:
                 if st.button("Excluir Lançamentos Selecionados", use_container_width=True):
-                    linhas_para_excluir = edited_df[edited_df['Excluir']]
-                    if not linhas_para_excluir.empty:
-                        for index, row in linhas_para_excluir.iterrows():
-                            transaction_id = int(row['id'])
+                    edicoes = st.session_state.editor_transacoes.get('edited_rows', {})
+                    ids_para_excluir = [id_da_posicao(pos) for pos, cols in edicoes.items() if cols.get('Excluir')]
+                    if ids_para_excluir:
+                        for transaction_id in ids_para_excluir:
                             delete_transaction(transaction_id, user_id=user_id)
-                        st.success(f"{len(linhas_para_excluir)} lançamento(s) excluído(s) do banco de dados!")
-                        if 'original_df' in st.session_state:
-                            del st.session_state.original_df
+                        st.success(f"{len(ids_para_excluir)} lançamento(s) excluído(s) do banco de dados!")
                         st.rerun()
                     else:
                         st.warning("Nenhum lançamento foi selecionado para exclusão.")
@@ -1054,8 +1188,9 @@ def ui_controle_financeiro():
 # ==============================================================================
 # ABA 2: VALUATION
 # ==============================================================================
+@st.cache_data(show_spinner=False)
 def calcular_beta(ticker, ibov_data, periodo_beta):
-    """Calcula o Beta de uma ação em relação ao Ibovespa de forma robusta."""
+    """Calcula o Beta de uma ação em relação ao Ibovespa de forma robusta (sem o ajuste de Hamada, feito no valuation)."""
     dados_acao = yf.download(ticker, period=periodo_beta, progress=False, auto_adjust=True)['Close']
     if dados_acao.empty:
         return 1.0
@@ -1073,28 +1208,51 @@ def calcular_beta(ticker, ibov_data, periodo_beta):
     
     return covariancia / variancia_mercado if variancia_mercado != 0 else 1.0
 
-def calcular_beta_hamada(ticker, ibov_data, periodo_beta, imposto, divida_total, market_cap):
+def fechamento_ibov(ibov_data):
+    """Série de fechamento do Ibovespa devolvida por obter_dados_mercado (com ou sem MultiIndex do yfinance)."""
+    if ibov_data is None or ibov_data.empty:
+        return None
+    fechamento = ibov_data['Adj Close'] if 'Adj Close' in ibov_data.columns else ibov_data['Close']
+    if isinstance(fechamento, pd.DataFrame):
+        fechamento = fechamento.iloc[:, 0]
+    return fechamento.dropna()
+
+def calcular_betas_moveis(fechamentos, ibov_data, janelas=JANELAS_BETA):
     """
-    Calcula o Beta alavancado ajustado pelo modelo de Hamada.
+    Beta e correlação móveis (12/24/36 meses) contra o Ibovespa de um ou vários ativos
+    ('fechamentos': datas x tickers), com o Ibovespa já baixado por obter_dados_mercado.
+    Devolve None se o Ibovespa não estiver disponível.
     """
-    beta_alavancado_mercado = calcular_beta(ticker, ibov_data, periodo_beta)
-    
-    if (market_cap + divida_total) == 0 or market_cap == 0:
-        return beta_alavancado_mercado
-    
-    divida_patrimonio = divida_total / market_cap
-    beta_desalavancado = beta_alavancado_mercado / (1 + (1 - imposto) * divida_patrimonio)
-    
-    beta_realavancado = beta_desalavancado * (1 + (1 - imposto) * divida_patrimonio)
-    
-    return beta_realavancado
+    ibov = fechamento_ibov(ibov_data)
+    if ibov is None:
+        return None
+    return beta_correlacao_moveis(retornos_mensais(fechamentos), retornos_mensais(ibov), janelas)
+
+def exibir_betas_moveis(ticker_sa, ibov_data):
+    """Gráficos do beta e da correlação móveis de um ativo (detalhe do valuation)."""
+    df = historico_diario(ticker_sa)
+    moveis = calcular_betas_moveis(df[['close']].rename(columns={'close': ticker_sa}), ibov_data) if df is not None and not df.empty else None
+    if moveis is None:
+        st.warning("Não foi possível calcular o beta móvel: histórico do ativo ou do Ibovespa indisponível.")
+        return
+    for grandeza, titulo in (('beta', 'Beta Móvel vs. Ibovespa'), ('correlacao', 'Correlação Móvel vs. Ibovespa')):
+        fig = go.Figure()
+        for janela, cor in zip(moveis, ('#00F6FF', '#F2A30F', '#E94560')):
+            serie = moveis[janela][grandeza][ticker_sa].dropna()
+            fig.add_trace(go.Scatter(x=serie.index, y=serie.values, mode='lines', name=f'{janela} meses', line=dict(color=cor, width=2)))
+        fig.update_layout(title=titulo, template="plotly_dark", paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='var(--text-color)'))
+        st.plotly_chart(fig, use_container_width=True)
+    st.caption("Retornos mensais (último fechamento de cada mês). Cada ponto usa os 12, 24 ou 36 meses anteriores; janelas com menos de 75% dos meses ficam em branco.")
 
-def processar_valuation_empresa(ticker_sa, codigo_cvm, demonstrativos, market_data, params):
+@st.cache_data(show_spinner=False)
+def insumos_cvm_valuation(codigo_cvm, anos_historico, _demonstrativos=None):
     """
-    Executa a análise de valuation de uma única empresa, calculando EVA, EFV, WACC, etc.
+    Estágio de coleta do valuation, parte CVM: séries anuais e alíquota efetiva da empresa
+    (valuation.series_valuation), que não dependem dos parâmetros da análise. O cache é por
+    código CVM e anos de histórico; os demonstrativos (de preparar_dados_cvm) só são lidos
+    quando a empresa ainda não está no cache e, se não forem passados, são carregados aqui.
     """
-    (risk_free_rate, _, premio_risco_mercado, ibov_data) = market_data
-
+    demonstrativos = _demonstrativos if _demonstrativos is not None else preparar_dados_cvm(anos_historico)
     dre = demonstrativos.get('dre', pd.DataFrame())
     bpa = demonstrativos.get('bpa', pd.DataFrame())
     bpp = demonstrativos.get('bpp', pd.DataFrame())
@@ -1103,115 +1261,69 @@ def processar_valuation_empresa(ticker_sa, codigo_cvm, demonstrativos, market_da
     if dre.empty or bpa.empty or bpp.empty or dfc.empty:
         return None, "Dados da CVM não puderam ser baixados. Análise de valuation impossível."
 
-    empresa_dre = dre[dre['CD_CVM'] == codigo_cvm]
-    empresa_bpa = bpa[bpa['CD_CVM'] == codigo_cvm]
-    empresa_bpp = bpp[bpp['CD_CVM'] == codigo_cvm]
-    empresa_dfc = dfc[dfc['CD_CVM'] == codigo_cvm]
+    empresa = {
+        'dre': dre[dre['CD_CVM'] == codigo_cvm],
+        'bpa': bpa[bpa['CD_CVM'] == codigo_cvm],
+        'bpp': bpp[bpp['CD_CVM'] == codigo_cvm],
+        'dfc': dfc[dfc['CD_CVM'] == codigo_cvm],
+    }
     
-    if any(df.empty for df in [empresa_dre, empresa_bpa, empresa_bpp, empresa_dfc]):
+    if any(df.empty for df in empresa.values()):
         return None, "Dados CVM históricos incompletos ou inexistentes para este ticker."
+
+    C = CONFIG['CONTAS_CVM']
+    # Demonstrativo de cada conta pelo prefixo do código (1 ativo, 2 passivo, 3 DRE, 6 DFC)
+    origem = {'1': 'bpa', '2': 'bpp', '3': 'dre', '6': 'dfc'}
+    historicos = {conta: obter_historico_metrica(empresa[origem[C[conta][0]]], C[conta]) for conta in CONTAS_VALUATION}
+    return series_valuation(historicos)
+
+def coletar_insumos_valuation(ticker_sa, codigo_cvm, demonstrativos, market_data, params):
+    """
+    Estágio de coleta do valuation, todo em cache: séries da CVM, dados do Yahoo Finance e beta
+    de mercado. Com demonstrativos=None, os demonstrativos só são carregados se a empresa não
+    estiver no cache. Devolve (insumos, mercado, beta_mercado, mensagem); insumos é None se
+    faltar dado.
+    """
+    insumos, mensagem = insumos_cvm_valuation(codigo_cvm, CONFIG["HISTORICO_ANOS_CVM"], demonstrativos)
+    if insumos is None:
+        return None, None, None, mensagem
     
     try:
-        info = yf.Ticker(ticker_sa).info
+        info = info_mercado_ativo(ticker_sa)
         market_cap = info.get('marketCap')
         preco_atual = info.get('currentPrice', info.get('previousClose'))
         nome_empresa = info.get('longName', ticker_sa)
         n_acoes = info.get('sharesOutstanding')
         
         if not all([market_cap, preco_atual, n_acoes, nome_empresa]):
-            return None, "Dados de mercado (YFinance) incompletos."
+            return None, None, None, "Dados de mercado (YFinance) incompletos."
             
     except Exception:
-        return None, "Falha ao buscar dados no Yahoo Finance."
-        
-    C = CONFIG['CONTAS_CVM']
-    
-    # Extração de dados da CVM para séries históricas
-    hist_ebit = obter_historico_metrica(empresa_dre, C['EBIT'])
-    hist_impostos = obter_historico_metrica(empresa_dre, C['IMPOSTO_DE_RENDA_CSLL'])
-    hist_lai = obter_historico_metrica(empresa_dre, C['LUCRO_ANTES_IMPOSTOS'])
-    hist_rec_liquida = obter_historico_metrica(empresa_dre, C['RECEITA_LIQUIDA'])
-    hist_lucro_liquido = obter_historico_metrica(empresa_dre, C['LUCRO_LIQUIDO'])
-    hist_contas_a_receber = obter_historico_metrica(empresa_bpa, C['CONTAS_A_RECEBER'])
-    hist_estoques = obter_historico_metrica(empresa_bpa, C['ESTOQUES'])
-    hist_fornecedores = obter_historico_metrica(empresa_bpp, C['FORNECEDORES'])
-    hist_ativo_imobilizado = obter_historico_metrica(empresa_bpa, C['ATIVO_IMOBILIZADO'])
-    hist_ativo_intangivel = obter_historico_metrica(empresa_bpa, C['ATIVO_INTANGIVEL'])
-    hist_divida_cp = obter_historico_metrica(empresa_bpp, C['DIVIDA_CURTO_PRAZO'])
-    hist_divida_lp = obter_historico_metrica(empresa_bpp, C['DIVIDA_LONGO_PRAZO'])
-    hist_desp_financeira = abs(obter_historico_metrica(empresa_dre, C['DESPESAS_FINANCEIRAS']))
-    hist_pl_total = obter_historico_metrica(empresa_bpp, C['PATRIMONIO_LIQUIDO'])
-    hist_dep_amort = obter_historico_metrica(empresa_dfc, C['DEPRECIACAO_AMORTIZACAO'])
-    
-    if hist_lai.sum() == 0 or hist_ebit.empty:
-        return None, "Dados de Lucro/EBIT insuficientes para calcular a alíquota de imposto."
+        return None, None, None, "Falha ao buscar dados no Yahoo Finance."
 
-    aliquota_efetiva = abs(hist_impostos.sum()) / abs(hist_lai.sum()) if hist_lai.sum() != 0 else 0
-    
-    hist_nopat = hist_ebit * (1 - aliquota_efetiva)
-    hist_fco = hist_nopat.add(hist_dep_amort, fill_value=0)
-    hist_ncg = hist_contas_a_receber.add(hist_estoques, fill_value=0).subtract(hist_fornecedores, fill_value=0)
-    hist_capital_empregado = hist_ncg.add(hist_ativo_imobilizado, fill_value=0).add(hist_ativo_intangivel, fill_value=0)
-    
-    df_series = pd.concat([hist_nopat, hist_fco, hist_capital_empregado, hist_divida_cp, hist_divida_lp, hist_desp_financeira, hist_pl_total, hist_rec_liquida, hist_lucro_liquido, hist_contas_a_receber, hist_estoques, hist_fornecedores, hist_ebit, hist_dep_amort], axis=1).dropna()
-    df_series.columns = ['NOPAT', 'FCO', 'Capital Empregado', 'Divida CP', 'Divida LP', 'Despesas Financeiras', 'PL', 'Receita Liquida', 'Lucro Liquido', 'Contas a Receber', 'Estoques', 'Fornecedores', 'EBIT', 'Dep_Amort']
+    mercado = {'ticker': ticker_sa.replace('.SA', ''), 'nome_empresa': nome_empresa, 'market_cap': market_cap, 'preco_atual': preco_atual, 'n_acoes': n_acoes}
+    beta_mercado = calcular_beta(ticker_sa, market_data[3], params['periodo_beta_ibov'])
+    return insumos, mercado, beta_mercado, mensagem
 
-    if df_series.empty:
-        return None, "Séries históricas incompletas para os cálculos anuais."
-    
-    hist_divida_total = df_series['Divida CP'] + df_series['Divida LP']
-    hist_roic = (df_series['NOPAT'] / df_series['Capital Empregado'])
-    
-    divida_total_ultimo_ano = hist_divida_total.iloc[-1]
-    
-    beta_hamada = calcular_beta_hamada(ticker_sa, ibov_data, params['periodo_beta_ibov'], aliquota_efetiva, divida_total_ultimo_ano, market_cap)
-    ke = risk_free_rate + beta_hamada * premio_risco_mercado
-    ev_mercado = market_cap + divida_total_ultimo_ano
-    wacc_medio = ((market_cap / ev_mercado) * ke) + ((divida_total_ultimo_ano / ev_mercado) * (df_series['Despesas Financeiras'].mean() / divida_total_ultimo_ano) * (1 - aliquota_efetiva)) if ev_mercado > 0 and divida_total_ultimo_ano > 0 else ke
-    
-    if wacc_medio <= params['taxa_crescimento_perpetuidade'] or pd.isna(wacc_medio):
-        return None, "WACC inválido ou menor/igual à taxa de crescimento na perpetuidade. Ajuste os parâmetros."
-
-    hist_wacc = pd.Series([wacc_medio] * len(df_series.index), index=df_series.index)
-    
-    hist_eva = (hist_roic - hist_wacc) * df_series['Capital Empregado']
-    hist_riqueza_atual = hist_eva / hist_wacc
-    
-    riqueza_futura_esperada_ultimo = market_cap + divida_total_ultimo_ano - df_series['Capital Empregado'].iloc[-1]
-    efv_ultimo = riqueza_futura_esperada_ultimo - hist_riqueza_atual.iloc[-1]
-
-    hist_riqueza_futura_percentual = ((pd.Series([riqueza_futura_esperada_ultimo] * len(df_series.index), index=df_series.index) / df_series['Capital Empregado']) - 1) * 100
-    hist_riqueza_atual_percentual = (hist_riqueza_atual / df_series['Capital Empregado']) * 100
-    hist_efv_percentual = (hist_riqueza_futura_percentual - hist_riqueza_atual_percentual)
-    hist_eva_percentual = (hist_eva / df_series['Capital Empregado']) * 100
-    
-    resultados = {
-        'Empresa': nome_empresa, 'Ticker': ticker_sa.replace('.SA', ''), 'Preço Atual (R$)': preco_atual, 
-        'Preço Justo (R$)': (riqueza_futura_esperada_ultimo + df_series['Capital Empregado'].iloc[-1] - divida_total_ultimo_ano) / n_acoes if n_acoes > 0 else 0, 
-        'Margem Segurança (%)': ((riqueza_futura_esperada_ultimo + df_series['Capital Empregado'].iloc[-1] - divida_total_ultimo_ano) / n_acoes / preco_atual - 1) * 100 if n_acoes > 0 and preco_atual > 0 else -100, 
-        'Market Cap (R$)': market_cap, 'Capital Empregado (R$)': df_series['Capital Empregado'].iloc[-1], 
-        'Dívida Total (R$)': divida_total_ultimo_ano, 'NOPAT Médio (R$)': df_series['NOPAT'].tail(params['media_anos_calculo']).mean(), 
-        'ROIC (%)': hist_roic.iloc[-1] * 100, 'Beta': beta_hamada, 'Custo do Capital (WACC %)': wacc_medio * 100, 
-        'Spread (ROIC-WACC %)': (hist_roic.iloc[-1] - hist_wacc.iloc[-1]) * 100, 'EVA (R$)': hist_eva.iloc[-1], 'EFV (R$)': efv_ultimo,
-        'Crescimento Vendas (%)': df_series['Receita Liquida'].pct_change().iloc[-1] * 100 if len(df_series['Receita Liquida']) > 1 else 0,
-        'Margem de Lucro (%)': (df_series['Lucro Liquido'].iloc[-1] / df_series['Receita Liquida'].iloc[-1]) * 100 if df_series['Receita Liquida'].iloc[-1] != 0 else 0,
-        'Dívida/Patrimônio': divida_total_ultimo_ano / df_series['PL'].iloc[-1] if df_series['PL'].iloc[-1] > 0 else np.nan,
-        'Prazo Cobrança (dias)': (df_series['Contas a Receber'].iloc[-1] / df_series['Receita Liquida'].iloc[-1]) * 365 if df_series['Receita Liquida'].iloc[-1] != 0 else np.nan,
-        'Prazo Pagamento (dias)': (df_series['Fornecedores'].iloc[-1] / (df_series['EBIT'].iloc[-1] + df_series['Dep_Amort'].iloc[-1] - df_series['Lucro Liquido'].iloc[-1])) * 365 if (df_series['EBIT'].iloc[-1] + df_series['Dep_Amort'].iloc[-1] - df_series['Lucro Liquido'].iloc[-1]) != 0 else np.nan,
-        'Giro Estoques (vezes)': df_series['Receita Liquida'].iloc[-1] / df_series['Estoques'].iloc[-1] if df_series['Estoques'].iloc[-1] != 0 else np.nan,
-        'ke': ke, 'kd': df_series['Despesas Financeiras'].mean() / divida_total_ultimo_ano if divida_total_ultimo_ano > 0 else 0,
-        'hist_nopat': hist_nopat, 'hist_fco': hist_fco, 'hist_roic': hist_roic * 100, 'wacc_series': hist_wacc * 100,
-        'hist_riqueza_futura_percentual': hist_riqueza_futura_percentual, 'hist_riqueza_atual_percentual': hist_riqueza_atual_percentual,
-        'hist_efv_percentual': hist_efv_percentual, 'hist_eva_percentual': hist_eva_percentual
-    }
-    
-    return resultados, "Análise concluída com sucesso."
+def processar_valuation_empresa(ticker_sa, codigo_cvm, demonstrativos, market_data, params):
+    """
+    Executa a análise de valuation de uma única empresa, calculando EVA, EFV, WACC, etc.
+    A coleta (coletar_insumos_valuation) vem do cache; só o cálculo
+    (valuation.calcular_valuation) é refeito quando os parâmetros mudam.
+    """
+    (risk_free_rate, _, premio_risco_mercado, _) = market_data
+    insumos, mercado, beta_mercado, mensagem = coletar_insumos_valuation(ticker_sa, codigo_cvm, demonstrativos, market_data, params)
+    if insumos is None:
+        return None, mensagem
+    return calcular_valuation(insumos, mercado, beta_mercado, risk_free_rate, premio_risco_mercado, params)
 
 
 def executar_analise_completa(ticker_map, demonstrativos, market_data, params, progress_bar):
     """Executa a análise de valuation para todas as empresas da lista."""
     todos_os_resultados = []
     total_empresas = len(ticker_map)
+    # Dados de mercado de todos os tickers em paralelo; o laço abaixo já os encontra no cache
+    snapshot_mercado([f"{ticker}.SA" for ticker in ticker_map['TICKER']], progress_bar)
     for i, (index, row) in enumerate(ticker_map.iterrows()):
         ticker = row['TICKER']
         codigo_cvm = int(row['CD_CVM'])
@@ -1263,10 +1375,139 @@ def exibir_rankings(df_final):
             csv = convert_df_to_csv(df_sorted[colunas_view])
             st.download_button(label=f"📥 Baixar Ranking Completo (.csv)", data=csv, file_name=f'ranking_{nome_ranking.lower()}.csv', mime='text/csv',)
 
+PONTOS_GRADE_MERCADO = 15
+
+def bases_sensibilidade_mercado(ticker_map, demonstrativos, market_data, params, progress_bar):
+    """
+    Valores de base_sensibilidade de todas as empresas da lista (uma linha por ticker), a partir
+    da mesma coleta em cache do valuation: depois do ranking, não há nova consulta.
+    """
+    (risk_free_rate, _, premio_risco_mercado, _) = market_data
+    snapshot_mercado([f"{ticker}.SA" for ticker in ticker_map['TICKER']], progress_bar)
+    linhas = []
+    total_empresas = len(ticker_map)
+    for i, row in enumerate(ticker_map.itertuples(index=False)):
+        progress_bar.progress((i + 1) / total_empresas, text=f"Coletando {i+1}/{total_empresas}: {row.TICKER}")
+        try:
+            insumos, mercado, beta_mercado, _ = coletar_insumos_valuation(f"{row.TICKER}.SA", int(row.CD_CVM), demonstrativos, market_data, params)
+        except Exception:
+            continue
+        base = base_sensibilidade(insumos, mercado, beta_mercado, risk_free_rate, premio_risco_mercado, params) if insumos is not None else None
+        if base is not None:
+            linhas.append({'Ticker': row.TICKER, **base})
+    progress_bar.empty()
+    return pd.DataFrame(linhas)
+
+def figura_heatmap(z, x, y, titulo, titulo_x, titulo_y, titulo_escala, ponto=None, centro=0):
+    """Heatmap de uma grade de sensibilidade (linhas = eixo y), com a escala centrada em 'centro' e o cenário atual marcado."""
+    fig = go.Figure(go.Heatmap(z=z, x=x, y=y, colorscale='RdYlGn', zmid=centro, colorbar=dict(title=titulo_escala),
+                               hovertemplate=f"{titulo_x}: %{{x:.2f}}<br>{titulo_y}: %{{y:.2f}}<br>{titulo_escala}: %{{z:.1f}}<extra></extra>"))
+    if ponto is not None:
+        fig.add_trace(go.Scatter(x=[ponto[0]], y=[ponto[1]], mode='markers', name='Cenário atual',
+                                 marker=dict(symbol='x', size=12, color='white', line=dict(width=1, color='black'))))
+    fig.update_layout(title=titulo, xaxis_title=titulo_x, yaxis_title=titulo_y, template="plotly_dark",
+                      paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='var(--text-color)'))
+    return fig
+
+@st.fragment
+def painel_sensibilidade_valuation(ticker_sa, codigo_cvm, params):
+    """Grades crescimento x WACC e beta x prêmio e tornado do preço justo por EVA de um ativo."""
+    market_data = obter_dados_mercado(params['periodo_beta_ibov'])
+    insumos, mercado, beta_mercado, mensagem = coletar_insumos_valuation(ticker_sa, codigo_cvm, None, market_data, params)
+    base = base_sensibilidade(insumos, mercado, beta_mercado, market_data[0], market_data[2], params) if insumos is not None else None
+    if base is None:
+        st.warning(f"Sensibilidade indisponível: {mensagem}")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    pontos = col1.select_slider("Pontos por eixo", options=[25, 50, 100, 200], value=100, key="sens_pontos")
+    faixa_g = col1.slider("Crescimento na perpetuidade (%)", -2.0, 12.0, (0.0, 8.0), 0.5, key="sens_crescimento")
+    delta_wacc = col2.slider("WACC: variação em torno do atual (p.p.)", 1.0, 10.0, 5.0, 0.5, key="sens_wacc_delta")
+    delta_beta = col2.slider("Beta: variação em torno do atual", 0.1, 1.5, 0.75, 0.05, key="sens_beta_delta")
+    faixa_premio = col3.slider("Prêmio de risco de mercado (%)", -5.0, 15.0, (0.0, 10.0), 0.5, key="sens_premio")
+    variacao = col3.slider("Variação do tornado (%)", 5, 50, 20, 5, key="sens_tornado") / 100
+
+    crescimentos = np.linspace(faixa_g[0], faixa_g[1], pontos) / 100
+    waccs = np.linspace(max(base['wacc'] - delta_wacc / 100, 0.005), base['wacc'] + delta_wacc / 100, pontos)
+    betas = np.linspace(max(base['beta'] - delta_beta, 0.0), base['beta'] + delta_beta, pontos)
+    premios = np.linspace(faixa_premio[0], faixa_premio[1], pontos) / 100
+
+    preco_base = float(preco_justo_eva(base, base['crescimento'], base['wacc']))
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Preço Justo por EVA (cenário atual)", f"R$ {preco_base:.2f}" if np.isfinite(preco_base) else "N/A")
+    c2.metric("Margem sobre o Preço Atual", f"{margem_seguranca(base, preco_base):.1f}%" if np.isfinite(preco_base) else "N/A")
+    c3.metric("WACC / Beta atuais", f"{base['wacc']:.2%} / {base['beta']:.2f}")
+
+    col_g, col_b = st.columns(2)
+    with col_g:
+        st.plotly_chart(figura_heatmap(margem_seguranca(base, grade_crescimento_wacc(base, crescimentos, waccs)), waccs * 100, crescimentos * 100,
+                                       "Margem de Segurança: Crescimento x WACC", "WACC (%)", "Crescimento (%)", "Margem (%)",
+                                       (base['wacc'] * 100, base['crescimento'] * 100)), use_container_width=True)
+    with col_b:
+        st.plotly_chart(figura_heatmap(margem_seguranca(base, grade_beta_premio(base, betas, premios)), premios * 100, betas,
+                                       "Margem de Segurança: Beta x Prêmio de Risco", "Prêmio de Risco (%)", "Beta", "Margem (%)",
+                                       (base['premio'] * 100, base['beta'])), use_container_width=True)
+
+    barras = tornado(base, variacao)
+    fig = go.Figure()
+    fig.add_trace(go.Bar(y=barras.index, x=barras['Redução'] - preco_base, base=preco_base, orientation='h', name=f'-{variacao:.0%}', marker_color='#E94560'))
+    fig.add_trace(go.Bar(y=barras.index, x=barras['Aumento'] - preco_base, base=preco_base, orientation='h', name=f'+{variacao:.0%}', marker_color='#00FF87'))
+    fig.update_layout(title=f"Tornado do Preço Justo (cada variável ±{variacao:.0%})", barmode='overlay', xaxis_title="Preço Justo (R$)",
+                      yaxis=dict(autorange='reversed'), template="plotly_dark", paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='var(--text-color)'))
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption("Preço justo por EVA na perpetuidade: (Capital Empregado + EVA x (1 + g) / (WACC - g) - Dívida) / ações, com EVA = NOPAT - WACC x Capital Empregado. "
+               "Combinações com WACC <= g ficam em branco. As grades usam os dados já coletados na análise, sem nova consulta.")
+
+@st.fragment
+def painel_sensibilidade_mercado(ticker_cvm_map_df):
+    """Grades grosseiras de sensibilidade da margem de segurança de todo o mercado."""
+    st.subheader("🎯 Sensibilidade do Mercado")
+    st.caption("Margem de segurança por EVA de todas as empresas numa grade de crescimento x deslocamento do WACC e de deslocamento do beta x prêmio de risco. Depois do ranking, a coleta já está em cache.")
+    if st.button("Calcular Sensibilidade do Mercado", use_container_width=True, key="sens_mercado_calcular"):
+        params = {'taxa_crescimento_perpetuidade': CONFIG["TAXA_CRESCIMENTO_PERPETUIDADE"], 'media_anos_calculo': CONFIG["MEDIA_ANOS_CALCULO"], 'periodo_beta_ibov': CONFIG["PERIODO_BETA_IBOV"]}
+        demonstrativos = preparar_dados_cvm(CONFIG["HISTORICO_ANOS_CVM"])
+        market_data = obter_dados_mercado(params['periodo_beta_ibov'])
+        progress_bar = st.progress(0, text="Coletando dados das empresas...")
+        st.session_state['sens_mercado_bases'] = bases_sensibilidade_mercado(ticker_cvm_map_df, demonstrativos, market_data, params, progress_bar)
+
+    bases = st.session_state.get('sens_mercado_bases')
+    if bases is None:
+        return
+    if bases.empty:
+        st.warning("Nenhuma empresa com dados suficientes para a sensibilidade.")
+        return
+
+    col1, col2 = st.columns(2)
+    faixa_g = col1.slider("Crescimento na perpetuidade (%)", -2.0, 12.0, (0.0, 8.0), 0.5, key="sens_mercado_crescimento")
+    delta_wacc = col1.slider("Deslocamento máximo do WACC (p.p.)", 1.0, 10.0, 4.0, 0.5, key="sens_mercado_wacc_delta")
+    delta_beta = col2.slider("Deslocamento máximo do beta", 0.1, 1.5, 0.5, 0.05, key="sens_mercado_beta_delta")
+    faixa_premio = col2.slider("Prêmio de risco de mercado (%)", -5.0, 15.0, (0.0, 10.0), 0.5, key="sens_mercado_premio")
+
+    n = PONTOS_GRADE_MERCADO
+    crescimentos = np.linspace(faixa_g[0], faixa_g[1], n) / 100
+    deslocamentos_wacc = np.linspace(-delta_wacc, delta_wacc, n) / 100
+    deslocamentos_beta = np.linspace(-delta_beta, delta_beta, n)
+    premios = np.linspace(faixa_premio[0], faixa_premio[1], n) / 100
+
+    grades = {
+        'wacc': (grade_mercado(bases, crescimentos, deslocamentos_wacc), deslocamentos_wacc * 100, crescimentos * 100, "Deslocamento do WACC (p.p.)", "Crescimento (%)"),
+        'beta': (grade_mercado(bases, None, None, deslocamentos_beta, premios), premios * 100, deslocamentos_beta, "Prêmio de Risco (%)", "Deslocamento do Beta"),
+    }
+    st.metric("Empresas na grade", len(bases))
+    for margens, x, y, titulo_x, titulo_y in grades.values():
+        validas = ~np.isnan(margens)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)  # células sem nenhuma empresa válida
+            mediana = np.nanmedian(margens, axis=0)
+        descontadas = np.where(validas.any(axis=0), (margens > 0).sum(axis=0) / np.maximum(validas.sum(axis=0), 1) * 100, np.nan)
+        col_a, col_b = st.columns(2)
+        col_a.plotly_chart(figura_heatmap(mediana, x, y, f"Margem Mediana: {titulo_y} x {titulo_x}", titulo_x, titulo_y, "Margem (%)"), use_container_width=True)
+        col_b.plotly_chart(figura_heatmap(descontadas, x, y, f"Empresas Descontadas: {titulo_y} x {titulo_x}", titulo_x, titulo_y, "% com margem > 0", centro=50), use_container_width=True)
+
 def ui_valuation():
     """Renderiza a interface completa da aba de Valuation."""
     st.header("Análise de Valuation e Scanner de Mercado")
-    tab_individual, tab_ranking = st.tabs(["Análise de Ativo Individual", "🔍 Scanner de Mercado (Ranking)"])
+    tab_individual, tab_ranking, tab_beta = st.tabs(["Análise de Ativo Individual", "🔍 Scanner de Mercado (Ranking)", "📉 Deriva de Beta"])
     
     ticker_cvm_map_df = carregar_mapeamento_ticker_cvm()
     if ticker_cvm_map_df.empty:
@@ -1291,7 +1532,6 @@ def ui_valuation():
                 p_periodo_beta = st.selectbox("Período para Cálculo do Beta", options=["1y", "2y", "5y", "10y"], index=2, key="beta_individual")
         
         if analisar_btn:
-            demonstrativos = preparar_dados_cvm(CONFIG["HISTORICO_ANOS_CVM"])
             market_data = obter_dados_mercado(p_periodo_beta)
             ticker_sa = f"{ticker_selecionado}.SA"
             codigo_cvm_info = ticker_cvm_map_df[ticker_cvm_map_df['TICKER'] == ticker_selecionado]
@@ -1309,7 +1549,8 @@ def ui_valuation():
             }
 
             with st.spinner(f"Analisando {ticker_selecionado}..."):
-                resultados, status_msg = processar_valuation_empresa(ticker_sa, codigo_cvm, demonstrativos, market_data, params_analise)
+                # Coleta em cache: mudar só os parâmetros refaz apenas o cálculo
+                resultados, status_msg = processar_valuation_empresa(ticker_sa, codigo_cvm, None, market_data, params_analise)
                 
             if resultados:
                 st.success(f"Análise para **{resultados['Empresa']} ({resultados['Ticker']})** concluída!")
@@ -1408,6 +1649,13 @@ def ui_valuation():
                     with col_inv:
                         st.markdown("**Estratégias de Investimento**")
                         st.table(pd.DataFrame.from_dict(direcionadores_investimento, orient='index', columns=['Valor']))
+
+                with st.expander("📉 Beta e Correlação Móveis (vs. Ibovespa)", expanded=False):
+                    # O Ibovespa é o de obter_dados_mercado com o período padrão (5 anos, em cache), longo o bastante para 36 meses
+                    exibir_betas_moveis(ticker_sa, obter_dados_mercado(CONFIG["PERIODO_BETA_IBOV"])[3])
+
+                with st.expander("🎯 Sensibilidade do Preço Justo", expanded=False):
+                    painel_sensibilidade_valuation(ticker_sa, codigo_cvm, params_analise)
             else:
                 st.error(f"Não foi possível analisar {ticker_selecionado}. Motivo: {status_msg}")
 
@@ -1426,158 +1674,84 @@ def ui_valuation():
                 exibir_rankings(df_final)
             else:
                 st.error("A análise em lote não retornou nenhum resultado válido.")
+        st.divider()
+        painel_sensibilidade_mercado(ticker_cvm_map_df)
+
+    with tab_beta:
+        painel_deriva_beta(ticker_cvm_map_df)
+
+@st.fragment
+def painel_deriva_beta(ticker_cvm_map_df):
+    """Relatório de deriva do beta de todo o mercado: betas móveis atuais e variação em 12 meses."""
+    st.info("Beta e correlação móveis de 12, 24 e 36 meses contra o Ibovespa para todas as empresas, calculados de uma vez a partir dos preços diários em lote. A variação compara o beta de 12 meses atual com o de 12 meses atrás.")
+    if st.button("Calcular Deriva de Beta do Mercado", type="primary", use_container_width=True, key="deriva_beta_calcular"):
+        tickers_sa = tuple(sorted(f"{ticker}.SA" for ticker in ticker_cvm_map_df['TICKER'].unique()))
+        with st.spinner(f"Calculando betas móveis de {len(tickers_sa)} ativos..."):
+            precos = baixar_precos_lote(tickers_sa, period=PERIODO_HISTORICO_DIARIO, interval="1d")
+            market_data = obter_dados_mercado(CONFIG["PERIODO_BETA_IBOV"])
+            fechamentos = pd.DataFrame({ticker: df['close'] for ticker, df in precos.items()}).sort_index()
+            moveis = calcular_betas_moveis(fechamentos, market_data[3]) if not fechamentos.empty else None
+        if moveis is None:
+            st.error("Não foi possível obter os preços dos ativos ou a série do Ibovespa.")
+            return
+        relatorio = relatorio_deriva_beta(moveis)
+        empresas = ticker_cvm_map_df.drop_duplicates('TICKER').set_index('TICKER')['Nome_Empresa']
+        relatorio.index = relatorio.index.str.replace(".SA", "", regex=False)
+        relatorio.insert(0, 'Empresa', relatorio.index.map(empresas))
+        st.session_state['deriva_beta'] = (relatorio.rename_axis('Ticker').reset_index(), moveis)
+
+    if 'deriva_beta' not in st.session_state:
+        return
+    relatorio, moveis = st.session_state['deriva_beta']
+    variacao = relatorio['Variação Beta 12m']
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Beta 12m Mediano", f"{relatorio['Beta 12m'].median():.2f}")
+    col2.metric("Betas em Alta (> +0,2)", int((variacao > 0.2).sum()))
+    col3.metric("Betas em Queda (< -0,2)", int((variacao < -0.2).sum()))
+    st.dataframe(relatorio, use_container_width=True, hide_index=True,
+                 column_config={col: st.column_config.NumberColumn(format="%.2f") for col in relatorio.columns if col not in ('Ticker', 'Empresa')})
+    st.download_button(label="📥 Baixar Relatório de Beta (.csv)", data=convert_df_to_csv(relatorio), file_name='deriva_beta.csv', mime='text/csv')
+
+    ticker = st.selectbox("Ver o histórico do beta de", relatorio['Ticker'], key="deriva_beta_ticker")
+    fig = go.Figure()
+    for janela, cor in zip(moveis, ('#00F6FF', '#F2A30F', '#E94560')):
+        serie = moveis[janela]['beta'][f"{ticker}.SA"].dropna()
+        fig.add_trace(go.Scatter(x=serie.index, y=serie.values, mode='lines', name=f'Beta {janela} meses', line=dict(color=cor, width=2)))
+    fig.update_layout(title=f'Beta Móvel de {ticker} vs. Ibovespa', template="plotly_dark", paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='var(--text-color)'))
+    st.plotly_chart(fig, use_container_width=True)
 
 # ==============================================================================
 # ABA 3: MODELO FLEURIET (SEÇÃO CORRIGIDA E ATUALIZADA)
 # ==============================================================================
 
-def reclassificar_contas_fleuriet(df_bpa_empresa, df_bpp_empresa, contas_cvm):
-    """
-    Reclassifica as contas do balanço para o formato do Modelo Fleuriet.
-    Isso é crucial para garantir que cada empresa tenha seus próprios valores.
-    """
-    try:
-        # Ativo Circulante Operacional (ACO) = Contas a Receber + Estoques
-        contas_a_receber = obter_historico_metrica(df_bpa_empresa, contas_cvm['CONTAS_A_RECEBER'])
-        estoques = obter_historico_metrica(df_bpa_empresa, contas_cvm['ESTOQUES'])
-        aco = contas_a_receber.add(estoques, fill_value=0)
-
-        # Passivo Circulante Operacional (PCO) = Fornecedores
-        pco = obter_historico_metrica(df_bpp_empresa, contas_cvm['FORNECEDORES'])
-
-        # Ativo Permanente (AP) = Ativo Não Circulante
-        ap = obter_historico_metrica(df_bpa_empresa, contas_cvm['ATIVO_NAO_CIRCULANTE'])
-
-        # Passivo Não Circulante (PNC)
-        pnc = obter_historico_metrica(df_bpp_empresa, contas_cvm['PASSIVO_NAO_CIRCULANTE'])
-
-        # Patrimônio Líquido (PL)
-        pl = obter_historico_metrica(df_bpp_empresa, contas_cvm['PATRIMONIO_LIQUIDO'])
-
-        return aco, pco, ap, pl, pnc
-    except Exception:
-        # Retorna Series vazias em caso de erro para que a empresa seja pulada
-        return pd.Series(dtype=float), pd.Series(dtype=float), pd.Series(dtype=float), pd.Series(dtype=float), pd.Series(dtype=float)
-
-
-def classificar_fleuriet(cdg, ncg, t):
-    """
-    Classifica a empresa em um dos 6 tipos do modelo Fleuriet, conforme a documentação.
-    """
-    if cdg > 0 and ncg < 0 and t > 0:
-        return "Tipo 1 (Excelente Liquidez)"
-    if cdg > 0 and ncg > 0 and t > 0:
-        return "Tipo 2 (Sólida e Comum)"
-    if cdg > 0 and ncg > 0 and t < 0:
-        return "Tipo 3 (Risco de Liquidez)"
-    if cdg < 0 and ncg > 0 and t < 0:
-        return "Tipo 4 (Alto Risco Financeiro)"
-    if cdg < 0 and ncg < 0 and t < 0:
-        return "Tipo 5 (Vulnerável a Fornecedores)"
-    if cdg < 0 and ncg < 0 and t > 0:
-        return "Tipo 6 (Incomum, NCG financia PNC)"
-    return "Indefinido"
-
-
-def processar_analise_fleuriet(ticker_sa, codigo_cvm, demonstrativos):
-    """
-    Processa a análise de saúde financeira pelos modelos Fleuriet e Z-Score de Prado.
-    Esta função foi robustecida para evitar erros e garantir cálculos corretos.
-    """
-    try:
-        C = CONFIG['CONTAS_CVM']
-        bpa = demonstrativos.get('bpa', pd.DataFrame())
-        bpp = demonstrativos.get('bpp', pd.DataFrame())
-        dre = demonstrativos.get('dre', pd.DataFrame())
-
-        empresa_bpa = bpa[bpa['CD_CVM'] == codigo_cvm] if not bpa.empty else pd.DataFrame()
-        empresa_bpp = bpp[bpp['CD_CVM'] == codigo_cvm] if not bpp.empty else pd.DataFrame()
-        empresa_dre = dre[dre['CD_CVM'] == codigo_cvm] if not dre.empty else pd.DataFrame()
-        
-        if any(df.empty for df in [empresa_bpa, empresa_bpp, empresa_dre]):
-            return None # Pula a empresa se dados essenciais faltam
-
-        # Utiliza a nova função para garantir a reclassificação correta por empresa
-        aco, pco, ap, pl, pnc = reclassificar_contas_fleuriet(empresa_bpa, empresa_bpp, C)
-        
-        if any(s.empty for s in [aco, pco, ap, pl, pnc]):
-            return None # Pula se a reclassificação falhar
-
-        # Cálculos do Modelo Fleuriet
-        ncg = aco.subtract(pco, fill_value=0)
-        cdg = pl.add(pnc, fill_value=0).subtract(ap, fill_value=0)
-        t = cdg.subtract(ncg, fill_value=0)
-        
-        if any(s.empty for s in [t, ncg, cdg]):
-            return None # Pula se os cálculos principais falharem
-
-        # Verificação do Efeito Tesoura
-        efeito_tesoura = False
-        if len(ncg) > 1 and len(cdg) > 1:
-            # fillna(0) previne erros com valores NaN
-            cresc_ncg = ncg.pct_change().iloc[-1]
-            cresc_cdg = cdg.pct_change().iloc[-1]
-            if pd.notna(cresc_ncg) and pd.notna(cresc_cdg) and cresc_ncg > cresc_cdg and t.iloc[-1] < 0:
-                efeito_tesoura = True
-        
-        # Bloco de busca de dados de mercado para o Z-Score
-        info = yf.Ticker(ticker_sa).info
-        market_cap = info.get('marketCap')
-        if not market_cap: # Se não encontrar market cap, não pode calcular Z-Score
-            return None
-        
-        ativo_total_hist = obter_historico_metrica(empresa_bpa, C['ATIVO_TOTAL'])
-        passivo_total_hist = obter_historico_metrica(empresa_bpp, C['PASSIVO_TOTAL'])
-        ebit_hist = obter_historico_metrica(empresa_dre, C['EBIT'])
-        vendas_hist = obter_historico_metrica(empresa_dre, C['RECEITA_LIQUIDA'])
-
-        # Garante que temos todos os dados para o Z-Score
-        if any(s.empty for s in [ativo_total_hist, passivo_total_hist, ebit_hist, vendas_hist, pl]):
-            return None
-
-        # Pega o último valor de cada série
-        ativo_total = ativo_total_hist.iloc[-1]
-        passivo_total = passivo_total_hist.iloc[-1]
-        ebit = ebit_hist.iloc[-1]
-        vendas = vendas_hist.iloc[-1]
-        lucro_retido = pl.iloc[-1] - pl.iloc[0] if len(pl) > 1 else 0
-        
-        # Evita divisão por zero
-        if ativo_total == 0 or passivo_total == 0:
-            return None
-            
-        # Variáveis do Z-Score de Prado
-        X1 = cdg.iloc[-1] / ativo_total
-        X2 = lucro_retido / ativo_total
-        X3 = ebit / ativo_total
-        X4 = market_cap / passivo_total
-        X5 = vendas / ativo_total
-        
-        z_score = 0.038*X1 + 1.253*X2 + 2.331*X3 + 0.511*X4 + 0.824*X5
-        
-        if z_score < 1.81: classificacao = "Risco Elevado"
-        elif z_score < 2.99: classificacao = "Zona Cinzenta"
-        else: classificacao = "Saudável"
-            
-        # Classificação final do balanço
-        tipo_fleuriet = classificar_fleuriet(cdg.iloc[-1], ncg.iloc[-1], t.iloc[-1])
-
-        return {
-            'Ticker': ticker_sa.replace('.SA', ''), 
-            'Empresa': info.get('longName', ticker_sa), 
-            'Ano': t.index[-1], 
-            'NCG': ncg.iloc[-1], 
-            'CDG': cdg.iloc[-1], 
-            'Tesouraria': t.iloc[-1], 
-            'Tipo Fleuriet': tipo_fleuriet, # Nova coluna
-            'Efeito Tesoura': efeito_tesoura, 
-            'Z-Score': z_score, 
-            'Classificação Risco': classificacao
-        }
-
-    except Exception:
-        # Se qualquer parte do processo falhar, retorna None para não quebrar a análise em lote.
-        return None
+def exibir_historico_fleuriet(historico, tabela):
+    """Migrações entre tipos de balanço e inícios do efeito tesoura ao longo dos anos carregados."""
+    empresas = tabela.groupby('CD_CVM').agg(Ticker=('Ticker', ' / '.join), Empresa=('Empresa', 'first'))
+    com_nomes = lambda df: empresas.join(df.set_index('CD_CVM'), how='inner').reset_index(drop=True)
+    transicoes = com_nomes(historico.transicoes()).sort_values(['Ano', 'Ticker'], ascending=[False, True])
+    inicios = com_nomes(historico.inicios_tesoura()).sort_values(['Ano', 'Ticker'], ascending=[False, True])
+
+    st.subheader(f"Histórico Fleuriet {historico.anos.min()}–{historico.anos.max()}")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Empresas que mudaram de tipo", f"{transicoes['Ticker'].nunique()}")
+    col2.metric("Migrações de tipo", f"{len(transicoes)}")
+    col3.metric("Inícios de efeito tesoura", f"{len(inicios)}")
+
+    st.markdown("**Matriz de migração** (tipo no ano anterior × tipo no ano seguinte, somando todas as empresas)")
+    st.dataframe(historico.matriz_transicoes(), use_container_width=True)
+    st.markdown("**Migrações por empresa**")
+    st.dataframe(transicoes, use_container_width=True, hide_index=True,
+                 column_config={col: st.column_config.NumberColumn(format="%.2f") for col in ('Z-Score Anterior', 'Z-Score')})
+    st.markdown("**Início do efeito tesoura** (NCG crescendo mais que o CDG com tesouraria negativa, ausente no ano anterior)")
+    st.dataframe(inicios, use_container_width=True, hide_index=True,
+                 column_config={'Z-Score': st.column_config.NumberColumn(format="%.2f")})
+    st.caption("O Z-Score de cada ano usa o valor de mercado atual no X4, o único disponível.")
+    st.download_button(
+        label="📥 Baixar Histórico Anual (.csv)",
+        data=convert_df_to_csv(com_nomes(historico.longo())),
+        file_name='analise_fleuriet_historico.csv',
+        mime='text/csv',
+    )
 
 def ui_modelo_fleuriet():
     """Renderiza a interface completa da aba do Modelo Fleuriet."""
@@ -1586,6 +1760,7 @@ def ui_modelo_fleuriet():
     Esta análise utiliza os dados da CVM para avaliar a estrutura de capital de giro e o risco de insolvência das empresas.
     **Nota:** O número de empresas processadas com sucesso pode ser menor que o total, pois empresas sem dados financeiros completos ou sem capitalização de mercado são descartadas.
     """)
+    incluir_historico = st.checkbox("Incluir histórico anual (migrações de tipo e início do efeito tesoura)", key="fleuriet_historico")
     
     if st.button("🚀 Iniciar Análise Fleuriet Completa", type="primary", use_container_width=True):
         ticker_cvm_map_df = carregar_mapeamento_ticker_cvm()
@@ -1595,23 +1770,31 @@ def ui_modelo_fleuriet():
             st.error("Não foi possível baixar os dados da CVM. A análise não pode continuar.")
             st.stop()
 
-        resultados_fleuriet = []
-        progress_bar = st.progress(0, text="Iniciando análise Fleuriet...")
+        # Fase de cálculo: todas as empresas e anos de uma vez, antes de qualquer consulta ao mercado
         total_empresas = len(ticker_cvm_map_df)
-        
-        for i, (index, row) in enumerate(ticker_cvm_map_df.iterrows()):
-            ticker = row['TICKER']
-            progress_bar.progress((i + 1) / total_empresas, text=f"Analisando {i+1}/{total_empresas}: {ticker}")
-            # A função de processamento agora é mais robusta
-            resultado = processar_analise_fleuriet(f"{ticker}.SA", int(row['CD_CVM']), demonstrativos)
-            if resultado:
-                resultados_fleuriet.append(resultado)
-                
+        inicio = datetime.now()
+        painel = PainelContabil(demonstrativos, CONFIG['CONTAS_CVM'], ticker_cvm_map_df['CD_CVM'].astype(int))
+        series = calcular_fleuriet(painel)
+        resumo = resumo_fleuriet(painel, series)
+        duracao_calculo = (datetime.now() - inicio).total_seconds()
+
+        # Só as empresas com o balanço completo precisam do valor de mercado (X4 do Z-Score)
+        candidatos = ticker_cvm_map_df[ticker_cvm_map_df['CD_CVM'].isin(resumo.index)]
+        progress_bar = st.progress(0, text="Buscando valor de mercado...")
+        infos = snapshot_mercado([f"{ticker}.SA" for ticker in candidatos['TICKER']], progress_bar)
+        mercado = []
+        for row in candidatos.itertuples(index=False):
+            info = infos.get(f"{row.TICKER}.SA", {})
+            if info.get('marketCap'):  # Sem market cap não há Z-Score
+                mercado.append({'Ticker': row.TICKER, 'CD_CVM': int(row.CD_CVM), 'Empresa': info.get('longName', f"{row.TICKER}.SA"), 'Market Cap': info['marketCap']})
         progress_bar.empty()
-        
-        if resultados_fleuriet:
-            df_fleuriet = pd.DataFrame(resultados_fleuriet)
+
+        if mercado:
+            tabela = pd.DataFrame(mercado).join(resumo, on='CD_CVM')
+            df_fleuriet = aplicar_zscore(tabela, tabela['Market Cap'])[
+                ['Ticker', 'Empresa', 'Ano', 'NCG', 'CDG', 'Tesouraria', 'Tipo Fleuriet', 'Efeito Tesoura', 'Z-Score', 'Classificação Risco']]
             st.success(f"Análise Fleuriet concluída para {len(df_fleuriet)} de {total_empresas} empresas.")
+            st.caption(f"Modelo calculado para {len(painel.empresas)} empresas x {len(painel.anos)} anos em {duracao_calculo:.2f} s.")
             
             ncg_medio = df_fleuriet['NCG'].mean()
             tesoura_count = df_fleuriet['Efeito Tesoura'].sum()
@@ -1635,6 +1818,11 @@ def ui_modelo_fleuriet():
                 file_name='analise_fleuriet_completa.csv',
                 mime='text/csv',
             )
+
+            if incluir_historico:
+                # Mesmas séries do resumo; uma empresa com várias classes de ação usa o valor de mercado da primeira
+                market_cap = tabela.drop_duplicates('CD_CVM').set_index('CD_CVM')['Market Cap']
+                exibir_historico_fleuriet(HistoricoFleuriet(painel, series, market_cap), tabela)
             
         else:
             st.error("Nenhum resultado pôde ser gerado para a análise Fleuriet. Verifique a conexão e os dados da CVM.")
@@ -1664,209 +1852,240 @@ def ui_modelo_fleuriet():
 def calcular_volatilidade_historica(ticker, periodo="1y"):
     """Calcula a volatilidade histórica anualizada de um ativo."""
     try:
-        dados = get_stock_data(ticker, period=periodo)
+        dados = recortar_periodo(historico_diario(ticker), periodo)
         if dados is None or dados.empty:
             return None
-        dados['log_retorno'] = np.log(dados['close'] / dados['close'].shift(1))
+        log_retorno = np.log(dados['close'] / dados['close'].shift(1))
         # 252 dias de pregão em um ano
-        volatilidade_anualizada = dados['log_retorno'].std() * np.sqrt(252)
+        volatilidade_anualizada = log_retorno.std() * np.sqrt(252)
         return volatilidade_anualizada
-    except (RetryError, Exception):
+    except Exception:
         return None
 
+@st.cache_data(show_spinner=False)
+def estimar_volatilidades_ativo(ticker, dias_uteis):
+    """
+    Volatilidade do ativo por todos os estimadores de volatilidade.ESTIMADORES, a partir da
+    série diária em cache. Os estimadores de janela usam o último ano (o close-to-close é o de
+    calcular_volatilidade_historica); o GARCH(1,1) usa até 4 anos e prevê a vol média até o
+    vencimento ('dias_uteis' pregões). Devolve None sem dados.
+    """
+    df = historico_diario(ticker)
+    if df is None or df.empty:
+        return None
+    barras_ano = len(recortar_periodo(df, "1y"))
+    estimativas = estimar_volatilidades(painel_ohlc({ticker: df}), janela=max(barras_ano - 1, 2), dias_garch=dias_uteis)
+    resultado = estimativas.loc[ticker]
+    resultado.attrs['garch'] = estimativas.attrs['garch'].loc[ticker]
+    return resultado
+
+# Erros de uma resposta malformada ao montar a cadeia: falham só aquele vencimento
+ERROS_CADEIA_OPCOES = (KeyError, IndexError, ValueError, TypeError, AttributeError)
+
+def _buscar_cadeia_opcoes(sessao, ticker, vencimento):
+    """
+    Baixa a cadeia de opções de um vencimento usando a sessão HTTP informada.
+    Levanta requests.exceptions.RequestException em caso de falha de rede e ERROS_CADEIA_OPCOES
+    quando a resposta vem malformada (linha incompleta, valor não numérico).
+    """
+    url = f'https://opcoes.net.br/listaopcoes/completa?idAcao={ticker}&listarVencimentos=false&cotacoes=true&vencimentos={vencimento}'
+    response = sessao.get(url, timeout=20)
+    response.raise_for_status()
+    dados = response.json()
+    if 'data' in dados and 'cotacoesOpcoes' in dados['data']:
+        opcoes = [[ticker, vencimento, i[0].split('_')[0], i[2], i[3], i[5], i[8]] for i in dados['data']['cotacoesOpcoes']]
+        df = pd.DataFrame(opcoes, columns=['ativo_obj', 'vencimento', 'ticker', 'tipo', 'modelo', 'strike', 'preco_mercado'])
+        df['strike'] = pd.to_numeric(df['strike'])
+        df['preco_mercado'] = pd.to_numeric(df['preco_mercado'])
+        return df
+    return pd.DataFrame()
+
 @st.cache_data
 def buscar_opcoes(ticker, vencimento):
     """Busca a cadeia de opções para um ticker e vencimento específicos."""
     try:
-        url = f'https://opcoes.net.br/listaopcoes/completa?idAcao={ticker}&listarVencimentos=false&cotacoes=true&vencimentos={vencimento}'
-        response = requests_retry_session().get(url, timeout=20)
-        response.raise_for_status()
-        dados = response.json()
-        if 'data' in dados and 'cotacoesOpcoes' in dados['data']:
-            opcoes = [[ticker, vencimento, i[0].split('_')[0], i[2], i[3], i[5], i[8]] for i in dados['data']['cotacoesOpcoes']]
-            df = pd.DataFrame(opcoes, columns=['ativo_obj', 'vencimento', 'ticker', 'tipo', 'modelo', 'strike', 'preco_mercado'])
-            df['strike'] = pd.to_numeric(df['strike'])
-            df['preco_mercado'] = pd.to_numeric(df['preco_mercado'])
-            return df
-        else:
-            return pd.DataFrame()
-    except (RetryError, requests.exceptions.RequestException) as e:
+        return _buscar_cadeia_opcoes(requests_retry_session(), ticker, vencimento)
+    except requests.exceptions.RequestException as e:
         st.error(f"Erro ao buscar dados de opções: {e}")
         return pd.DataFrame()
 
-def black_scholes(S, K, T, r, sigma, option_type="call"):
-    """Calcula o preço de uma opção usando o modelo Black-Scholes."""
-    if T <= 0 or sigma <= 0: return 0
-    d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
-    d2 = d1 - sigma * np.sqrt(T)
-    if option_type.lower() == "call":
-        return S * norm.cdf(d1) - K * np.exp(-r * T) * norm.cdf(d2)
-    elif option_type.lower() == "put":
-        return K * np.exp(-r * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
-    return 0
-
-def calcular_greeks(S, K, T, r, sigma, option_type="call"):
-    """Calcula as Greeks de uma opção."""
-    greeks = {'delta': 0, 'gamma': 0, 'vega': 0, 'theta': 0, 'rho': 0}
-    if T <= 0 or sigma <= 0: return greeks
-    
-    d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
-    d2 = d1 - sigma * np.sqrt(T)
-    
-    greeks['gamma'] = norm.pdf(d1) / (S * sigma * np.sqrt(T))
-    greeks['vega'] = S * norm.pdf(d1) * np.sqrt(T) / 100 # Dividido por 100 para representar a mudança por 1% na vol
-    
-    if option_type.lower() == "call":
-        greeks['delta'] = norm.cdf(d1)
-        greeks['theta'] = (-S * norm.pdf(d1) * sigma / (2 * np.sqrt(T)) - r * K * np.exp(-r * T) * norm.cdf(d2)) / 365
-        greeks['rho'] = K * T * np.exp(-r * T) * norm.cdf(d2) / 100
-    elif option_type.lower() == "put":
-        greeks['delta'] = norm.cdf(d1) - 1
-        greeks['theta'] = (-S * norm.pdf(d1) * sigma / (2 * np.sqrt(T)) + r * K * np.exp(-r * T) * norm.cdf(-d2)) / 365
-        greeks['rho'] = -K * T * np.exp(-r * T) * norm.cdf(-d2) / 100
-        
-    return greeks
+@st.cache_data(ttl=300, show_spinner=False)
+def buscar_superficie_volatilidade(ticker, preco_atual, taxa_juros, n_vencimentos=6):
+    """
+    Busca em paralelo as cadeias dos próximos vencimentos mensais (terceiras sextas) e monta a
+    superfície de volatilidade implícita. Todas as requisições compartilham uma sessão HTTP (e o
+    pool de conexões dela). O resultado fica em cache por 5 minutos, já que as cotações mudam.
+    Devolve (opções com vol implícita, grade strike × vencimento, vencimentos que falharam).
+    """
+    vencimentos = [v.strftime('%Y-%m-%d') for v in terceiras_sextas(date.today(), n_vencimentos)]
+    sessao = requests_retry_session()
+    cadeias, falhas = [], []
+    with ThreadPoolExecutor(max_workers=min(8, len(vencimentos))) as executor:
+        futuros = {executor.submit(_buscar_cadeia_opcoes, sessao, ticker, vencimento): vencimento for vencimento in vencimentos}
+        for futuro in as_completed(futuros):
+            try:
+                cadeia = futuro.result()
+                if not cadeia.empty:
+                    cadeias.append(cadeia)
+            except (requests.exceptions.RequestException, *ERROS_CADEIA_OPCOES):
+                falhas.append(futuros[futuro])
+    if not cadeias:
+        return pd.DataFrame(), pd.DataFrame(), sorted(falhas)
+    opcoes_superficie, grade = montar_superficie(pd.concat(cadeias, ignore_index=True), preco_atual, taxa_juros, date.today())
+    return opcoes_superficie, grade, sorted(falhas)
+
+# Mínimo de barras exigido (o indicador com maior período é o BBands(20))
+MIN_BARRAS_INDICADORES = 20
+PESOS_SINAIS_TECNICOS = {'RSI': 0.20, 'MACD': 0.20, 'BOLLINGER': 0.15, 'EMA': 0.15, 'ADX': 0.10, 'STOCH': 0.08, 'SAR': 0.07}
+
+def _barras_timeframe(df_diario, timeframe):
+    """
+    Barras de cada timeframe, sobre toda a série diária (5 anos): semanais reamostradas ou as
+    próprias diárias. A série não é recortada em uma janela fixa, que avançaria a cada pregão e
+    obrigaria o motor incremental a recomeçar do zero.
+    """
+    if timeframe == 'weekly':
+        return reamostrar_barras(df_diario, 'weekly')
+    return df_diario
 
-@st.cache_data
-def analise_tecnica_ativo(ticker, timeframe='daily', weekly_bias=0, thresholds=None):
+def _dados_analise_tecnica(ticker, timeframe):
+    """Série de preços usada pela análise técnica em cada timeframe (derivada da série diária)."""
+    return _barras_timeframe(historico_diario(ticker), timeframe)
+
+@st.cache_resource
+def motor_indicadores():
+    """Estado incremental dos indicadores por ativo/timeframe, compartilhado entre as sessões."""
+    return MotorIndicadores()
+
+def _chave_ultima_barra(df_diario):
+    """Data e máxima/mínima/fechamento do último pregão diário: mudam também com a cotação intradiária."""
+    ultima = df_diario.iloc[-1]
+    return str(df_diario.index[-1]), float(ultima['high']), float(ultima['low']), float(ultima['close'])
+
+@st.cache_data(show_spinner=False)
+def calcular_indicadores_tecnicos(ticker, timeframe, ultima_barra):
     """
-    Realiza a análise técnica completa e retorna um score de convergência.
-    Versão robustecida para evitar KeyErrors e lidar com dados insuficientes.
+    Etapa cara da análise técnica: atualiza os indicadores incrementais do ativo (só as barras
+    ainda não processadas) e devolve as leituras da última barra (chaves de
+    indicadores.COLUNAS_PANDAS_TA) e as últimas 10 linhas para depuração.
+
+    O cache é indexado por ticker, timeframe e pelos valores do último pregão diário
+    (_chave_ultima_barra): um novo pregão processa a barra nova, e uma cotação intradiária que
+    altere o pregão em andamento (ou a semana em andamento, na semanal) revisa só a última barra
+    no motor. Limiares e pesos ficam em pontuar_sinais_tecnicos.
+    """
+    df = _dados_analise_tecnica(ticker, timeframe)
+    leituras, raw_data = motor_indicadores().atualizar((ticker, timeframe), df, recentes=True)
+    raw_data.index = df.index[-len(raw_data):]
+    raw_data_cols = ['close', 'RSI_14', 'MACD_12_26_9', 'MACDs_12_26_9', 'BBL_20_2.0', 'BBU_20_2.0', 'EMA_9', 'EMA_21']
+    return leituras, raw_data[raw_data_cols]
+
+def pontuar_sinais_tecnicos(leituras, timeframe='daily', weekly_bias=0, thresholds=None, raw_data=None):
+    """
+    Etapa barata da análise técnica: converte as leituras dos indicadores em sinais (-1, 0, 1),
+    aplica PESOS_SINAIS_TECNICOS, o viés semanal e os limiares. Não toca em preços nem em
+    indicadores, então mudar os limiares apenas repontua. Mesmo retorno de analise_tecnica_ativo.
     """
     if thresholds is None:
         thresholds = {'forte': 0.7, 'normal': 0.2}
+    ok = lambda *nomes: all(pd.notna(leituras.get(nome)) for nome in nomes)
+    sinais = {}
+    valores_indicadores = {}
+
+    if ok('rsi'):
+        rsi_val = leituras['rsi']
+        valores_indicadores['RSI'] = f"{rsi_val:.1f}"
+        sinais['RSI'] = 1 if rsi_val < 30 else (-1 if rsi_val > 70 else 0)
+    else:
+        sinais['RSI'] = 0; valores_indicadores['RSI'] = "N/A"
 
-    try:
-        # 1. Obtenção de Dados
-        if timeframe == 'weekly':
-            df = get_stock_data(ticker, period="5y", interval="1wk")
-        else:
-            df = get_stock_data(ticker, period="2y", interval="1d")
-
-        if df is None or df.empty:
-            return "Dados Insuficientes", 0, {"Erro": "Dados históricos indisponíveis."}, "NEUTRO"
-
-        # Garante que não há MultiIndex
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.droplevel(0)
+    if ok('macd', 'macd_sinal'):
+        valores_indicadores['MACD'] = f"{leituras['macd']:.2f}"
+        sinais['MACD'] = 1 if leituras['macd'] > leituras['macd_sinal'] else -1
+    else:
+        sinais['MACD'] = 0; valores_indicadores['MACD'] = "N/A"
 
-        # 2. Validação de Dados de Entrada
-        min_periods_required = 20  # O indicador com maior período é o BBands(20)
-        if len(df) < min_periods_required:
-            msg = f"São necessários pelo menos {min_periods_required} pontos de dados, mas apenas {len(df)} foram encontrados."
-            return "Dados Insuficientes", 0, {"Erro": msg}, "NEUTRO"
+    if ok('bb_superior', 'bb_inferior'):
+        bbu, bbl, close = leituras['bb_superior'], leituras['bb_inferior'], leituras['close']
+        valores_indicadores['Bandas de Bollinger (%B)'] = f"{(close - bbl) / (bbu - bbl):.2f}" if (bbu - bbl) > 0 else "N/A"
+        sinais['BOLLINGER'] = 1 if close < bbl else (-1 if close > bbu else 0)
+    else:
+        sinais['BOLLINGER'] = 0; valores_indicadores['Bandas de Bollinger (%B)'] = "N/A"
 
-        # 3. Cálculo dos Indicadores
-        MyStrategy = ta.Strategy(
-            name="Convergencia_Opcoes",
-            description="RSI, MACD, BBANDS, EMA, ADX, STOCH, PSAR",
-            ta=[
-                {"kind": "rsi"}, {"kind": "macd"}, {"kind": "bbands", "length": 20},
-                {"kind": "ema", "length": 9}, {"kind": "ema", "length": 21},
-                {"kind": "adx"}, {"kind": "stoch"}, {"kind": "psar"},
-            ]
-        )
-        df.ta.strategy(MyStrategy)
-
-        if df.empty or 'RSI_14' not in df.columns:
-            return "Erro de Cálculo", 0, {"Erro": "Não foi possível calcular os indicadores técnicos."}, "NEUTRO"
-
-        last = df.iloc[-1]
-        sinais = {}
-        valores_indicadores = {}
-
-        # 4. Extração Segura dos Sinais
-        if 'RSI_14' in last and pd.notna(last['RSI_14']):
-            rsi_val = last['RSI_14']
-            valores_indicadores['RSI'] = f"{rsi_val:.1f}"
-            if rsi_val < 30: sinais['RSI'] = 1
-            elif rsi_val > 70: sinais['RSI'] = -1
-            else: sinais['RSI'] = 0
-        else:
-            sinais['RSI'] = 0; valores_indicadores['RSI'] = "N/A"
+    if ok('ema_9', 'ema_21'):
+        valores_indicadores['EMA (9 vs 21)'] = "Cruz. Alta" if leituras['ema_9'] > leituras['ema_21'] else "Cruz. Baixa"
+        sinais['EMA'] = 1 if leituras['ema_9'] > leituras['ema_21'] else -1
+    else:
+        sinais['EMA'] = 0; valores_indicadores['EMA (9 vs 21)'] = "N/A"
+
+    if timeframe == 'weekly':
+        weekly_bias_signal = "Alta" if sinais['EMA'] > 0 and sinais['MACD'] > 0 else ("Baixa" if sinais['EMA'] < 0 and sinais['MACD'] < 0 else "Neutro")
+        return "Viés Semanal", 0, valores_indicadores, weekly_bias_signal
+
+    if ok('adx', 'dmp', 'dmn'):
+        adx_val = leituras['adx']
+        valores_indicadores['ADX'] = f"{adx_val:.1f}"
+        if adx_val > 25 and leituras['dmp'] > leituras['dmn']: sinais['ADX'] = 1
+        elif adx_val > 25 and leituras['dmn'] > leituras['dmp']: sinais['ADX'] = -1
+        else: sinais['ADX'] = 0
+    else:
+        sinais['ADX'] = 0; valores_indicadores['ADX'] = "N/A"
 
-        if 'MACD_12_26_9' in last and 'MACDs_12_26_9' in last and pd.notna(last['MACD_12_26_9']) and pd.notna(last['MACDs_12_26_9']):
-            valores_indicadores['MACD'] = f"{last['MACD_12_26_9']:.2f}"
-            if last['MACD_12_26_9'] > last['MACDs_12_26_9']: sinais['MACD'] = 1
-            else: sinais['MACD'] = -1
-        else:
-            sinais['MACD'] = 0; valores_indicadores['MACD'] = "N/A"
+    if ok('stoch_k'):
+        stoch_val = leituras['stoch_k']
+        valores_indicadores['Estocástico'] = f"{stoch_val:.1f}"
+        sinais['STOCH'] = 1 if stoch_val < 20 else (-1 if stoch_val > 80 else 0)
+    else:
+        sinais['STOCH'] = 0; valores_indicadores['Estocástico'] = "N/A"
+
+    if ok('psar_alta'):
+        sinais['SAR'] = 1; valores_indicadores['SAR Parabólico'] = "Alta"
+    elif ok('psar_baixa'):
+        sinais['SAR'] = -1; valores_indicadores['SAR Parabólico'] = "Baixa"
+    elif leituras.get('psar_alta') is not None and leituras.get('psar_baixa') is not None:
+        sinais['SAR'] = 0; valores_indicadores['SAR Parabólico'] = "Neutro"
+    else:
+        sinais['SAR'] = 0; valores_indicadores['SAR Parabólico'] = "N/A"
 
-        if 'BBU_20_2.0' in last and 'BBL_20_2.0' in last and pd.notna(last['BBU_20_2.0']) and pd.notna(last['BBL_20_2.0']):
-            bbu, bbl, close = last['BBU_20_2.0'], last['BBL_20_2.0'], last['close']
-            if (bbu - bbl) > 0:
-                bbp = (close - bbl) / (bbu - bbl)
-                valores_indicadores['Bandas de Bollinger (%B)'] = f"{bbp:.2f}"
-            else:
-                valores_indicadores['Bandas de Bollinger (%B)'] = "N/A"
-            if close < bbl: sinais['BOLLINGER'] = 1
-            elif close > bbu: sinais['BOLLINGER'] = -1
-            else: sinais['BOLLINGER'] = 0
-        else:
-            sinais['BOLLINGER'] = 0; valores_indicadores['Bandas de Bollinger (%B)'] = "N/A"
+    # Cálculo do Score e Sinal Final
+    score = sum(PESOS_SINAIS_TECNICOS.get(ind, 0) * valor for ind, valor in sinais.items())
+    score_ajustado = score + (0.15 * weekly_bias)
 
-        if 'EMA_9' in last and 'EMA_21' in last and pd.notna(last['EMA_9']) and pd.notna(last['EMA_21']):
-            valores_indicadores['EMA (9 vs 21)'] = "Cruz. Alta" if last['EMA_9'] > last['EMA_21'] else "Cruz. Baixa"
-            if last['EMA_9'] > last['EMA_21']: sinais['EMA'] = 1
-            else: sinais['EMA'] = -1
-        else:
-            sinais['EMA'] = 0; valores_indicadores['EMA (9 vs 21)'] = "N/A"
-
-        if timeframe == 'weekly':
-            weekly_bias_signal = "Alta" if sinais.get('EMA', 0) > 0 and sinais.get('MACD', 0) > 0 else ("Baixa" if sinais.get('EMA', 0) < 0 and sinais.get('MACD', 0) < 0 else "Neutro")
-            return "Viés Semanal", 0, valores_indicadores, weekly_bias_signal
-
-        if 'ADX_14' in last and 'DMP_14' in last and 'DMN_14' in last and all(pd.notna(last[c]) for c in ['ADX_14', 'DMP_14', 'DMN_14']):
-            adx_val = last['ADX_14']
-            valores_indicadores['ADX'] = f"{adx_val:.1f}"
-            if adx_val > 25 and last['DMP_14'] > last['DMN_14']: sinais['ADX'] = 1
-            elif adx_val > 25 and last['DMN_14'] > last['DMP_14']: sinais['ADX'] = -1
-            else: sinais['ADX'] = 0
-        else:
-            sinais['ADX'] = 0; valores_indicadores['ADX'] = "N/A"
-
-        if 'STOCHk_14_3_3' in last and pd.notna(last['STOCHk_14_3_3']):
-            stoch_val = last['STOCHk_14_3_3']
-            valores_indicadores['Estocástico'] = f"{stoch_val:.1f}"
-            if stoch_val < 20: sinais['STOCH'] = 1
-            elif stoch_val > 80: sinais['STOCH'] = -1
-            else: sinais['STOCH'] = 0
-        else:
-            sinais['STOCH'] = 0; valores_indicadores['Estocástico'] = "N/A"
+    tendencia_alta = sinais['MACD'] > 0 or sinais['EMA'] > 0
+    momento_alta = sinais['RSI'] > 0 or sinais['STOCH'] > 0
+    tendencia_baixa = sinais['MACD'] < 0 or sinais['EMA'] < 0
+    momento_baixa = sinais['RSI'] < 0 or sinais['STOCH'] < 0
 
-        if 'PSARl_0.02_0.2' in last and 'PSARs_0.02_0.2' in last:
-            if pd.notna(last['PSARl_0.02_0.2']):
-                sinais['SAR'] = 1; valores_indicadores['SAR Parabólico'] = "Alta"
-            elif pd.notna(last['PSARs_0.02_0.2']):
-                sinais['SAR'] = -1; valores_indicadores['SAR Parabólico'] = "Baixa"
-            else:
-                sinais['SAR'] = 0; valores_indicadores['SAR Parabólico'] = "Neutro"
-        else:
-            sinais['SAR'] = 0; valores_indicadores['SAR Parabólico'] = "N/A"
+    if score_ajustado > thresholds['forte'] and tendencia_alta and momento_alta: sinal_final = "COMPRA FORTE"
+    elif score_ajustado > thresholds['normal']: sinal_final = "COMPRA"
+    elif score_ajustado < -thresholds['forte'] and tendencia_baixa and momento_baixa: sinal_final = "VENDA FORTE"
+    elif score_ajustado < -thresholds['normal']: sinal_final = "VENDA"
+    else: sinal_final = "NEUTRO"
 
-        # 5. Cálculo do Score e Sinal Final
-        pesos = {'RSI': 0.20, 'MACD': 0.20, 'BOLLINGER': 0.15, 'EMA': 0.15, 'ADX': 0.10, 'STOCH': 0.08, 'SAR': 0.07}
-        score = sum(pesos.get(ind, 0) * valor for ind, valor in sinais.items())
-        score_ajustado = score + (0.15 * weekly_bias)
-        
-        tendencia_alta = sinais.get('MACD', 0) > 0 or sinais.get('EMA', 0) > 0
-        momento_alta = sinais.get('RSI', 0) > 0 or sinais.get('STOCH', 0) > 0
-        tendencia_baixa = sinais.get('MACD', 0) < 0 or sinais.get('EMA', 0) < 0
-        momento_baixa = sinais.get('RSI', 0) < 0 or sinais.get('STOCH', 0) < 0
+    if raw_data is not None:
+        valores_indicadores['raw_data'] = raw_data
+    return sinal_final, score_ajustado, valores_indicadores, "N/A"
 
-        if score_ajustado > thresholds['forte'] and tendencia_alta and momento_alta: sinal_final = "COMPRA FORTE"
-        elif score_ajustado > thresholds['normal']: sinal_final = "COMPRA"
-        elif score_ajustado < -thresholds['forte'] and tendencia_baixa and momento_baixa: sinal_final = "VENDA FORTE"
-        elif score_ajustado < -thresholds['normal']: sinal_final = "VENDA"
-        else: sinal_final = "NEUTRO"
+def analise_tecnica_ativo(ticker, timeframe='daily', weekly_bias=0, thresholds=None):
+    """
+    Realiza a análise técnica completa e retorna um score de convergência.
 
-        # 6. Coleta Segura de Dados Brutos para Depuração (A CAUSA DO ERRO ORIGINAL)
-        raw_data_cols = ['close', 'RSI_14', 'MACD_12_26_9', 'MACDs_12_26_9', 'BBL_20_2.0', 'BBU_20_2.0', 'EMA_9', 'EMA_21']
-        existing_cols = [col for col in raw_data_cols if col in df.columns]
-        if existing_cols:
-            valores_indicadores['raw_data'] = df[existing_cols].tail(10)
+    Os indicadores ficam em cache por ticker/timeframe/última barra (calcular_indicadores_tecnicos);
+    pesos, viés semanal e limiares são aplicados a cada chamada por pontuar_sinais_tecnicos.
+    """
+    try:
+        # 1. Obtenção e validação dos dados (get_stock_data já está em cache)
+        df = _dados_analise_tecnica(ticker, timeframe)
+        if df is None or df.empty:
+            return "Dados Insuficientes", 0, {"Erro": "Dados históricos indisponíveis."}, "NEUTRO"
+        if len(df) < MIN_BARRAS_INDICADORES:
+            msg = f"São necessários pelo menos {MIN_BARRAS_INDICADORES} pontos de dados, mas apenas {len(df)} foram encontrados."
+            return "Dados Insuficientes", 0, {"Erro": msg}, "NEUTRO"
 
-        return sinal_final, score_ajustado, valores_indicadores, "N/A"
+        # 2. Indicadores (cache) e 3. pontuação (sempre recalculada, é instantânea)
+        # A chave são os valores do último pregão diário, que também definem a barra semanal em andamento
+        leituras, raw_data = calcular_indicadores_tecnicos(ticker, timeframe, _chave_ultima_barra(historico_diario(ticker)))
+        return pontuar_sinais_tecnicos(leituras, timeframe, weekly_bias, thresholds, raw_data)
 
     except Exception as e:
         # Captura qualquer erro inesperado no processo
@@ -1916,6 +2135,360 @@ def gerar_analise_avancada(row, vies_fundamental, sinal_tecnico, vies_semanal):
     return recomendacao_final, analise_texto
 
 
+@st.fragment
+def painel_limiares_bs():
+    """
+    Explicação e sliders dos limiares da análise técnica. Os valores ficam no session_state
+    e só são lidos quando o botão "Analisar Opções" é pressionado, então mover um slider
+    reexecuta apenas este fragmento.
+    """
+    st.markdown("""
+    Esta seção permite ajustar a sensibilidade do modelo de análise técnica. Os limiares definem o quão forte a pontuação dos indicadores precisa ser para gerar um sinal de compra ou venda.
+
+    - **Limiar para Sinal FORTE:** Define a pontuação mínima para um sinal ser considerado "Forte". Requer que múltiplos indicadores de tendência e momento estejam alinhados.
+    - **Limiar para Sinal NORMAL:** Define a pontuação mínima para um sinal "Normal".
+
+    **Como ajustar:**
+    - **Valores mais altos** (ex: 0.8 para Forte) tornam o modelo **mais seletivo e exigente**, gerando menos sinais, porém mais confiáveis.
+    - **Valores mais baixos** (ex: 0.4 para Forte) tornam o modelo **mais sensível**, gerando mais sinais, que podem incluir mais "falsos positivos".
+
+    *Obs: Os valores são independentes e não precisam somar 1.*
+    """)
+    col_t1, col_t2 = st.columns(2)
+    with col_t1:
+        st.slider("Limiar para Sinal FORTE", 0.1, 1.0, 0.65, 0.05, key="bs_limiar_forte")
+    with col_t2:
+        st.slider("Limiar para Sinal NORMAL", 0.1, 1.0, 0.25, 0.05, key="bs_limiar_normal")
+
+@st.fragment
+def exibir_resultados_bs(debug_mode):
+    """
+    Diagnóstico do ativo e tabelas de resultado das opções, lidos do session_state.
+    Selecionar uma opção para ver a análise detalhada reexecuta apenas este fragmento.
+    """
+    st.subheader("Diagnóstico do Ativo Subjacente")
+    vies_fundamental = st.session_state.get('vies_fundamental_bs', "N/A")
+    sinal_tecnico = st.session_state.get('sinal_tecnico_bs', "N/A")
+    vies_semanal = st.session_state.get('vies_semanal_bs', "N/A")
+    detalhes_tecnicos = st.session_state.get('detalhes_tecnicos_bs', {})
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Viés Fundamentalista (Longo Prazo)", vies_fundamental)
+    col2.metric("Viés de Tendência (Semanal)", vies_semanal)
+    col3.metric("Sinal Técnico (Diário)", sinal_tecnico)
+
+    with st.expander("Detalhes da Análise Técnica Diária"):
+        if isinstance(detalhes_tecnicos, dict) and 'Erro' not in detalhes_tecnicos:
+            # Dicionário de interpretações para leigos
+            interpretacoes = {
+                'RSI': "Mede a força do movimento. Abaixo de 30 indica 'sobrevenda' (potencial de alta). Acima de 70, 'sobrecompra' (potencial de baixa).",
+                'MACD': "Indica o momento do ativo. Valores positivos sugerem momento de alta; negativos, de baixa.",
+                'Bandas de Bollinger (%B)': "Mostra se o preço está 'caro' ou 'barato'. Abaixo de 0, o preço cruzou a banda inferior (sinal de compra). Acima de 1, cruzou a superior (sinal de venda).",
+                'EMA (9 vs 21)': "Indica a tendência de curto prazo. 'Cruz. Alta' é um sinal otimista; 'Cruz. Baixa' é pessimista.",
+                'ADX': "Mede a força da tendência. Acima de 25 indica uma tendência forte (seja de alta ou baixa). Abaixo de 20, uma tendência fraca ou lateral.",
+                'Estocástico': "Similar ao RSI, mede o momento. Abaixo de 20 é 'sobrevenda' (potencial de alta), acima de 80 é 'sobrecompra' (potencial de baixa).",
+                'SAR Parabólico': "Mostra a direção da tendência. Quando os pontos estão abaixo do preço, a tendência é de alta."
+            }
+
+            # Prepara os dados para a tabela
+            dados_tabela = []
+            for indicador, valor in detalhes_tecnicos.items():
+                if indicador != 'raw_data':
+                    dados_tabela.append({
+                        "Indicador": indicador,
+                        "Valor/Sinal": valor,
+                        "Interpretação para Leigos": interpretacoes.get(indicador, "Análise de tendência/momento.")
+                    })
+
+            if dados_tabela:
+                df_tabela = pd.DataFrame(dados_tabela)
+                st.dataframe(df_tabela, use_container_width=True, hide_index=True)
+
+            # Se o modo de depuração estiver ativo, mostra os dados brutos
+            if debug_mode and 'raw_data' in detalhes_tecnicos:
+                st.markdown("##### Dados Brutos dos Indicadores (Últimos 10 dias)")
+                st.dataframe(detalhes_tecnicos['raw_data'])
+        else:
+            st.warning(f"Não foi possível exibir os detalhes da análise técnica. Motivo: {detalhes_tecnicos.get('Erro', 'desconhecido')}")
+
+
+    vols_estimadas = st.session_state.get('vols_estimadas_bs')
+    if vols_estimadas is not None:
+        with st.expander("Volatilidade do Ativo (estimadores)"):
+            estimador = st.session_state.get('estimador_vol_bs', 'close')
+            st.dataframe(pd.DataFrame({
+                'Estimador': [ESTIMADORES[chave] for chave in ESTIMADORES],
+                'Volatilidade Anual (%)': [vols_estimadas[chave] * 100 for chave in ESTIMADORES],
+                'Em Uso': ["✅" if chave == estimador else "" for chave in ESTIMADORES],
+            }), use_container_width=True, hide_index=True, column_config={'Volatilidade Anual (%)': st.column_config.NumberColumn(format="%.1f%%")})
+            garch = vols_estimadas.attrs.get('garch')
+            if garch is not None:
+                st.caption(f"GARCH(1,1): alfa = {garch['alfa']:.3f}, beta = {garch['beta']:.3f}, persistência = {garch['persistencia']:.3f}, "
+                           f"vol de longo prazo = {garch['vol_longo_prazo']:.1%}, vol condicional atual = {garch['vol_condicional']:.1%}.")
+
+    st.divider()
+
+    df_resultados = st.session_state['df_resultados_bs']
+
+    st.subheader("Resultados da Análise de Opções")
+
+    df_calls = df_resultados[df_resultados['Tipo'] == 'CALL'].copy()
+    df_puts = df_resultados[df_resultados['Tipo'] == 'PUT'].copy()
+
+    tab_calls, tab_puts = st.tabs(["Opções de Compra (Calls)", "Opções de Venda (Puts)"])
+
+    def exibir_tabela_e_analise(df, tipo_opcao):
+        if df.empty:
+            st.info(f"Nenhuma opção de {tipo_opcao} encontrada para este vencimento.")
+            return
+
+        st.dataframe(df[['Ticker', 'Modelo', 'Strike', 'Preço Mercado', 'Preço Teórico (BS)', 'Vol. Implícita (%)', 'Recomendação', 'Delta', 'Gamma', 'Vega', 'Theta', 'Rho']],
+                        use_container_width=True, hide_index=True,
+                        column_config={
+                            "Strike": st.column_config.NumberColumn("Strike", format="R$ %.2f"),
+                            "Preço Mercado": st.column_config.NumberColumn("Preço Mercado", format="R$ %.4f"),
+                            "Preço Teórico (BS)": st.column_config.NumberColumn("Preço Teórico", format="R$ %.4f", help="Black-Scholes para séries europeias; árvore binomial (Leisen-Reimer) para séries americanas."),
+                            "Vol. Implícita (%)": st.column_config.NumberColumn("Vol. Implícita", format="%.1f%%"),
+                            "Delta": st.column_config.NumberColumn(format="%.3f"),
+                            "Gamma": st.column_config.NumberColumn(format="%.3f"),
+                            "Vega": st.column_config.NumberColumn(format="%.3f"),
+                            "Theta": st.column_config.NumberColumn(format="%.3f"),
+                            "Rho": st.column_config.NumberColumn(format="%.3f"),
+                        })
+
+        st.markdown("---")
+        st.markdown("#### 🔍 Análise Detalhada da Opção")
+
+        opcoes_disponiveis = df['Ticker'].tolist()
+        if opcoes_disponiveis:
+            opcao_selecionada = st.selectbox("Selecione uma opção para ver a análise completa:", options=opcoes_disponiveis, key=f"select_{tipo_opcao}")
+            analise = df[df['Ticker'] == opcao_selecionada]['Análise Detalhada'].iloc[0]
+            st.success(analise)
+
+    with tab_calls:
+        exibir_tabela_e_analise(df_calls, "CALL")
+
+    with tab_puts:
+        exibir_tabela_e_analise(df_puts, "PUT")
+
+    # --- Sorriso de volatilidade: vol implícita por strike, comparada à vol histórica usada no preço teórico ---
+    df_sorriso = df_resultados.dropna(subset=['Vol. Implícita (%)']).sort_values('Strike')
+    if not df_sorriso.empty:
+        fig_sorriso = px.line(df_sorriso, x='Strike', y='Vol. Implícita (%)', color='Tipo', markers=True, title="Sorriso de Volatilidade (Vol. Implícita por Strike)", color_discrete_map={'CALL': '#00F6FF', 'PUT': '#FF5252'}, hover_data=['Ticker'])
+        vol_historica = st.session_state.get('vol_historica_bs')
+        if vol_historica:
+            estimador = ESTIMADORES[st.session_state.get('estimador_vol_bs', 'close')]
+            fig_sorriso.add_hline(y=vol_historica * 100, line_dash="dash", line_color="#39FF14", annotation_text=f"Vol. Histórica ({estimador})")
+        preco_ativo = st.session_state.get('preco_atual_ativo_bs')
+        if preco_ativo:
+            fig_sorriso.add_vline(x=preco_ativo, line_dash="dot", line_color="#F2A30F", annotation_text="Preço Atual")
+        fig_sorriso.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', legend_font_color='var(--text-color)', title_font_color='var(--header-color)', yaxis_title='Vol. Implícita (%)')
+        st.plotly_chart(fig_sorriso, use_container_width=True)
+        st.caption("A 'Diferença (%)' entre preço de mercado e teórico reflete, em grande parte, a distância entre a vol. implícita de cada strike e a vol. histórica.")
+
+    with st.expander("📖 Glossário das Gregas (O que significam?)"):
+        st.markdown("""
+        As **"Greeks" (Gregas)** são um conjunto de indicadores que medem a sensibilidade do preço de uma opção a diferentes fatores de risco. Entendê-las é fundamental para gerenciar o risco de suas operações.
+
+        - **Delta (Δ):** Mede a velocidade da opção. Indica o quanto o preço da opção tende a mudar para cada R$ 1,00 de variação no preço do ativo-objeto.
+          - *Exemplo:* Um Delta de 0.60 significa que, se a ação subir R$ 1,00, o preço da opção de compra (CALL) tende a valorizar R$ 0,60.
+
+        - **Gamma (Γ):** Mede a aceleração do Delta. Mostra o quão rápido o Delta de uma opção muda conforme o preço do ativo-objeto se altera.
+          - *Exemplo:* Um Gamma alto significa que o Delta é muito sensível, mudando rapidamente. Isso é comum em opções "no dinheiro" (ATM) e próximas do vencimento.
+
+        - **Vega (ν):** Mede o impacto da volatilidade. Indica o quanto o preço da opção muda para cada 1% de variação na volatilidade do ativo.
+          - *Exemplo:* Se você acredita que a volatilidade do mercado vai aumentar, deve procurar opções com Vega positivo e alto, pois elas se beneficiarão mais desse movimento.
+
+        - **Theta (Θ):** Mede o custo do tempo. Indica o quanto o preço da opção perde de valor a cada dia que passa, devido à aproximação do vencimento (decaimento temporal).
+          - *Exemplo:* Um Theta de -0.05 significa que a opção perde R$ 0,05 de seu valor extrínseco por dia, mantendo os outros fatores constantes. É o "aluguel" que se paga por manter a posição.
+
+        - **Rho (ρ):** Mede o impacto dos juros. Indica a sensibilidade do preço da opção a uma variação de 1% na taxa de juros livre de risco.
+          - *Exemplo:* Geralmente, tem um impacto menor no preço de opções de curto prazo, mas é relevante para opções de longo prazo (LEAPs).
+        """)
+
+def _valor_limite(valor):
+    """Formata lucro/perda máximos de uma estratégia, que podem ser ilimitados."""
+    return "Ilimitado" if np.isinf(valor) else f"R$ {valor:,.2f}"
+
+def exibir_estrategia(pernas, preco_atual, taxa_juros, vol):
+    """
+    Resumo de uma estratégia (pernas no formato de grade_cenarios): métricas, Greeks
+    agregadas e gráfico de payoff no vencimento e hoje sobre uma grade densa de preços.
+    """
+    resultado = avaliar_estrategia(pernas, preco_atual, taxa_juros, vol)
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Custo de Montagem", f"R$ {resultado.custo:,.2f}", help="Positivo = débito; negativo = crédito recebido.")
+    col2.metric("Lucro Máximo", _valor_limite(resultado.lucro_maximo))
+    col3.metric("Perda Máxima", _valor_limite(resultado.perda_maxima))
+    col4.metric("Prob. de Lucro", f"{resultado.prob_lucro:.1%}", help=f"No vencimento, com volatilidade de {vol:.1%}.")
+    col5.metric("Valor Esperado", f"R$ {resultado.valor_esperado:,.2f}", help="Valor teórico da estratégia menos o custo de montagem.")
+    breakevens = ", ".join(f"R$ {ponto:.2f}" for ponto in resultado.breakevens) or "nenhum"
+    st.caption(f"Pontos de equilíbrio no vencimento: {breakevens} | " + " | ".join(f"{grega.capitalize()}: {valor:.4f}" for grega, valor in resultado.gregas.items()))
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=resultado.precos, y=resultado.pnl_vencimento, name='No vencimento', line=dict(color='#00F6FF')))
+    fig.add_trace(go.Scatter(x=resultado.precos, y=resultado.pnl_hoje, name='Hoje (teórico)', line=dict(color='#FFD700', dash='dash')))
+    fig.add_hline(y=0, line_color='gray', line_width=1)
+    fig.add_vline(x=preco_atual, line_dash='dot', line_color='white', annotation_text=f"Preço atual: R$ {preco_atual:.2f}")
+    for ponto in resultado.breakevens:
+        if resultado.precos[0] <= ponto <= resultado.precos[-1]:
+            fig.add_vline(x=ponto, line_dash='dot', line_color='#FF5252')
+    fig.update_layout(title="Payoff da Estratégia", xaxis_title='Preço do ativo (R$)', yaxis_title='P&L (R$)', paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+                      font_color='var(--text-color)', title_font_color='var(--header-color)', legend=dict(orientation='h', y=1.1))
+    st.plotly_chart(fig, use_container_width=True)
+
+def exibir_mapas_cenarios(pernas, preco_atual, prazo_anos, taxa_juros, chave):
+    """
+    Mapas de calor do P&L de uma posição (pernas no formato de grade_cenarios) em uma grade de
+    200 preços × 50 choques de vol × 30 datas até o vencimento, calculada de uma só vez.
+    """
+    dias_ate_vencimento = max(int(round(prazo_anos * 365)), 1)
+    grade = grade_cenarios(pernas, np.linspace(preco_atual * 0.7, preco_atual * 1.3, 200), np.linspace(-0.20, 0.20, 50),
+                           np.linspace(0, dias_ate_vencimento, 30), taxa_juros)
+
+    dia_escolhido = st.select_slider("Dias a partir de hoje (mapa Preço × Volatilidade)", options=list(range(30)), value=0,
+                                     format_func=lambda i: f"{grade.dias[i]:.0f} dia(s)", key=f"{chave}_dia")
+    col_vol, col_tempo = st.columns(2)
+    layout = dict(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='var(--text-color)', title_font_color='var(--header-color)')
+    with col_vol:
+        mapa = grade.mapa_preco_vol(dia_escolhido)
+        fig_vol = go.Figure(go.Heatmap(z=mapa.values, x=mapa.columns * 100, y=mapa.index, colorscale='RdYlGn', zmid=0, colorbar=dict(title='P&L (R$)'),
+                                       hovertemplate='Preço: R$ %{y:.2f}<br>Choque de vol: %{x:+.1f} p.p.<br>P&L: R$ %{z:.2f}<extra></extra>'))
+        fig_vol.update_layout(title=f"P&L: Preço × Volatilidade ({grade.dias[dia_escolhido]:.0f} dias)", xaxis_title='Choque de vol (p.p.)', yaxis_title='Preço do ativo (R$)', **layout)
+        st.plotly_chart(fig_vol, use_container_width=True)
+    with col_tempo:
+        mapa = grade.mapa_preco_dias()
+        fig_tempo = go.Figure(go.Heatmap(z=mapa.values, x=mapa.columns, y=mapa.index, colorscale='RdYlGn', zmid=0, colorbar=dict(title='P&L (R$)'),
+                                         hovertemplate='Preço: R$ %{y:.2f}<br>Dias: %{x:.0f}<br>P&L: R$ %{z:.2f}<extra></extra>'))
+        fig_tempo.update_layout(title="P&L: Preço × Tempo (vol atual)", xaxis_title='Dias a partir de hoje', yaxis_title='Preço do ativo (R$)', **layout)
+        st.plotly_chart(fig_tempo, use_container_width=True)
+
+@st.fragment
+def painel_cenarios_bs():
+    """
+    Análise de cenários de uma posição montada com as opções da última análise. Alterar a
+    seleção, as quantidades ou o dia do mapa reexecuta apenas este fragmento.
+    """
+    df_resultados = st.session_state['df_resultados_bs']
+    preco_atual = st.session_state.get('preco_atual_ativo_bs')
+    prazo_anos = st.session_state.get('prazo_anos_bs')
+    if not preco_atual or not prazo_anos or prazo_anos <= 0:
+        return
+
+    st.subheader("🧪 Montagem de Estratégia e Cenários")
+    col_opcoes, col_ativo = st.columns([4, 1])
+    selecionadas = col_opcoes.multiselect("Selecione as opções da posição", options=df_resultados['Ticker'].tolist(), max_selections=8, key="cenario_tickers")
+    quantidade_ativo = col_ativo.number_input("Ações do ativo-objeto", value=0, step=1, key="cenario_qtd_ativo", help="Use para estratégias com o ativo, como o collar ou a venda coberta.")
+    if not selecionadas:
+        st.info("Selecione uma ou mais opções para ver payoff, Greeks e pontos de equilíbrio da posição e simular o resultado em diferentes preços, volatilidades e prazos.")
+        return
+
+    posicao = df_resultados.drop_duplicates('Ticker').set_index('Ticker').loc[selecionadas, ['Tipo', 'Strike', 'Preço Mercado', 'Vol. Implícita (%)']].reset_index()
+    posicao.insert(1, 'Quantidade', 1)
+    posicao = st.data_editor(posicao, hide_index=True, use_container_width=True, disabled=['Ticker', 'Tipo', 'Strike', 'Preço Mercado', 'Vol. Implícita (%)'],
+                             column_config={"Quantidade": st.column_config.NumberColumn("Quantidade (negativa = vendida)", step=1, format="%d")},
+                             key=f"cenario_quantidades_{'_'.join(selecionadas)}")
+    if (posicao['Quantidade'] == 0).all():
+        st.info("Defina ao menos uma quantidade diferente de zero.")
+        return
+
+    # Cada perna usa a própria vol implícita (ou a histórica, se a implícita não tiver solução)
+    vol_historica = st.session_state.get('vol_historica_bs', 0.30)
+    pernas = pd.DataFrame({
+        'strike': posicao['Strike'], 'tipo': posicao['Tipo'], 'quantidade': posicao['Quantidade'],
+        'preco_entrada': posicao['Preço Mercado'], 'vol': (posicao['Vol. Implícita (%)'] / 100).fillna(vol_historica),
+        'prazo_anos': prazo_anos,
+    })
+    if quantidade_ativo:
+        pernas.loc[len(pernas)] = {'strike': 0.0, 'tipo': 'ATIVO', 'quantidade': quantidade_ativo, 'preco_entrada': preco_atual, 'vol': vol_historica, 'prazo_anos': prazo_anos}
+    selic = st.session_state.get('selic_bs', 0.10)
+    exibir_estrategia(pernas, preco_atual, selic, vol_historica)
+    exibir_mapas_cenarios(pernas, preco_atual, prazo_anos, selic, chave="cenario_posicao")
+
+@st.fragment
+def painel_ranking_estrategias():
+    """
+    Monta todas as travas, straddles, strangles, collars e iron condors possíveis com a cadeia
+    analisada e lista as melhores pelo critério escolhido. A avaliação é vetorizada sobre todas
+    as combinações, então refazer o ranking não reexecuta a análise da página.
+    """
+    cadeia = st.session_state.get('cadeia_bs')
+    preco_atual = st.session_state.get('preco_atual_ativo_bs')
+    prazo_anos = st.session_state.get('prazo_anos_bs')
+    if cadeia is None or not preco_atual or not prazo_anos or prazo_anos <= 0:
+        return
+
+    st.subheader("🏆 Ranking Automático de Estratégias")
+    criterios = {'retorno_risco': 'Retorno esperado / perda máxima', 'prob_lucro': 'Probabilidade de lucro', 'valor_esperado': 'Valor esperado'}
+    col1, col2, col3 = st.columns([3, 2, 1])
+    estrategias = col1.multiselect("Estratégias", options=list(ESTRATEGIAS), default=list(ESTRATEGIAS), key="ranking_estrategias")
+    criterio = col2.selectbox("Critério", options=list(criterios), format_func=criterios.get, key="ranking_criterio")
+    max_strikes = col3.number_input("Strikes por tipo", min_value=4, max_value=40, value=20, step=1, key="ranking_max_strikes",
+                                    help="Quantidade de strikes mais próximos do preço atual usados em cada tipo de opção.")
+    if not estrategias:
+        return
+
+    vol = st.session_state.get('vol_historica_bs', 0.30)
+    selic = st.session_state.get('selic_bs', 0.10)
+    ranking = ranquear_estrategias(cadeia, preco_atual, prazo_anos, selic, vol, estrategias=estrategias, criterio=criterio, max_strikes=int(max_strikes))
+    if ranking.empty:
+        st.info("Não há opções suficientes na cadeia para montar as estratégias selecionadas.")
+        return
+
+    st.caption(f"Probabilidade e valor esperado calculados com a volatilidade histórica ({vol:.1%}) contra os preços de mercado.")
+    st.dataframe(ranking.drop(columns=['Pernas']), use_container_width=True, hide_index=True,
+                 column_config={
+                     **{coluna: st.column_config.NumberColumn(format="R$ %.2f") for coluna in ('Custo (R$)', 'Lucro Máximo (R$)', 'Perda Máxima (R$)', 'Valor Esperado (R$)', 'Breakeven Inferior', 'Breakeven Superior')},
+                     "Prob. Lucro (%)": st.column_config.NumberColumn(format="%.1f%%"),
+                     **{coluna: st.column_config.NumberColumn(format="%.3f") for coluna in ('Retorno/Risco', 'Delta', 'Gamma', 'Vega', 'Theta')},
+                 })
+    escolhida = st.selectbox("Detalhar estratégia", options=ranking.index, format_func=lambda i: f"{i + 1}. {ranking.at[i, 'Estratégia']}: {ranking.at[i, 'Montagem']}", key="ranking_detalhe")
+    exibir_estrategia(pd.DataFrame(ranking.at[escolhida, 'Pernas']), preco_atual, selic, vol)
+
+@st.fragment
+def painel_superficie_volatilidade(ticker):
+    """
+    Superfície de volatilidade implícita (strike × vencimento) do ativo selecionado.
+    Busca os próximos vencimentos mensais de uma vez, em paralelo; por ser um fragmento,
+    montar ou atualizar a superfície não reexecuta o restante da aba.
+    """
+    with st.expander("🌐 Superfície de Volatilidade (vários vencimentos)", expanded=False):
+        with st.form("form_superficie_vol"):
+            n_vencimentos = st.slider("Número de vencimentos mensais (terceiras sextas-feiras)", 2, 12, 6)
+            montar = st.form_submit_button(f"Montar Superfície de {ticker}", use_container_width=True)
+
+        if montar:
+            with st.spinner(f"Buscando {n_vencimentos} cadeias de opções de {ticker} em paralelo..."):
+                preco_atual = st.session_state.get('preco_atual_ativo_bs') if st.session_state.get('ticker_bs') == ticker else None
+                if preco_atual is None:
+                    dados = get_stock_data(f"{ticker}.SA", period="1y")
+                    if dados is None or dados.empty:
+                        st.warning(f"Não foi possível obter o preço atual de {ticker}.")
+                        return
+                    preco_atual = float(np.asarray(dados['close']).ravel()[-1])
+                selic_anual = obter_dados_mercado(CONFIG["PERIODO_BETA_IBOV"])[0]
+                opcoes_superficie, grade, falhas = buscar_superficie_volatilidade(ticker, round(preco_atual, 2), selic_anual, n_vencimentos)
+            st.session_state['superficie_bs'] = {'ticker': ticker, 'opcoes': opcoes_superficie, 'grade': grade, 'falhas': falhas}
+
+        superficie = st.session_state.get('superficie_bs')
+        if not superficie or superficie['ticker'] != ticker:
+            return
+        if superficie['falhas']:
+            st.caption(f"Vencimentos que não puderam ser baixados: {', '.join(superficie['falhas'])}")
+        grade = superficie['grade']
+        if grade.empty:
+            st.info("Nenhuma opção com volatilidade implícita válida nos vencimentos consultados.")
+            return
+
+        fig_superficie = go.Figure(go.Heatmap(
+            z=grade.values * 100, x=[pd.Timestamp(v).strftime('%d/%m/%Y') for v in grade.columns], y=grade.index,
+            colorscale='Viridis', colorbar=dict(title='Vol. Impl. (%)'), hoverongaps=False,
+            hovertemplate='Vencimento: %{x}<br>Strike: R$ %{y:.2f}<br>Vol. Implícita: %{z:.1f}%<extra></extra>'
+        ))
+        fig_superficie.update_layout(title=f"Superfície de Volatilidade Implícita - {ticker}", xaxis_title='Vencimento', yaxis_title='Strike (R$)', paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='var(--text-color)', title_font_color='var(--header-color)')
+        st.plotly_chart(fig_superficie, use_container_width=True)
+        st.caption("Cada célula usa a opção fora do dinheiro daquele strike (PUTs abaixo do preço atual, CALLs acima). Os dados ficam em cache por 5 minutos.")
+
 def ui_black_scholes():
     """Renderiza a interface da aba Black-Scholes."""
     st.header("Precificação de Opções e Análise Avançada")
@@ -1938,29 +2511,16 @@ def ui_black_scholes():
             st.write("") # Espaçamento
             st.write("") # Espaçamento
             analisar_opcoes_btn = st.form_submit_button("Analisar Opções", use_container_width=True)
+        estimador_vol = st.selectbox("Estimador de volatilidade", options=list(ESTIMADORES), format_func=ESTIMADORES.get, key="bs_estimador_vol",
+                                     help="Volatilidade usada no preço teórico. Close-to-Close, EWMA, Parkinson, Garman-Klass e Yang-Zhang usam o último ano de pregões; o GARCH(1,1) prevê a vol média até o vencimento.")
+        passos_binomial = st.slider("Passos da árvore binomial (séries americanas)", 25, 1001, 101, 2,
+                                    help="As séries americanas são precificadas por árvore de Leisen-Reimer, que admite exercício antecipado. Mais passos = mais precisão e mais tempo de cálculo.")
 
     with st.expander("Opções Avançadas de Análise Técnica", expanded=False):
-        st.markdown("""
-        Esta seção permite ajustar a sensibilidade do modelo de análise técnica. Os limiares definem o quão forte a pontuação dos indicadores precisa ser para gerar um sinal de compra ou venda.
-
-        - **Limiar para Sinal FORTE:** Define a pontuação mínima para um sinal ser considerado "Forte". Requer que múltiplos indicadores de tendência e momento estejam alinhados.
-        - **Limiar para Sinal NORMAL:** Define a pontuação mínima para um sinal "Normal".
-
-        **Como ajustar:**
-        - **Valores mais altos** (ex: 0.8 para Forte) tornam o modelo **mais seletivo e exigente**, gerando menos sinais, porém mais confiáveis.
-        - **Valores mais baixos** (ex: 0.4 para Forte) tornam o modelo **mais sensível**, gerando mais sinais, que podem incluir mais "falsos positivos".
-        
-        *Obs: Os valores são independentes e não precisam somar 1.*
-        """)
-        col_t1, col_t2 = st.columns(2)
-        with col_t1:
-            threshold_forte = st.slider("Limiar para Sinal FORTE", 0.1, 1.0, 0.65, 0.05)
-        with col_t2:
-            threshold_normal = st.slider("Limiar para Sinal NORMAL", 0.1, 1.0, 0.25, 0.05)
-        
+        painel_limiares_bs()
         debug_mode = st.checkbox("Ativar Modo de Depuração da Análise Técnica")
         
-        thresholds_config = {'forte': threshold_forte, 'normal': threshold_normal}
+        thresholds_config = {'forte': st.session_state.bs_limiar_forte, 'normal': st.session_state.bs_limiar_normal}
 
     if analisar_opcoes_btn:
         ticker_sa = f"{ticker_selecionado}.SA"
@@ -1970,11 +2530,10 @@ def ui_black_scholes():
                 # 1. Análise Fundamentalista (Valuation)
                 codigo_cvm_info = ticker_cvm_map_df[ticker_cvm_map_df['TICKER'] == ticker_selecionado]
                 codigo_cvm = int(codigo_cvm_info.iloc[0]['CD_CVM'])
-                demonstrativos = preparar_dados_cvm(CONFIG["HISTORICO_ANOS_CVM"])
                 market_data = obter_dados_mercado(CONFIG["PERIODO_BETA_IBOV"])
                 params_analise = {'taxa_crescimento_perpetuidade': CONFIG["TAXA_CRESCIMENTO_PERPETUIDADE"], 'media_anos_calculo': CONFIG["MEDIA_ANOS_CALCULO"], 'periodo_beta_ibov': CONFIG["PERIODO_BETA_IBOV"]}
                 
-                resultados_valuation, status_msg = processar_valuation_empresa(ticker_sa, codigo_cvm, demonstrativos, market_data, params_analise)
+                resultados_valuation, status_msg = processar_valuation_empresa(ticker_sa, codigo_cvm, None, market_data, params_analise)
                 
                 if resultados_valuation is None:
                     st.error(f"Falha na Análise Fundamentalista: {status_msg}. A análise de opções não pode continuar.")
@@ -2001,10 +2560,21 @@ def ui_black_scholes():
                 selic_anual = market_data[0]
                 preco_atual_ativo = resultados_valuation['Preço Atual (R$)']
                 st.session_state['preco_atual_ativo_bs'] = preco_atual_ativo
+                st.session_state['ticker_bs'] = ticker_selecionado
                 
-                vol_historica = calcular_volatilidade_historica(ticker_sa)
-                if vol_historica is None: vol_historica = 0.30
+                dias_uteis = max(int(np.busday_count(date.today(), data_vencimento)), 1)
+                vols_estimadas = estimar_volatilidades_ativo(ticker_sa, dias_uteis)
+                vol_historica = vols_estimadas[estimador_vol] if vols_estimadas is not None else np.nan
+                if not np.isfinite(vol_historica) or vol_historica <= 0:
+                    vol_historica = calcular_volatilidade_historica(ticker_sa)
+                    if vol_historica is None or not np.isfinite(vol_historica):
+                        st.warning("Não foi possível estimar a volatilidade do ativo; usando 30% ao ano.")
+                        vol_historica = 0.30
+                    else:
+                        st.warning(f"O estimador {ESTIMADORES[estimador_vol]} não está disponível para {ticker_selecionado}; usando Close-to-Close.")
                 st.session_state['vol_historica_bs'] = vol_historica
+                st.session_state['vols_estimadas_bs'] = vols_estimadas
+                st.session_state['estimador_vol_bs'] = estimador_vol
                 
                 vencimento_str = data_vencimento.strftime('%Y-%m-%d')
                 df_opcoes = buscar_opcoes(ticker_selecionado, vencimento_str)
@@ -2012,27 +2582,40 @@ def ui_black_scholes():
                     st.warning(f"Nenhuma opção encontrada para {ticker_selecionado} com vencimento em {data_vencimento.strftime('%d/%m/%Y')}.")
                     st.stop()
                 
-                # 4. Cálculos de Black-Scholes
+                # 4. Cálculos de Black-Scholes: preço e Greeks da cadeia inteira em uma passada
                 T = (data_vencimento - date.today()).days / 365.0
-                resultados = []
-                for _, row in df_opcoes.iterrows():
-                    preco_bs = black_scholes(preco_atual_ativo, row['strike'], T, selic_anual, vol_historica, row['tipo'])
-                    greeks = calcular_greeks(preco_atual_ativo, row['strike'], T, selic_anual, vol_historica, row['tipo'])
-                    diferenca_percentual = ((row['preco_mercado'] - preco_bs) / preco_bs * 100) if preco_bs > 0 else 0
-                    
-                    res_temp = {'Diferença (%)': diferenca_percentual, 'Tipo': row['tipo'], 'Strike': row['strike']}
-                    recomendacao, analise_detalhada = gerar_analise_avancada(res_temp, vies_fundamental, sinal_tecnico, vies_semanal)
-                    
-                    res = {
-                        'Ticker': row['ticker'], 'Tipo': row['tipo'], 'Strike': row['strike'],
-                        'Preço Mercado': row['preco_mercado'], 'Preço Teórico (BS)': preco_bs,
-                        'Recomendação': recomendacao, 'Análise Detalhada': analise_detalhada,
-                        **{k.capitalize(): v for k, v in greeks.items()}
-                    }
-                    resultados.append(res)
-                
-                df_resultados = pd.DataFrame(resultados)
+                st.session_state['prazo_anos_bs'] = T
+                st.session_state['selic_bs'] = selic_anual
+                calculo = black_scholes_vetorizado(preco_atual_ativo, df_opcoes['strike'].to_numpy(), T, selic_anual, vol_historica, df_opcoes['tipo'].to_numpy())
+                # Séries americanas (modelo 'A') vão para a árvore binomial, que considera o exercício antecipado
+                americanas = df_opcoes['modelo'].astype(str).str.upper().str.startswith('A').to_numpy()
+                if americanas.any():
+                    calculo_arvore = binomial_vetorizado(preco_atual_ativo, df_opcoes['strike'].to_numpy()[americanas], T, selic_anual, vol_historica,
+                                                         df_opcoes['tipo'].to_numpy()[americanas], americana=True, passos=passos_binomial)
+                    for grandeza, valores in calculo_arvore.items():
+                        calculo[grandeza][americanas] = valores
+                preco_bs = calculo['preco']
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    diferenca_percentual = np.where(preco_bs > 0, (df_opcoes['preco_mercado'].to_numpy() - preco_bs) / preco_bs * 100, 0.0)
+
+                # Volatilidade implícita de cada opção, resolvida para a cadeia inteira de uma vez
+                vol_implicita = volatilidade_implicita(df_opcoes['preco_mercado'].to_numpy(), preco_atual_ativo, df_opcoes['strike'].to_numpy(), T, selic_anual, df_opcoes['tipo'].to_numpy())
+
+                # A recomendação em texto continua por opção, mas só compara números já calculados
+                analises = [gerar_analise_avancada({'Diferença (%)': diferenca, 'Tipo': tipo}, vies_fundamental, sinal_tecnico, vies_semanal)
+                            for diferenca, tipo in zip(diferenca_percentual, df_opcoes['tipo'])]
+
+                df_resultados = pd.DataFrame({
+                    'Ticker': df_opcoes['ticker'].to_numpy(), 'Tipo': df_opcoes['tipo'].to_numpy(), 'Strike': df_opcoes['strike'].to_numpy(),
+                    'Modelo': np.where(americanas, 'Americana', 'Europeia'),
+                    'Preço Mercado': df_opcoes['preco_mercado'].to_numpy(), 'Preço Teórico (BS)': preco_bs,
+                    'Vol. Implícita (%)': vol_implicita * 100,
+                    'Recomendação': [recomendacao for recomendacao, _ in analises],
+                    'Análise Detalhada': [analise for _, analise in analises],
+                    **{grega.capitalize(): calculo[grega] for grega in ('delta', 'gamma', 'vega', 'theta', 'rho')}
+                })
                 st.session_state['df_resultados_bs'] = df_resultados
+                st.session_state['cadeia_bs'] = df_opcoes
 
             except Exception as e:
                 st.error(f"Ocorreu um erro inesperado durante a análise completa: {e}")
@@ -2041,115 +2624,282 @@ def ui_black_scholes():
                 st.stop()
 
     if 'df_resultados_bs' in st.session_state:
-        st.subheader("Diagnóstico do Ativo Subjacente")
-        vies_fundamental = st.session_state.get('vies_fundamental_bs', "N/A")
-        sinal_tecnico = st.session_state.get('sinal_tecnico_bs', "N/A")
-        vies_semanal = st.session_state.get('vies_semanal_bs', "N/A")
-        detalhes_tecnicos = st.session_state.get('detalhes_tecnicos_bs', {})
-        
-        col1, col2, col3 = st.columns(3)
-        col1.metric("Viés Fundamentalista (Longo Prazo)", vies_fundamental)
-        col2.metric("Viés de Tendência (Semanal)", vies_semanal)
-        col3.metric("Sinal Técnico (Diário)", sinal_tecnico)
-
-        with st.expander("Detalhes da Análise Técnica Diária"):
-            if isinstance(detalhes_tecnicos, dict) and 'Erro' not in detalhes_tecnicos:
-                # Dicionário de interpretações para leigos
-                interpretacoes = {
-                    'RSI': "Mede a força do movimento. Abaixo de 30 indica 'sobrevenda' (potencial de alta). Acima de 70, 'sobrecompra' (potencial de baixa).",
-                    'MACD': "Indica o momento do ativo. Valores positivos sugerem momento de alta; negativos, de baixa.",
-                    'Bandas de Bollinger (%B)': "Mostra se o preço está 'caro' ou 'barato'. Abaixo de 0, o preço cruzou a banda inferior (sinal de compra). Acima de 1, cruzou a superior (sinal de venda).",
-                    'EMA (9 vs 21)': "Indica a tendência de curto prazo. 'Cruz. Alta' é um sinal otimista; 'Cruz. Baixa' é pessimista.",
-                    'ADX': "Mede a força da tendência. Acima de 25 indica uma tendência forte (seja de alta ou baixa). Abaixo de 20, uma tendência fraca ou lateral.",
-                    'Estocástico': "Similar ao RSI, mede o momento. Abaixo de 20 é 'sobrevenda' (potencial de alta), acima de 80 é 'sobrecompra' (potencial de baixa).",
-                    'SAR Parabólico': "Mostra a direção da tendência. Quando os pontos estão abaixo do preço, a tendência é de alta."
-                }
-                
-                # Prepara os dados para a tabela
-                dados_tabela = []
-                for indicador, valor in detalhes_tecnicos.items():
-                    if indicador != 'raw_data':
-                        dados_tabela.append({
-                            "Indicador": indicador,
-                            "Valor/Sinal": valor,
-                            "Interpretação para Leigos": interpretacoes.get(indicador, "Análise de tendência/momento.")
-                        })
-                
-                if dados_tabela:
-                    df_tabela = pd.DataFrame(dados_tabela)
-                    st.dataframe(df_tabela, use_container_width=True, hide_index=True)
-                
-                # Se o modo de depuração estiver ativo, mostra os dados brutos
-                if debug_mode and 'raw_data' in detalhes_tecnicos:
-                    st.markdown("##### Dados Brutos dos Indicadores (Últimos 10 dias)")
-                    st.dataframe(detalhes_tecnicos['raw_data'])
-            else:
-                st.warning(f"Não foi possível exibir os detalhes da análise técnica. Motivo: {detalhes_tecnicos.get('Erro', 'desconhecido')}")
-
-        
+        exibir_resultados_bs(debug_mode)
+        st.divider()
+        painel_cenarios_bs()
         st.divider()
+        painel_ranking_estrategias()
 
-        df_resultados = st.session_state['df_resultados_bs']
-        
-        st.subheader("Resultados da Análise de Opções")
-        
-        df_calls = df_resultados[df_resultados['Tipo'] == 'CALL'].copy()
-        df_puts = df_resultados[df_resultados['Tipo'] == 'PUT'].copy()
-
-        tab_calls, tab_puts = st.tabs(["Opções de Compra (Calls)", "Opções de Venda (Puts)"])
-
-        def exibir_tabela_e_analise(df, tipo_opcao):
-            if df.empty:
-                st.info(f"Nenhuma opção de {tipo_opcao} encontrada para este vencimento.")
-                return
-
-            st.dataframe(df[['Ticker', 'Strike', 'Preço Mercado', 'Preço Teórico (BS)', 'Recomendação', 'Delta', 'Gamma', 'Vega', 'Theta', 'Rho']],
-                            use_container_width=True, hide_index=True,
-                            column_config={
-                                "Strike": st.column_config.NumberColumn("Strike", format="R$ %.2f"),
-                                "Preço Mercado": st.column_config.NumberColumn("Preço Mercado", format="R$ %.4f"),
-                                "Preço Teórico (BS)": st.column_config.NumberColumn("Preço Teórico", format="R$ %.4f"),
-                                "Delta": st.column_config.NumberColumn(format="%.3f"),
-                                "Gamma": st.column_config.NumberColumn(format="%.3f"),
-                                "Vega": st.column_config.NumberColumn(format="%.3f"),
-                                "Theta": st.column_config.NumberColumn(format="%.3f"),
-                                "Rho": st.column_config.NumberColumn(format="%.3f"),
-                            })
-            
-            st.markdown("---")
-            st.markdown("#### 🔍 Análise Detalhada da Opção")
-            
-            opcoes_disponiveis = df['Ticker'].tolist()
-            if opcoes_disponiveis:
-                opcao_selecionada = st.selectbox("Selecione uma opção para ver a análise completa:", options=opcoes_disponiveis, key=f"select_{tipo_opcao}")
-                analise = df[df['Ticker'] == opcao_selecionada]['Análise Detalhada'].iloc[0]
-                st.success(analise)
+    st.divider()
+    painel_superficie_volatilidade(ticker_selecionado)
 
-        with tab_calls:
-            exibir_tabela_e_analise(df_calls, "CALL")
+# ==============================================================================
+# ABA 5: SCANNER TÉCNICO
+# ==============================================================================
 
-        with tab_puts:
-            exibir_tabela_e_analise(df_puts, "PUT")
-        
-        with st.expander("📖 Glossário das Gregas (O que significam?)"):
-            st.markdown("""
-            As **"Greeks" (Gregas)** são um conjunto de indicadores que medem a sensibilidade do preço de uma opção a diferentes fatores de risco. Entendê-las é fundamental para gerenciar o risco de suas operações.
+SINAIS_SCANNER = ["COMPRA FORTE", "COMPRA", "NEUTRO", "VENDA", "VENDA FORTE"]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def baixar_precos_lote(tickers_sa, period="2y", interval="1d"):
+    """
+    Preços de vários ativos em uma única chamada ao yfinance (que baixa em paralelo).
+    Devolve ticker -> DataFrame com colunas minúsculas. Os ativos que vierem vazios no lote
+    são buscados individualmente por get_stock_data (fallback brapi/Alpha Vantage), em paralelo.
+    """
+    tickers_sa = list(tickers_sa)
+    precos = {}
+    try:
+        lote = yf.download(tickers_sa, period=period, interval=interval, group_by='ticker',
+                           auto_adjust=True, threads=True, progress=False)
+        for ticker in set(lote.columns.get_level_values(0)) & set(tickers_sa):
+            df = lote[ticker].dropna(how='all')
+            if not df.empty:
+                df.columns = [col.lower() for col in df.columns]
+                precos[ticker] = df
+    except Exception as e:
+        logging.warning(f"Download em lote do yfinance falhou ({e}); buscando os ativos individualmente.")
+
+    faltantes = [ticker for ticker in tickers_sa if ticker not in precos]
+    if faltantes:
+        with ThreadPoolExecutor(max_workers=min(8, len(faltantes))) as executor:
+            for ticker, df in zip(faltantes, executor.map(lambda t: get_stock_data(t, period, interval), faltantes)):
+                if df is not None and not df.empty:
+                    if isinstance(df.columns, pd.MultiIndex):
+                        df = df.copy()
+                        df.columns = df.columns.droplevel(0)
+                    precos[ticker] = df
+    return precos
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def leituras_tecnicas_universo(tickers_sa, timeframe='daily'):
+    """
+    Leituras dos indicadores da última barra de todos os ativos (um por linha), com as mesmas
+    barras de analise_tecnica_ativo. Os indicadores são calculados de uma vez para o
+    universo inteiro por indicadores.calcular_universo; limiares e pesos ficam fora do cache.
+    """
+    # Um único lote diário serve aos dois timeframes (as barras semanais são reamostradas dele)
+    precos = baixar_precos_lote(tickers_sa, period=PERIODO_HISTORICO_DIARIO, interval="1d")
+    precos = {ticker: _barras_timeframe(df[['high', 'low', 'close']].dropna(), timeframe) for ticker, df in precos.items()}
+    precos = {ticker: df for ticker, df in precos.items() if len(df) >= MIN_BARRAS_INDICADORES}
+    if not precos:
+        return pd.DataFrame()
+    return calcular_universo(precos)
+
+def pontuar_universo(leituras_diario, leituras_semanal, ticker_cvm_map_df, thresholds):
+    """
+    Sinal de convergência de cada ativo a partir das leituras em cache: viés semanal primeiro e
+    depois o score diário com o viés e os limiares, como em ui_black_scholes. Só Python puro
+    sobre ~275 linhas, então mudar os limiares repontua o mercado instantaneamente.
+    """
+    empresas = ticker_cvm_map_df.drop_duplicates('TICKER').set_index('TICKER')['Nome_Empresa']
+    linhas = []
+    for ticker_sa, leituras in leituras_diario.iterrows():
+        vies_semanal = "N/A"
+        if ticker_sa in leituras_semanal.index:
+            _, _, _, vies_semanal = pontuar_sinais_tecnicos(leituras_semanal.loc[ticker_sa].to_dict(), timeframe='weekly')
+        weekly_bias_value = 1 if vies_semanal == "Alta" else (-1 if vies_semanal == "Baixa" else 0)
+        sinal, score, valores, _ = pontuar_sinais_tecnicos(leituras.to_dict(), 'daily', weekly_bias_value, thresholds)
+        ticker = ticker_sa.replace(".SA", "")
+        linhas.append({
+            'Ticker': ticker, 'Empresa': empresas.get(ticker, ""), 'Sinal': sinal, 'Score': score,
+            'Viés Semanal': vies_semanal, 'Preço (R$)': leituras['close'], 'RSI': leituras['rsi'],
+            'ADX': leituras['adx'], 'Estocástico': leituras['stoch_k'],
+            'MACD': valores['MACD'], 'EMA (9 vs 21)': valores['EMA (9 vs 21)'], 'SAR': valores['SAR Parabólico'],
+            'Último Pregão': leituras['ultima_barra'],
+        })
+    return pd.DataFrame(linhas)
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def dados_backtest_universo(tickers_sa):
+    """
+    Histórico completo dos indicadores (diário e semanal) de todos os ativos, preparado para o
+    backtest. Usa o mesmo lote diário (5 anos) do scanner e da leitura atual.
+
+    Em cache_resource: o DadosBacktest é só lido pelo backtest e pela busca em grade, então a
+    mesma instância é compartilhada, sem ser copiada a cada rerun. O horizonte fica fora da
+    chave: trocá-lo não baixa nem recalcula os indicadores, e os padrões e retornos de cada
+    horizonte ficam guardados na instância.
+    """
+    precos = baixar_precos_lote(tickers_sa, period=PERIODO_HISTORICO_DIARIO, interval="1d")
+    precos = {ticker: df[['high', 'low', 'close']].dropna() for ticker, df in precos.items()}
+    precos = {ticker: df for ticker, df in precos.items() if len(df) >= MIN_BARRAS_INDICADORES}
+    if not precos:
+        return None
+    _, series = calcular_universo(precos, historico=True)
+    _, series_semanais = calcular_universo({ticker: reamostrar_barras(df, 'weekly') for ticker, df in precos.items()}, historico=True)
+    return DadosBacktest(series, series_semanais)
+
+@st.fragment
+def painel_backtest_sinal(tickers_sa):
+    """Backtest do sinal de convergência em todo o histórico e busca em grade de pesos e limiares."""
+    st.subheader("🧪 Backtest do Sinal de Convergência")
+    st.caption("""
+    Calcula o sinal de todas as barras dos últimos 5 anos com os pesos atuais e os limiares acima. COMPRA = posição comprada,
+    VENDA = vendida, NEUTRO = zerada. O **acerto** e o **retorno médio** usam o retorno do horizonte escolhido a partir da barra do sinal;
+    a **estratégia** segue o sinal barra a barra (carteira igualmente ponderada no universo). O viés semanal só vale após o fechamento da semana.
+    """)
+    thresholds = {'forte': st.session_state.get('scanner_limiar_forte', 0.65), 'normal': st.session_state.get('scanner_limiar_normal', 0.25)}
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        horizonte = st.selectbox("Horizonte do retorno (pregões)", [5, 10, 20, 60], index=1, key="backtest_horizonte")
+    with col2:
+        st.write(""); st.write("")
+        rodar_btn = st.button("Rodar Backtest", use_container_width=True, key="backtest_rodar")
+
+    if rodar_btn:
+        with st.spinner("Calculando o histórico dos indicadores de todos os ativos..."):
+            dados = dados_backtest_universo(tickers_sa)
+        if dados is None:
+            st.warning("Nenhum ativo com dados suficientes para o backtest.")
+            return
+        st.session_state['backtest_resultado'] = (horizonte, thresholds, backtest_sinal(dados, PESOS_SINAIS_TECNICOS, thresholds, horizonte))
+
+    if 'backtest_resultado' in st.session_state:
+        horizonte_resultado, limiares_resultado, resultado = st.session_state['backtest_resultado']
+        universo = resultado.universo
+        st.caption(f"Horizonte de {horizonte_resultado} pregões, limiares {limiares_resultado['forte']:.2f} / {limiares_resultado['normal']:.2f}.")
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Sinais", f"{universo['Sinais']:,.0f}")
+        col2.metric("Acerto", f"{universo['Acerto (%)']:.1f}%")
+        col3.metric("Retorno Médio", f"{universo['Retorno Médio (%)']:.2f}%")
+        col4.metric("Retorno Estratégia", f"{universo['Retorno Estratégia (%)']:.1f}%")
+        col5.metric("Drawdown Máximo", f"{universo['Drawdown Máximo (%)']:.1f}%")
+        fig = px.line(x=resultado.patrimonio.index, y=resultado.patrimonio.values, labels={'x': 'Data', 'y': 'Patrimônio (início = 1)'},
+                      title="Carteira do sinal (universo, igualmente ponderada)")
+        st.plotly_chart(fig, use_container_width=True)
+        por_ticker = resultado.por_ticker.rename(index=lambda ticker: ticker.replace(".SA", "")).rename_axis('Ticker').reset_index()
+        st.dataframe(por_ticker.sort_values('Retorno Médio (%)', ascending=False), use_container_width=True, hide_index=True,
+                     column_config={col: st.column_config.NumberColumn(format="%.2f") for col in por_ticker.columns if '%' in col})
+
+    with st.expander("🔎 Busca em grade de pesos e limiares"):
+        st.caption("Cada peso atual é multiplicado por cada multiplicador (e renormalizado para a mesma soma); todas as combinações são testadas com todos os pares de limiares (FORTE > NORMAL).")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            multiplicadores = st.multiselect("Multiplicadores dos pesos", [0.0, 0.5, 1.0, 1.5, 2.0], default=[0.0, 1.0, 2.0], key="grade_multiplicadores")
+            criterio = st.selectbox("Ordenar por", list(CRITERIOS_BUSCA), format_func=CRITERIOS_BUSCA.get, key="grade_criterio")
+        with col2:
+            limiares_forte = st.multiselect("Limiares FORTE", [0.5, 0.6, 0.65, 0.7, 0.8, 0.9], default=[0.5, 0.65, 0.8], key="grade_limiares_forte")
+            min_sinais = st.number_input("Mínimo de sinais", 1, 100000, 100, key="grade_min_sinais")
+        with col3:
+            limiares_normal = st.multiselect("Limiares NORMAL", [0.1, 0.15, 0.2, 0.25, 0.3, 0.4], default=[0.15, 0.25, 0.3], key="grade_limiares_normal")
+        if st.button("Buscar Melhores Configurações", key="grade_buscar") and multiplicadores:
+            grade = grade_pesos(PESOS_SINAIS_TECNICOS, multiplicadores)
+            with st.spinner(f"Testando {len(grade)} combinações de pesos em todos os ativos..."):
+                dados = dados_backtest_universo(tickers_sa)
+                if dados is None:
+                    st.warning("Nenhum ativo com dados suficientes para o backtest.")
+                    return
+                inicio = datetime.now()
+                st.session_state['grade_resultado'] = busca_em_grade(dados, grade, limiares_forte, limiares_normal, criterio, min_sinais, horizonte=horizonte)
+                st.session_state['grade_duracao'] = (len(grade), (datetime.now() - inicio).total_seconds())
+        if 'grade_resultado' in st.session_state:
+            combinacoes, duracao = st.session_state['grade_duracao']
+            st.caption(f"{combinacoes} combinações de pesos avaliadas em {duracao:.1f} s.")
+            st.dataframe(st.session_state['grade_resultado'], use_container_width=True, hide_index=True,
+                         column_config={col: st.column_config.NumberColumn(format="%.2f") for col in st.session_state['grade_resultado'].columns})
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def volatilidades_universo(tickers_sa, dias_garch=21):
+    """Todos os estimadores de volatilidade para todo o mercado, a partir do lote diário do scanner (GARCH incluso)."""
+    precos = baixar_precos_lote(tickers_sa, period=PERIODO_HISTORICO_DIARIO, interval="1d")
+    precos = {ticker: df for ticker, df in precos.items() if df['close'].notna().sum() > MIN_BARRAS_INDICADORES}
+    if not precos:
+        return pd.DataFrame()
+    return estimar_volatilidades(painel_ohlc(precos), dias_garch=dias_garch)
+
+@st.fragment
+def painel_volatilidade_mercado(tickers_sa):
+    """Tabela de volatilidades de todo o mercado por estimador."""
+    st.subheader("📉 Volatilidade do Mercado")
+    st.caption("Close-to-Close, EWMA, Parkinson, Garman-Klass e Yang-Zhang no último ano de pregões e GARCH(1,1) ajustado em até 4 anos, para todos os ativos de uma vez. O resultado fica em cache por um dia.")
+    if st.button("Calcular Volatilidades", key="volatilidade_calcular"):
+        inicio = datetime.now()
+        with st.spinner(f"Estimando a volatilidade de {len(tickers_sa)} ativos..."):
+            st.session_state['volatilidades_mercado'] = volatilidades_universo(tickers_sa)
+        st.session_state['volatilidades_duracao'] = (datetime.now() - inicio).total_seconds()
+
+    df_vol = st.session_state.get('volatilidades_mercado')
+    if df_vol is None:
+        return
+    if df_vol.empty:
+        st.warning("Nenhum ativo com dados suficientes para estimar a volatilidade.")
+        return
+    garch = df_vol.attrs['garch']
+    tabela = (df_vol * 100).rename(columns=ESTIMADORES)
+    tabela['Persistência GARCH'] = garch['persistencia']
+    tabela = tabela.rename(index=lambda ticker: ticker.replace(".SA", "")).rename_axis('Ticker').reset_index()
+    st.caption(f"{len(tabela)} ativos em {st.session_state['volatilidades_duracao']:.1f} s.")
+    st.dataframe(tabela.sort_values(ESTIMADORES['yang_zhang'], ascending=False), use_container_width=True, hide_index=True,
+                 column_config={**{nome: st.column_config.NumberColumn(format="%.1f%%") for nome in ESTIMADORES.values()},
+                                'Persistência GARCH': st.column_config.NumberColumn(format="%.3f")})
+    st.download_button(label="📥 Baixar Volatilidades (.csv)", data=convert_df_to_csv(tabela), file_name='volatilidades_mercado.csv', mime='text/csv')
+
+def ui_scanner_tecnico():
+    """Renderiza a aba do scanner técnico de todo o mercado."""
+    st.header("Scanner Técnico de Mercado")
+    st.info("""
+    Aplica a análise técnica de convergência da aba Black-Scholes (RSI, MACD, Bollinger, EMAs, ADX, Estocástico e SAR, com o viés semanal)
+    a **todos os ativos** do mapeamento de uma vez. Os preços são baixados em lote e ficam em cache por uma hora; mudar os limiares apenas repontua.
+    """)
 
-            - **Delta (Δ):** Mede a velocidade da opção. Indica o quanto o preço da opção tende a mudar para cada R$ 1,00 de variação no preço do ativo-objeto.
-              - *Exemplo:* Um Delta de 0.60 significa que, se a ação subir R$ 1,00, o preço da opção de compra (CALL) tende a valorizar R$ 0,60.
+    ticker_cvm_map_df = carregar_mapeamento_ticker_cvm()
+    if ticker_cvm_map_df.empty:
+        st.error("Não foi possível carregar o mapeamento de tickers."); st.stop()
+    tickers_sa = tuple(sorted(f"{ticker}.SA" for ticker in ticker_cvm_map_df['TICKER'].unique()))
 
-            - **Gamma (Γ):** Mede a aceleração do Delta. Mostra o quão rápido o Delta de uma opção muda conforme o preço do ativo-objeto se altera.
-              - *Exemplo:* Um Gamma alto significa que o Delta é muito sensível, mudando rapidamente. Isso é comum em opções "no dinheiro" (ATM) e próximas do vencimento.
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        limiar_forte = st.slider("Limiar para Sinal FORTE", 0.1, 1.0, 0.65, 0.05, key="scanner_limiar_forte")
+    with col2:
+        limiar_normal = st.slider("Limiar para Sinal NORMAL", 0.1, 1.0, 0.25, 0.05, key="scanner_limiar_normal")
+    with col3:
+        st.write(""); st.write("")
+        escanear_btn = st.button("📡 Escanear Mercado", type="primary", use_container_width=True)
+
+    if escanear_btn:
+        inicio = datetime.now()
+        with st.spinner(f"Calculando indicadores diários e semanais de {len(tickers_sa)} ativos..."):
+            try:
+                st.session_state['scanner_leituras'] = (leituras_tecnicas_universo(tickers_sa, 'daily'),
+                                                        leituras_tecnicas_universo(tickers_sa, 'weekly'))
+                st.session_state['scanner_duracao'] = (datetime.now() - inicio).total_seconds()
+            except Exception as e:
+                st.error(f"Falha ao escanear o mercado: {e}")
 
-            - **Vega (ν):** Mede o impacto da volatilidade. Indica o quanto o preço da opção muda para cada 1% de variação na volatilidade do ativo.
-              - *Exemplo:* Se você acredita que a volatilidade do mercado vai aumentar, deve procurar opções com Vega positivo e alto, pois elas se beneficiarão mais desse movimento.
+    if 'scanner_leituras' in st.session_state:
+        exibir_scanner(ticker_cvm_map_df, tickers_sa, {'forte': limiar_forte, 'normal': limiar_normal})
+    st.divider()
+    painel_backtest_sinal(tickers_sa)
+    st.divider()
+    painel_volatilidade_mercado(tickers_sa)
 
-            - **Theta (Θ):** Mede o custo do tempo. Indica o quanto o preço da opção perde de valor a cada dia que passa, devido à aproximação do vencimento (decaimento temporal).
-              - *Exemplo:* Um Theta de -0.05 significa que a opção perde R$ 0,05 de seu valor extrínseco por dia, mantendo os outros fatores constantes. É o "aluguel" que se paga por manter a posição.
+def exibir_scanner(ticker_cvm_map_df, tickers_sa, thresholds):
+    """Tabela do scanner, repontuada com os limiares atuais a partir das leituras em cache."""
+    leituras_diario, leituras_semanal = st.session_state['scanner_leituras']
+    if leituras_diario.empty:
+        st.warning("Nenhum ativo com dados suficientes para a análise técnica.")
+        return
 
-            - **Rho (ρ):** Mede o impacto dos juros. Indica a sensibilidade do preço da opção a uma variação de 1% na taxa de juros livre de risco.
-              - *Exemplo:* Geralmente, tem um impacto menor no preço de opções de curto prazo, mas é relevante para opções de longo prazo (LEAPs).
-            """)
+    df_scanner = pontuar_universo(leituras_diario, leituras_semanal, ticker_cvm_map_df, thresholds)
+    st.success(f"{len(df_scanner)} de {len(tickers_sa)} ativos analisados em {st.session_state['scanner_duracao']:.1f} s.")
+
+    contagem = df_scanner['Sinal'].value_counts()
+    colunas = st.columns(len(SINAIS_SCANNER))
+    for coluna, sinal in zip(colunas, SINAIS_SCANNER):
+        coluna.metric(sinal.title(), int(contagem.get(sinal, 0)))
+
+    filtro = st.multiselect("Filtrar por sinal", SINAIS_SCANNER, default=SINAIS_SCANNER, key="scanner_filtro_sinais")
+    df_filtrado = df_scanner[df_scanner['Sinal'].isin(filtro)].sort_values('Score', ascending=False).reset_index(drop=True)
+    st.dataframe(df_filtrado, use_container_width=True, hide_index=True, column_config={
+        'Score': st.column_config.NumberColumn(format="%.2f"),
+        'Preço (R$)': st.column_config.NumberColumn(format="R$ %.2f"),
+        'RSI': st.column_config.NumberColumn(format="%.1f"),
+        'ADX': st.column_config.NumberColumn(format="%.1f"),
+        'Estocástico': st.column_config.NumberColumn(format="%.1f"),
+        'Último Pregão': st.column_config.DateColumn(format="DD/MM/YYYY"),
+    })
+    st.download_button(label="📥 Baixar Resultado do Scanner (.csv)", data=convert_df_to_csv(df_filtrado),
+                       file_name='scanner_tecnico.csv', mime='text/csv')
 
 # ==============================================================================
 # ESTRUTURA PRINCIPAL DO APP
@@ -2204,10 +2954,24 @@ def login_screen():
                         st.error(f"Erro ao criar conta: {e}")
     st.stop()
 
+def exibir_tempos_importacao():
+    """Tempos de carga das bibliotecas importadas tardiamente neste processo, na barra lateral."""
+    tempos = relatorio_importacao()
+    with st.sidebar.expander("⏱️ Tempos de Importação"):
+        if not tempos:
+            st.caption("Nenhuma biblioteca pesada foi carregada ainda.")
+            return
+        st.dataframe(pd.DataFrame(tempos, columns=['Módulo', 'Tempo (ms)']), hide_index=True, use_container_width=True,
+                     column_config={'Tempo (ms)': st.column_config.NumberColumn(format="%.0f")})
+        st.caption(f"Total: {sum(ms for _, ms in tempos):.0f} ms. Cada biblioteca é carregada uma vez por processo, "
+                   "no primeiro uso pela aba que precisa dela.")
+
 def main_app():
     """Mostra o aplicativo principal após o login."""
     st.sidebar.write(f"Logado como: {st.session_state.user.user.email}")
-    if st.sidebar.button("Sair (Logout)"):
+    if armazenamento_local():
+        st.sidebar.caption("Dados gravados no banco local (SQLite).")
+    elif st.sidebar.button("Sair (Logout)"):
         st.session_state.user = None
         st.rerun()
 
@@ -2215,20 +2979,26 @@ def main_app():
     st.title("Sistema de Controle Financeiro e Análise de Investimentos")
     inicializar_session_state()
     
-    tabs = st.tabs(["💲 Controle Financeiro", "📈 Análise de Valuation", "🔬 Modelo Fleuriet", "🤖 Black-Scholes"])
-    
-    with tabs[0]:
-        ui_controle_financeiro()
-    with tabs[1]:
-        ui_valuation()
-    with tabs[2]:
-        ui_modelo_fleuriet()
-    with tabs[3]:
-        ui_black_scholes()
+    # Cada seção é uma página de st.navigation: a cada interação só a página visível é executada
+    # (com st.tabs, as seções rodavam em todo rerun, mesmo escondidas)
+    pagina = st.navigation([
+        st.Page(ui_controle_financeiro, title="Controle Financeiro", icon="💲", url_path="controle-financeiro", default=True),
+        st.Page(ui_valuation, title="Análise de Valuation", icon="📈", url_path="valuation"),
+        st.Page(ui_modelo_fleuriet, title="Modelo Fleuriet", icon="🔬", url_path="fleuriet"),
+        st.Page(ui_black_scholes, title="Black-Scholes", icon="🤖", url_path="black-scholes"),
+        st.Page(ui_scanner_tecnico, title="Scanner Técnico", icon="📡", url_path="scanner-tecnico"),
+    ], position="top")
+    pagina.run()
+    # Depois da página, para incluir as bibliotecas que ela acabou de carregar
+    exibir_tempos_importacao()
 
 def main():
     """Função principal que decide se mostra a tela de login ou o app."""
     
+    # Com o banco local não há login: a sessão usa o usuário local fixo
+    if armazenamento_local():
+        st.session_state.user = USUARIO_LOCAL
+
     # Verifica se a "credencial" do usuário existe na memória da sessão
     if 'user' not in st.session_state or st.session_state.user is None:
         # Se NÃO existir, mostra a tela de login. A função login_screen()
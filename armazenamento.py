@@ -0,0 +1,236 @@
+# armazenamento.py
+"""
+Backends de armazenamento da tabela 'transactions'.
+
+A aplicação conversa com o banco apenas através da interface BackendArmazenamento.
+Há duas implementações:
+- BackendSupabase: o banco hospedado usado em produção (cliente criado em supabase_client.py).
+- BackendSQLite: um banco embutido (biblioteca padrão do Python) que roda as consultas
+  analíticas no próprio processo. Serve para desenvolvimento offline, testes de carga com
+  ledgers sintéticos de milhões de linhas e instalações de um único usuário.
+"""
+
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+# Colunas que podem ser gravadas pelo usuário (o 'id' e o 'created_at' são gerados pelo banco)
+COLUNAS_GRAVAVEIS = ['user_id', 'Data', 'Tipo', 'Categoria', 'Subcategoria ARCA', 'Valor', 'Descrição']
+
+def dias_locais(datas: pd.Series) -> pd.Series:
+    """Data (sem hora e sem fuso) de cada lançamento, usada como chave dos totais diários."""
+    datas = pd.to_datetime(datas, format='ISO8601')
+    if getattr(datas.dtype, 'tz', None) is not None:
+        datas = datas.dt.tz_localize(None)
+    return datas.dt.normalize()
+
+def agregar_totais_diarios(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Soma e contagem de lançamentos por dia e tipo, calculadas em memória.
+    Devolve as colunas 'Dia', 'Tipo', 'Valor' e 'Quantidade'.
+    """
+    colunas = ['Dia', 'Tipo', 'Valor', 'Quantidade']
+    if df.empty:
+        return pd.DataFrame(columns=colunas)
+    validas = df['Valor'].notna() & df['Tipo'].notna() & df['Data'].notna()
+    if not validas.any():
+        return pd.DataFrame(columns=colunas)
+    dias = dias_locais(df['Data'][validas]).to_numpy()
+    tipos = df['Tipo'][validas].astype(str).to_numpy()
+    totais = df['Valor'][validas].groupby([dias, tipos]).agg(['sum', 'count'])
+    totais.index.names = ['Dia', 'Tipo']
+    return totais.rename(columns={'sum': 'Valor', 'count': 'Quantidade'}).reset_index()[colunas]
+
+
+class BackendArmazenamento(ABC):
+    """
+    Interface comum dos backends. Todas as operações levantam exceções em caso de falha;
+    o tratamento (novas tentativas, mensagens na tela) fica com quem chama.
+    Um backend que não implemente as quatro operações básicas falha já ao ser instanciado.
+    """
+
+    @abstractmethod
+    def buscar_transacoes(self, user_id: str) -> pd.DataFrame:
+        """Todas as transações do usuário, da mais recente para a mais antiga."""
+
+    @abstractmethod
+    def inserir_transacoes(self, linhas: list) -> list:
+        """Insere as linhas e devolve-as como gravadas (com 'id' e 'created_at'), na mesma ordem."""
+
+    @abstractmethod
+    def atualizar_transacao(self, transaction_id: int, data: dict, user_id: str):
+        """Atualiza as colunas informadas de uma transação do usuário."""
+
+    @abstractmethod
+    def excluir_transacoes(self, transaction_ids: list, user_id: str):
+        """Exclui as transações informadas, desde que pertençam ao usuário."""
+
+    def totais_diarios(self, user_id: str, transacoes: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Soma e contagem por dia e tipo ('Dia', 'Tipo', 'Valor', 'Quantidade').
+        Se o DataFrame de transações já estiver em memória, ele é usado no lugar de uma nova consulta.
+        """
+        if transacoes is None:
+            transacoes = self.buscar_transacoes(user_id)
+        return agregar_totais_diarios(transacoes)
+
+    def totais_mensais(self, user_id: str, transacoes: pd.DataFrame = None) -> pd.DataFrame:
+        """Soma por mês (último dia do mês) e tipo, derivada dos totais diários."""
+        diarios = self.totais_diarios(user_id, transacoes)
+        if diarios.empty:
+            return pd.DataFrame(columns=['Mes', 'Tipo', 'Valor', 'Quantidade'])
+        meses = pd.to_datetime(diarios['Dia']) + pd.offsets.MonthEnd(0)
+        mensais = diarios.groupby([meses.rename('Mes'), 'Tipo'])[['Valor', 'Quantidade']].sum()
+        return mensais.reset_index()
+
+
+class BackendSupabase(BackendArmazenamento):
+    """Tabela 'transactions' no Supabase (PostgREST), acessada pela rede."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def buscar_transacoes(self, user_id: str) -> pd.DataFrame:
+        # A query filtra pela coluna 'user_id' para buscar apenas os dados do usuário logado
+        response = self.client.table("transactions").select("*").eq("user_id", user_id).order("Data", desc=True).execute()
+        return pd.DataFrame(response.data) if response.data else pd.DataFrame()
+
+    def inserir_transacoes(self, linhas: list) -> list:
+        response = self.client.table("transactions").insert(linhas).execute()
+        return response.data or []
+
+    def atualizar_transacao(self, transaction_id: int, data: dict, user_id: str):
+        # A query de update tem duas condições:
+        # 1. O 'id' da transação deve corresponder.
+        # 2. O 'user_id' da transação deve corresponder ao do usuário logado.
+        return self.client.table("transactions").update(data).eq("id", transaction_id).eq("user_id", user_id).execute()
+
+    def excluir_transacoes(self, transaction_ids: list, user_id: str):
+        return self.client.table("transactions").delete().in_("id", transaction_ids).eq("user_id", user_id).execute()
+
+
+class BackendSQLite(BackendArmazenamento):
+    """
+    Tabela 'transactions' em um arquivo SQLite local (ou ':memory:').
+    As agregações são feitas em SQL, no próprio processo, sem carregar as linhas no pandas
+    (o DataFrame de transações recebido por totais_diarios/totais_mensais é ignorado).
+    """
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+            user_id TEXT NOT NULL,
+            "Data" TEXT NOT NULL,
+            "Tipo" TEXT NOT NULL,
+            "Categoria" TEXT,
+            "Subcategoria ARCA" TEXT,
+            "Valor" REAL NOT NULL DEFAULT 0,
+            "Descrição" TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_data ON transactions (user_id, "Data");
+    """
+
+    def __init__(self, caminho: str = ":memory:"):
+        self.caminho = caminho
+        # A fila de escrita grava a partir de outra thread; o lock serializa o acesso à conexão
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(caminho, check_same_thread=False)
+        self._con.row_factory = sqlite3.Row
+        if caminho != ":memory:":
+            self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.executescript(self.ESQUEMA)
+
+    @staticmethod
+    def _colunas(data: dict) -> list:
+        return [c for c in COLUNAS_GRAVAVEIS if c in data]
+
+    @staticmethod
+    def _valor_sql(valor):
+        """Converte escalares do numpy/pandas (vindos do data_editor) para tipos aceitos pelo sqlite3."""
+        if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+            return None
+        return valor.item() if hasattr(valor, 'item') else valor
+
+    def buscar_transacoes(self, user_id: str) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query('SELECT * FROM transactions WHERE user_id = ? ORDER BY "Data" DESC', self._con, params=[user_id])
+
+    def inserir_transacoes(self, linhas: list) -> list:
+        gravadas = []
+        with self._lock, self._con:
+            for linha in linhas:
+                colunas = self._colunas(linha)
+                nomes = ", ".join(f'"{c}"' for c in colunas)
+                marcadores = ", ".join("?" for _ in colunas)
+                sql = f'INSERT INTO transactions ({nomes}) VALUES ({marcadores}) RETURNING *'
+                gravadas.append(dict(self._con.execute(sql, [self._valor_sql(linha[c]) for c in colunas]).fetchone()))
+        return gravadas
+
+    def atualizar_transacao(self, transaction_id: int, data: dict, user_id: str):
+        colunas = [c for c in self._colunas(data) if c != 'user_id']
+        if not colunas:
+            return None
+        atribuicoes = ", ".join(f'"{c}" = ?' for c in colunas)
+        with self._lock, self._con:
+            self._con.execute(f'UPDATE transactions SET {atribuicoes} WHERE id = ? AND user_id = ?',
+                              [self._valor_sql(data[c]) for c in colunas] + [int(transaction_id), user_id])
+
+    def excluir_transacoes(self, transaction_ids: list, user_id: str):
+        if not transaction_ids:
+            return None
+        marcadores = ", ".join("?" for _ in transaction_ids)
+        with self._lock, self._con:
+            self._con.execute(f'DELETE FROM transactions WHERE user_id = ? AND id IN ({marcadores})',
+                              [user_id] + [int(i) for i in transaction_ids])
+
+    def totais_diarios(self, user_id: str, transacoes: pd.DataFrame = None) -> pd.DataFrame:
+        # As datas são gravadas em ISO 8601, então os 10 primeiros caracteres são o dia
+        sql = '''SELECT substr("Data", 1, 10) AS Dia, "Tipo", SUM("Valor") AS Valor, COUNT(*) AS Quantidade
+                 FROM transactions WHERE user_id = ? GROUP BY 1, 2 ORDER BY 1'''
+        with self._lock:
+            totais = pd.read_sql_query(sql, self._con, params=[user_id])
+        totais['Dia'] = pd.to_datetime(totais['Dia'])
+        return totais
+
+    def totais_mensais(self, user_id: str, transacoes: pd.DataFrame = None) -> pd.DataFrame:
+        sql = '''SELECT substr("Data", 1, 7) AS Mes, "Tipo", SUM("Valor") AS Valor, COUNT(*) AS Quantidade
+                 FROM transactions WHERE user_id = ? GROUP BY 1, 2 ORDER BY 1'''
+        with self._lock:
+            totais = pd.read_sql_query(sql, self._con, params=[user_id])
+        totais['Mes'] = pd.to_datetime(totais['Mes'], format='%Y-%m') + pd.offsets.MonthEnd(0)
+        return totais
+
+    def gerar_ledger_sintetico(self, user_id: str, n_linhas: int, anos: int = 5, seed: int = 42):
+        """
+        Popula o banco com um ledger aleatório para testes de carga.
+        A inserção usa executemany em lotes, sem RETURNING, para carregar milhões de linhas rapidamente.
+        """
+        rng = np.random.default_rng(seed)
+        categorias = {
+            'Receita': ['Salário', 'Freelance'],
+            'Despesa': ['Moradia', 'Alimentação', 'Transporte', 'Saúde', 'Vestuário'],
+            'Investimento': ['Ações BR', 'REITs (FII)', 'Caixa', 'Ações Internacionais'],
+        }
+        tipos = np.array(list(categorias))
+        inicio = pd.Timestamp.today().normalize() - pd.DateOffset(years=anos)
+        lote = 100_000
+        sql = ('INSERT INTO transactions (user_id, "Data", "Tipo", "Categoria", "Subcategoria ARCA", "Valor", "Descrição") '
+               'VALUES (?, ?, ?, ?, ?, ?, ?)')
+        for inicio_lote in range(0, n_linhas, lote):
+            n = min(lote, n_linhas - inicio_lote)
+            tipo = tipos[rng.choice(3, size=n, p=[0.15, 0.7, 0.15])]
+            datas = (inicio + pd.to_timedelta(rng.integers(0, anos * 365, size=n), unit='D')).strftime('%Y-%m-%dT00:00:00')
+            valores = np.round(rng.lognormal(mean=5.0, sigma=1.0, size=n), 2)
+            sorteio = rng.integers(0, 60, size=n)  # 60 é múltiplo do número de categorias de cada tipo
+            categoria = np.empty(n, dtype=object)
+            for t, nomes in categorias.items():
+                mascara = tipo == t
+                categoria[mascara] = np.array(nomes, dtype=object)[sorteio[mascara] % len(nomes)]
+            arca = np.where(tipo == 'Investimento', categoria, None)
+            linhas = zip([user_id] * n, datas, tipo.tolist(), categoria, arca, valores.tolist(), [None] * n)
+            with self._lock, self._con:
+                self._con.executemany(sql, linhas)
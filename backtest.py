@@ -0,0 +1,285 @@
+# backtest.py
+"""
+Backtest vetorizado do sinal de convergência técnica (pontuar_sinais_tecnicos).
+
+As leituras históricas de todos os ativos (indicadores.calcular_universo com historico=True)
+viram matrizes datas x tickers de sinais -1/0/1 por indicador. O score ponderado, os limiares
+FORTE/NORMAL e as métricas (acerto, retorno futuro, drawdown) são calculados para todas as
+barras e todos os ativos de uma vez. A busca em grade agrupa as barras pelos padrões de sinais
+distintos (o score só depende deles) e avalia todas as combinações de pesos e de limiares sobre
+esses padrões. Não depende do Streamlit.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# Mesma ordem de pontuar_sinais_tecnicos (a soma do score segue essa ordem)
+INDICADORES = ('RSI', 'MACD', 'BOLLINGER', 'EMA', 'ADX', 'STOCH', 'SAR')
+PESO_VIES_SEMANAL = 0.15
+CLASSES_SINAL = {2: "COMPRA FORTE", 1: "COMPRA", 0: "NEUTRO", -1: "VENDA", -2: "VENDA FORTE"}
+CRITERIOS_BUSCA = {
+    'retorno_medio': 'Retorno Médio (%)',
+    'acerto': 'Acerto (%)',
+    'retorno_estrategia': 'Retorno Estratégia (%)',
+    'drawdown': 'Drawdown Máximo (%)',
+}
+
+def _sinal(alta, baixa) -> np.ndarray:
+    """1 onde 'alta', -1 onde 'baixa', 0 no resto."""
+    return np.where(alta, 1, np.where(baixa, -1, 0)).astype(np.int8)
+
+def sinais_indicadores(series: dict) -> dict:
+    """
+    Sinais -1/0/1 de cada indicador em todas as barras, com as regras de
+    pontuar_sinais_tecnicos. 'series' mapeia leitura -> DataFrame (datas x tickers); leituras
+    ausentes (NaN) dão sinal 0, como o "N/A" da análise de um ativo.
+    """
+    v = {nome: df.to_numpy(dtype=float) for nome, df in series.items()}
+    ok = lambda *nomes: np.logical_and.reduce([~np.isnan(v[nome]) for nome in nomes])
+    with np.errstate(invalid='ignore'):
+        macd_ok, ema_ok, bb_ok, adx_ok = ok('macd', 'macd_sinal'), ok('ema_9', 'ema_21'), ok('bb_superior', 'bb_inferior'), ok('adx', 'dmp', 'dmn')
+        adx_forte = v['adx'] > 25
+        return {
+            'RSI': _sinal(v['rsi'] < 30, v['rsi'] > 70),
+            'MACD': _sinal(macd_ok & (v['macd'] > v['macd_sinal']), macd_ok & ~(v['macd'] > v['macd_sinal'])),
+            'BOLLINGER': _sinal(bb_ok & (v['close'] < v['bb_inferior']), bb_ok & (v['close'] > v['bb_superior'])),
+            'EMA': _sinal(ema_ok & (v['ema_9'] > v['ema_21']), ema_ok & ~(v['ema_9'] > v['ema_21'])),
+            'ADX': _sinal(adx_ok & adx_forte & (v['dmp'] > v['dmn']), adx_ok & adx_forte & (v['dmn'] > v['dmp'])),
+            'STOCH': _sinal(v['stoch_k'] < 20, v['stoch_k'] > 80),
+            'SAR': _sinal(ok('psar_alta'), ~ok('psar_alta') & ok('psar_baixa')),
+        }
+
+def vies_semanal_historico(series_semanais: dict, datas, tickers) -> np.ndarray:
+    """
+    Viés semanal (1 Alta, -1 Baixa, 0 Neutro: EMA 9/21 e MACD na mesma direção) alinhado às
+    barras diárias. A barra semanal, rotulada pela segunda-feira, só fecha no fim da semana,
+    então cada viés vale a partir da semana seguinte (sem olhar o futuro no backtest).
+    """
+    sinais = sinais_indicadores(series_semanais)
+    vies = np.where((sinais['EMA'] > 0) & (sinais['MACD'] > 0), 1, np.where((sinais['EMA'] < 0) & (sinais['MACD'] < 0), -1, 0))
+    indice = series_semanais['close'].index
+    df = pd.DataFrame(vies, index=indice + pd.Timedelta(days=7), columns=series_semanais['close'].columns)
+    return df.reindex(columns=tickers).reindex(datas, method='ffill').fillna(0).to_numpy(dtype=np.int8)
+
+def pontuar_historico(sinais: dict, vies, pesos: dict) -> np.ndarray:
+    """Score de convergência de todas as barras (datas x tickers), já com o viés semanal."""
+    score = np.zeros(sinais['RSI'].shape)
+    for indicador in INDICADORES:
+        score = score + pesos.get(indicador, 0) * sinais[indicador]
+    return score + PESO_VIES_SEMANAL * vies
+
+def classificar_sinais(score, sinais: dict, limiar_forte, limiar_normal) -> np.ndarray:
+    """
+    Classe de cada barra (2 COMPRA FORTE ... -2 VENDA FORTE, ver CLASSES_SINAL). Os limiares
+    podem ser arrays (L,) para classificar vários pares de uma vez: o resultado ganha um eixo L
+    na frente. O FORTE exige tendência (MACD ou EMA) e momento (RSI ou Estocástico) alinhados.
+    """
+    limiar_forte = np.asarray(limiar_forte, dtype=float)
+    limiar_normal = np.asarray(limiar_normal, dtype=float)
+    if limiar_forte.ndim:
+        limiar_forte = limiar_forte.reshape(-1, *([1] * score.ndim))
+        limiar_normal = limiar_normal.reshape(-1, *([1] * score.ndim))
+    confirma_alta = ((sinais['MACD'] > 0) | (sinais['EMA'] > 0)) & ((sinais['RSI'] > 0) | (sinais['STOCH'] > 0))
+    confirma_baixa = ((sinais['MACD'] < 0) | (sinais['EMA'] < 0)) & ((sinais['RSI'] < 0) | (sinais['STOCH'] < 0))
+    return np.select(
+        [(score > limiar_forte) & confirma_alta, score > limiar_normal, (score < -limiar_forte) & confirma_baixa, score < -limiar_normal],
+        [2, 1, -2, -1], 0).astype(np.int8)
+
+class DadosBacktest:
+    """
+    Tudo o que não depende de pesos, limiares e horizonte, preparado uma vez: sinais por
+    indicador, viés semanal e retorno da barra seguinte (para a estratégia). Os retornos
+    futuros e o resumo por padrão de cada horizonte são calculados no primeiro uso e guardados.
+    """
+
+    def __init__(self, series: dict, series_semanais: dict = None):
+        close = series['close']
+        self.datas, self.tickers = close.index, list(close.columns)
+        self.sinais = sinais_indicadores(series)
+        if series_semanais is not None:
+            self.vies = vies_semanal_historico(series_semanais, self.datas, self.tickers)
+        else:
+            self.vies = np.zeros(close.shape, dtype=np.int8)
+        # Dias sem pregão do ativo repetem o último preço; barras sem preço não geram sinal
+        self._preco = close.ffill()
+        self.com_preco = close.notna().to_numpy()
+        self.retorno_seguinte = np.nan_to_num((self._preco.shift(-1) / self._preco - 1).to_numpy())
+        self._retornos_futuros = {}
+        self._codigos = None
+        self._padroes = {}
+
+    def retorno_futuro(self, horizonte: int) -> np.ndarray:
+        """Retorno de cada barra até 'horizonte' barras à frente (NaN no fim da série)."""
+        if horizonte not in self._retornos_futuros:
+            self._retornos_futuros[horizonte] = (self._preco.shift(-horizonte) / self._preco - 1).to_numpy()
+        return self._retornos_futuros[horizonte]
+
+    def _padroes_base(self) -> dict:
+        """Padrão de sinais de cada barra com preço e a parte do resumo que não depende do horizonte."""
+        if self._codigos is None:
+            codigo = np.zeros(self.vies.shape, dtype=np.int64)
+            for posicao, indicador in enumerate(INDICADORES):
+                codigo += (self.sinais[indicador].astype(np.int64) + 1) * 3 ** posicao
+            codigo += (self.vies.astype(np.int64) + 1) * 3 ** len(INDICADORES)
+            codigos, padrao = np.unique(codigo[self.com_preco], return_inverse=True)
+            carteira = np.zeros((len(codigos), len(self.datas)))
+            np.add.at(carteira, (padrao, np.nonzero(self.com_preco)[0]), self.retorno_seguinte[self.com_preco])
+            self._codigos = {
+                'padrao': padrao,
+                'sinais': {indicador: (codigos // 3 ** posicao % 3 - 1).astype(np.int8) for posicao, indicador in enumerate(INDICADORES)},
+                'vies': (codigos // 3 ** len(INDICADORES) % 3 - 1).astype(np.int8),
+                'carteira': carteira, 'negociados': np.maximum(self.com_preco.sum(axis=1), 1),
+            }
+        return self._codigos
+
+    def padroes(self, horizonte: int) -> dict:
+        """
+        Resumo das barras por padrão de sinais (os 7 indicadores e o viés, cada um -1/0/1):
+        barras com o mesmo padrão têm o mesmo score e a mesma classe para quaisquer pesos e
+        limiares. Guarda os sinais de cada padrão e, por padrão, a contagem de barras, de
+        retornos futuros positivos e negativos no 'horizonte', a soma deles e a soma dos
+        retornos da barra seguinte em cada data (para a carteira). Os padrões são calculados
+        uma vez; trocar o horizonte só refaz as contagens.
+        """
+        if horizonte not in self._padroes:
+            base = self._padroes_base()
+            padrao, P = base['padrao'], len(base['vies'])
+            futuro = self.retorno_futuro(horizonte)[self.com_preco]
+            valido = ~np.isnan(futuro)
+            contar = lambda mascara, pesos=None: np.bincount(padrao[mascara], weights=pesos, minlength=P)
+            self._padroes[horizonte] = {
+                'sinais': base['sinais'], 'vies': base['vies'],
+                'barras': contar(valido), 'positivos': contar(valido & (futuro > 0)), 'negativos': contar(valido & (futuro < 0)),
+                'soma_retornos': contar(valido, futuro[valido]),
+                'carteira': base['carteira'], 'negociados': base['negociados'],
+            }
+        return self._padroes[horizonte]
+
+def _drawdown_maximo(patrimonio, eixo=0) -> np.ndarray:
+    """Maior queda (negativa) do patrimônio em relação ao pico anterior."""
+    return (patrimonio / np.maximum.accumulate(patrimonio, axis=eixo) - 1).min(axis=eixo)
+
+def _metricas(classe, dados: DadosBacktest, eixo, horizonte):
+    """
+    Métricas das barras com sinal, somadas nos eixos 'eixo' (datas e/ou tickers). COMPRA abre
+    posição comprada e VENDA vendida na barra do sinal; o retorno futuro é o de 'horizonte'
+    barras à frente, com o sinal da direção.
+    """
+    direcao = np.sign(classe)
+    retorno_futuro = dados.retorno_futuro(horizonte)
+    valido = (direcao != 0) & dados.com_preco & ~np.isnan(retorno_futuro)
+    retorno = np.where(valido, direcao * np.nan_to_num(retorno_futuro), 0.0)
+    forte = valido & (np.abs(classe) == 2)
+    n, n_fortes = valido.sum(axis=eixo), forte.sum(axis=eixo)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'Sinais': n,
+            'Acerto (%)': 100 * (valido & (retorno > 0)).sum(axis=eixo) / n,
+            'Retorno Médio (%)': 100 * retorno.sum(axis=eixo) / n,
+            'Sinais Fortes': n_fortes,
+            'Acerto Fortes (%)': 100 * (forte & (retorno > 0)).sum(axis=eixo) / n_fortes,
+            'Retorno Médio Fortes (%)': 100 * np.where(forte, retorno, 0.0).sum(axis=eixo) / n_fortes,
+        }
+
+def _retorno_carteira(classe, dados: DadosBacktest) -> np.ndarray:
+    """Retorno diário da carteira igualmente ponderada entre os ativos negociados em cada barra."""
+    posicao = np.sign(classe) * dados.com_preco
+    negociados = np.maximum(dados.com_preco.sum(axis=1), 1)
+    return (posicao * dados.retorno_seguinte).sum(axis=-1) / negociados
+
+class ResultadoBacktest:
+    """Métricas por ticker e do universo, mais a curva de patrimônio da carteira do sinal."""
+
+    def __init__(self, por_ticker: pd.DataFrame, universo: dict, patrimonio: pd.Series, classes: pd.DataFrame):
+        self.por_ticker = por_ticker
+        self.universo = universo
+        self.patrimonio = patrimonio
+        self.classes = classes
+
+def backtest_sinal(dados: DadosBacktest, pesos: dict, limiares: dict, horizonte: int = 10) -> ResultadoBacktest:
+    """
+    Backtest de uma configuração, com acerto e retorno médio medidos 'horizonte' barras à
+    frente. Por ticker, a estratégia fica comprada enquanto o sinal é de COMPRA, vendida na
+    VENDA e zerada no NEUTRO, com o retorno da barra seguinte; no universo, a carteira divide
+    o capital igualmente entre os ativos.
+    """
+    score = pontuar_historico(dados.sinais, dados.vies, pesos)
+    classe = classificar_sinais(score, dados.sinais, limiares['forte'], limiares['normal'])
+
+    por_ticker = pd.DataFrame(_metricas(classe, dados, 0, horizonte), index=dados.tickers)
+    patrimonio_ticker = np.cumprod(1 + np.sign(classe) * dados.com_preco * dados.retorno_seguinte, axis=0)
+    por_ticker['Retorno Estratégia (%)'] = 100 * (patrimonio_ticker[-1] - 1)
+    por_ticker['Drawdown Máximo (%)'] = 100 * _drawdown_maximo(patrimonio_ticker)
+
+    patrimonio = np.cumprod(1 + _retorno_carteira(classe, dados))
+    universo = {nome: float(valor) for nome, valor in _metricas(classe, dados, (0, 1), horizonte).items()}
+    universo['Retorno Estratégia (%)'] = 100 * (patrimonio[-1] - 1)
+    universo['Drawdown Máximo (%)'] = 100 * float(_drawdown_maximo(patrimonio))
+    return ResultadoBacktest(por_ticker, universo, pd.Series(patrimonio, index=dados.datas),
+                             pd.DataFrame(classe, index=dados.datas, columns=dados.tickers))
+
+def grade_pesos(pesos: dict, multiplicadores=(0, 1, 2)) -> np.ndarray:
+    """
+    Combinações de pesos (G x len(INDICADORES)): cada peso atual multiplicado por cada
+    multiplicador, renormalizado para a soma original (a escala dos limiares não muda).
+    """
+    base = np.array([pesos.get(indicador, 0) for indicador in INDICADORES], dtype=float)
+    grade = np.array(list(itertools.product(multiplicadores, repeat=len(INDICADORES))), dtype=float) * base
+    soma = grade.sum(axis=1)
+    grade = grade[soma > 0] * (base.sum() / soma[soma > 0])[:, None]
+    return np.unique(np.round(grade, 10), axis=0)
+
+def _avaliar_grade(padroes: dict, grade, pares) -> pd.DataFrame:
+    """Métricas do universo para cada combinação de pesos de 'grade' x par de limiares de 'pares'."""
+    # Score e classe de cada padrão para cada combinação (mesma ordem de soma de pontuar_historico)
+    sinais = {indicador: valores[None, :] for indicador, valores in padroes['sinais'].items()}
+    score = pontuar_historico(sinais, padroes['vies'][None, :], dict(zip(INDICADORES, grade.T[:, :, None])))
+    classe = classificar_sinais(score, sinais, pares[:, 0], pares[:, 1]).transpose(1, 0, 2)  # G x L x P
+    direcao = np.sign(classe).astype(float)
+    forte = (np.abs(classe) == 2).astype(float)
+    acertos = np.where(direcao > 0, padroes['positivos'], np.where(direcao < 0, padroes['negativos'], 0.0))
+    retornos = direcao * padroes['soma_retornos']
+
+    n, n_fortes = (direcao != 0) @ padroes['barras'], forte @ padroes['barras']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        metricas = {
+            'Sinais': n,
+            'Acerto (%)': 100 * acertos.sum(axis=-1) / n,
+            'Retorno Médio (%)': 100 * retornos.sum(axis=-1) / n,
+            'Sinais Fortes': n_fortes,
+            'Acerto Fortes (%)': 100 * (forte * acertos).sum(axis=-1) / n_fortes,
+            'Retorno Médio Fortes (%)': 100 * (forte * retornos).sum(axis=-1) / n_fortes,
+        }
+    patrimonio = np.cumprod(1 + direcao @ padroes['carteira'] / padroes['negociados'], axis=-1)
+    metricas['Retorno Estratégia (%)'] = 100 * (patrimonio[..., -1] - 1)
+    metricas['Drawdown Máximo (%)'] = 100 * _drawdown_maximo(patrimonio, eixo=-1)
+
+    L = len(pares)
+    tabela = pd.DataFrame({nome: np.asarray(valor).ravel() for nome, valor in metricas.items()})
+    tabela['Limiar Forte'], tabela['Limiar Normal'] = np.tile(pares[:, 0], len(grade)), np.tile(pares[:, 1], len(grade))
+    for indicador, pesos in zip(INDICADORES, grade.T):
+        tabela[f'Peso {indicador}'] = np.repeat(pesos, L)
+    return tabela
+
+def busca_em_grade(dados: DadosBacktest, grade, limiares_forte, limiares_normal, criterio: str = 'retorno_medio',
+                   min_sinais: int = 30, limite: int = 20, bloco: int = 2_000_000, horizonte: int = 10) -> pd.DataFrame:
+    """
+    Avalia cada linha de 'grade' (grade_pesos) com todos os pares de limiares (forte > normal)
+    e devolve as 'limite' melhores pelo 'criterio' (chave de CRITERIOS_BUSCA), só entre as
+    configurações com pelo menos 'min_sinais' sinais. As métricas são as de backtest_sinal no
+    universo, com o mesmo 'horizonte'. Em vez de datas x tickers, o cálculo percorre só os
+    padrões de sinais distintos (DadosBacktest.padroes): as combinações de pesos e de limiares
+    vão juntas em arrays G x L x P, em blocos de até 'bloco' elementos para limitar a memória.
+    """
+    pares = np.array([(forte, normal) for forte in limiares_forte for normal in limiares_normal if forte > normal])
+    grade = np.atleast_2d(np.asarray(grade, dtype=float))
+    if len(pares) == 0 or grade.size == 0:
+        return pd.DataFrame()
+    padroes = dados.padroes(horizonte)
+    por_bloco = max(1, bloco // (len(pares) * max(len(padroes['barras']), len(dados.datas))))
+    tabela = pd.concat([_avaliar_grade(padroes, grade[inicio:inicio + por_bloco], pares)
+                        for inicio in range(0, len(grade), por_bloco)], ignore_index=True)
+    tabela = tabela[tabela['Sinais'] >= min_sinais]
+    return tabela.sort_values(CRITERIOS_BUSCA[criterio], ascending=False).head(limite).reset_index(drop=True)
@@ -0,0 +1,292 @@
+# fleuriet.py
+"""
+Modelo Fleuriet e Z-Score de Prado para todas as empresas da CVM de uma vez.
+
+As contas usadas pelo modelo são extraídas dos demonstrativos (BPA, BPP e DRE) numa única
+passada e organizadas em matrizes empresas x anos (PainelContabil). NCG, CDG, Tesouraria,
+efeito tesoura, variáveis do Z-Score e tipo de balanço saem de operações sobre essas matrizes,
+com a classificação feita por np.select, sem laço por empresa. As regras são as da análise
+original por empresa: cada conta vale o último registro 'ÚLTIMO' de cada ano, somas e
+subtrações tratam o ano ausente em uma das parcelas como zero e cada indicador usa o último
+ano da própria série. O HistoricoFleuriet reaproveita as mesmas séries para guardar tipo,
+efeito tesoura e Z-Score de todos os anos e apontar as migrações entre tipos. Não depende do
+Streamlit.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Nome da conta no modelo -> (demonstrativo, chave em CONFIG['CONTAS_CVM'])
+CONTAS_FLEURIET = {
+    'contas_a_receber': ('bpa', 'CONTAS_A_RECEBER'),
+    'estoques': ('bpa', 'ESTOQUES'),
+    'ativo_nao_circulante': ('bpa', 'ATIVO_NAO_CIRCULANTE'),
+    'ativo_total': ('bpa', 'ATIVO_TOTAL'),
+    'fornecedores': ('bpp', 'FORNECEDORES'),
+    'passivo_nao_circulante': ('bpp', 'PASSIVO_NAO_CIRCULANTE'),
+    'patrimonio_liquido': ('bpp', 'PATRIMONIO_LIQUIDO'),
+    'passivo_total': ('bpp', 'PASSIVO_TOTAL'),
+    'ebit': ('dre', 'EBIT'),
+    'receita_liquida': ('dre', 'RECEITA_LIQUIDA'),
+}
+DEMONSTRATIVOS_FLEURIET = ('bpa', 'bpp', 'dre')
+TIPOS_FLEURIET = (
+    "Tipo 1 (Excelente Liquidez)",
+    "Tipo 2 (Sólida e Comum)",
+    "Tipo 3 (Risco de Liquidez)",
+    "Tipo 4 (Alto Risco Financeiro)",
+    "Tipo 5 (Vulnerável a Fornecedores)",
+    "Tipo 6 (Incomum, NCG financia PNC)",
+)
+TIPO_INDEFINIDO = "Indefinido"
+# Código guardado no histórico -> tipo (0 = Indefinido, 1 a 6 = Tipo 1 a Tipo 6; -1 = ano sem dados)
+ROTULOS_TIPOS = (TIPO_INDEFINIDO,) + TIPOS_FLEURIET
+# Z = 0,038 X1 + 1,253 X2 + 2,331 X3 + 0,511 X4 + 0,824 X5
+PESOS_ZSCORE_PRADO = (0.038, 1.253, 2.331, 0.511, 0.824)
+LIMITES_ZSCORE = (1.81, 2.99)
+CLASSES_ZSCORE = ("Risco Elevado", "Zona Cinzenta", "Saudável")
+
+class PainelContabil:
+    """
+    Contas do modelo por empresa e ano. 'valores' mapeia o nome da conta (CONTAS_FLEURIET)
+    -> matriz empresas x anos, com NaN onde a empresa não divulgou a conta naquele ano.
+    'com_demonstrativos' marca as empresas com algum registro em BPA, BPP e DRE.
+    """
+
+    def __init__(self, demonstrativos: dict, contas_cvm: dict, empresas=None):
+        partes, presentes = [], []
+        for demonstrativo in DEMONSTRATIVOS_FLEURIET:
+            df = demonstrativos.get(demonstrativo)
+            if df is None or df.empty:
+                presentes.append(np.array([], dtype=np.int64))
+                continue
+            presentes.append(pd.unique(df['CD_CVM']))
+            codigos = {contas_cvm[chave]: nome for nome, (origem, chave) in CONTAS_FLEURIET.items() if origem == demonstrativo}
+            # O filtro de contas é o mais seletivo: os demais só olham as linhas que sobram
+            parte = df.loc[df['CD_CONTA'].isin(list(codigos)), ['CD_CVM', 'CD_CONTA', 'DT_REFER', 'ORDEM_EXERC', 'VL_CONTA']]
+            filtro = parte['ORDEM_EXERC'] == 'ÚLTIMO'
+            if empresas is not None:
+                filtro &= parte['CD_CVM'].isin(empresas)
+            parte = parte.loc[filtro, ['CD_CVM', 'CD_CONTA', 'DT_REFER', 'VL_CONTA']]
+            partes.append(parte.assign(conta=parte['CD_CONTA'].map(codigos)))
+
+        registros = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=['CD_CVM', 'DT_REFER', 'VL_CONTA', 'conta'])
+        registros = registros.dropna(subset=['VL_CONTA'])
+        registros['DT_REFER'] = pd.to_datetime(registros['DT_REFER'])
+        registros['ano'] = registros['DT_REFER'].dt.year
+        # Último registro de cada conta em cada ano (o de maior DT_REFER)
+        registros = registros.sort_values('DT_REFER', kind='stable').drop_duplicates(['CD_CVM', 'conta', 'ano'], keep='last')
+
+        self.empresas = np.sort(pd.unique(registros['CD_CVM'])).astype(np.int64)
+        self.anos = np.sort(pd.unique(registros['ano'])).astype(np.int64)
+        linha = np.searchsorted(self.empresas, registros['CD_CVM'].to_numpy(dtype=np.int64))
+        coluna = np.searchsorted(self.anos, registros['ano'].to_numpy(dtype=np.int64))
+        self.valores = {}
+        for nome in CONTAS_FLEURIET:
+            da_conta = (registros['conta'] == nome).to_numpy()
+            matriz = np.full((len(self.empresas), len(self.anos)), np.nan)
+            matriz[linha[da_conta], coluna[da_conta]] = registros['VL_CONTA'].to_numpy(dtype=float)[da_conta]
+            self.valores[nome] = matriz
+        self.com_demonstrativos = np.logical_and.reduce([np.isin(self.empresas, p) for p in presentes])
+
+def _combinar(*parcelas) -> np.ndarray:
+    """
+    Soma de séries anuais com o comportamento de Series.add(..., fill_value=0): o ano existe
+    se existir em alguma parcela, e a parcela ausente naquele ano conta como zero.
+    """
+    existe = np.logical_or.reduce([~np.isnan(p) for p in parcelas])
+    total = np.nan_to_num(parcelas[0])
+    for parcela in parcelas[1:]:
+        total = total + np.nan_to_num(parcela)
+    return np.where(existe, total, np.nan)
+
+def _posicoes(x) -> tuple:
+    """Contagem de anos com valor e índices do primeiro, penúltimo e último desses anos em cada linha."""
+    existe = ~np.isnan(x)
+    acumulado = np.cumsum(existe, axis=1)
+    contagem = acumulado[:, -1]
+    primeiro = np.argmax(existe, axis=1)
+    ultimo = x.shape[1] - 1 - np.argmax(existe[:, ::-1], axis=1)
+    penultimo = np.argmax(existe & (acumulado == (contagem - 1)[:, None]), axis=1)
+    return contagem, primeiro, penultimo, ultimo
+
+def _no_indice(x, indice) -> np.ndarray:
+    return x[np.arange(len(x)), indice]
+
+def _anterior(x) -> np.ndarray:
+    """Valor do ano anterior com dado na mesma linha (NaN no primeiro ano da série e fora dela)."""
+    existe = ~np.isnan(x)
+    indice = np.maximum.accumulate(np.where(existe, np.arange(x.shape[1]), -1), axis=1)
+    anterior = np.hstack([np.full((len(x), 1), -1), indice[:, :-1]])
+    return np.where(anterior >= 0, np.take_along_axis(x, np.maximum(anterior, 0), axis=1), np.nan)
+
+def codificar_tipos(cdg, ncg, t) -> np.ndarray:
+    """Código do tipo de balanço (índice em ROTULOS_TIPOS) elemento a elemento; sinais nulos ou NaN dão 0 (Indefinido)."""
+    with np.errstate(invalid='ignore'):
+        condicoes = [
+            (cdg > 0) & (ncg < 0) & (t > 0),
+            (cdg > 0) & (ncg > 0) & (t > 0),
+            (cdg > 0) & (ncg > 0) & (t < 0),
+            (cdg < 0) & (ncg > 0) & (t < 0),
+            (cdg < 0) & (ncg < 0) & (t < 0),
+            (cdg < 0) & (ncg < 0) & (t > 0),
+        ]
+    return np.select(condicoes, np.arange(1, len(TIPOS_FLEURIET) + 1), 0).astype(np.int8)
+
+def classificar_tipos(cdg, ncg, t) -> np.ndarray:
+    """Tipo de balanço Fleuriet (TIPOS_FLEURIET) elemento a elemento; sinais nulos ou NaN dão 'Indefinido'."""
+    return np.asarray(ROTULOS_TIPOS, dtype=object)[codificar_tipos(cdg, ncg, t)]
+
+def classificar_zscore(z) -> np.ndarray:
+    """Faixa de risco do Z-Score de Prado (CLASSES_ZSCORE) elemento a elemento."""
+    with np.errstate(invalid='ignore'):
+        return np.select([z < LIMITES_ZSCORE[0], z < LIMITES_ZSCORE[1]], CLASSES_ZSCORE[:2], CLASSES_ZSCORE[2])
+
+def calcular_fleuriet(painel: PainelContabil) -> dict:
+    """
+    Séries anuais do modelo (matrizes empresas x anos, NaN fora da série): ACO (contas a
+    receber + estoques), PCO (fornecedores), NCG = ACO - PCO, CDG = PL + PNC - AP e
+    T = CDG - NCG, além das contas usadas pelo Z-Score.
+    """
+    v = painel.valores
+    aco = _combinar(v['contas_a_receber'], v['estoques'])
+    ncg = _combinar(aco, -v['fornecedores'])
+    cdg = _combinar(_combinar(v['patrimonio_liquido'], v['passivo_nao_circulante']), -v['ativo_nao_circulante'])
+    return {
+        'aco': aco, 'pco': v['fornecedores'], 'ap': v['ativo_nao_circulante'],
+        'pl': v['patrimonio_liquido'], 'pnc': v['passivo_nao_circulante'],
+        'ncg': ncg, 'cdg': cdg, 't': _combinar(cdg, -ncg),
+        'ativo_total': v['ativo_total'], 'passivo_total': v['passivo_total'],
+        'ebit': v['ebit'], 'vendas': v['receita_liquida'],
+    }
+
+def resumo_fleuriet(painel: PainelContabil, series: dict = None) -> pd.DataFrame:
+    """
+    Situação mais recente de cada empresa (índice CD_CVM): Ano, NCG, CDG, Tesouraria, Tipo
+    Fleuriet, Efeito Tesoura e as variáveis do Z-Score que não dependem do valor de mercado
+    (X1, X2, X3, X5 e o Passivo Total que divide o X4). Ficam só as empresas com todos os
+    demonstrativos, todas as contas e ativo e passivo totais não nulos.
+    """
+    s = series if series is not None else calcular_fleuriet(painel)
+    posicoes = {nome: _posicoes(x) for nome, x in s.items()}
+    ultimo = {nome: _no_indice(s[nome], posicoes[nome][3]) for nome in s}
+    contagem = {nome: posicoes[nome][0] for nome in s}
+
+    validas = painel.com_demonstrativos.copy()
+    for nome in ('aco', 'pco', 'ap', 'pl', 'pnc', 'ativo_total', 'passivo_total', 'ebit', 'vendas'):
+        validas &= contagem[nome] > 0
+    validas &= (ultimo['ativo_total'] != 0) & (ultimo['passivo_total'] != 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Efeito tesoura: a NCG cresceu mais que o CDG no último ano de cada série e T < 0
+        crescimento = {nome: ultimo[nome] / _no_indice(s[nome], posicoes[nome][2]) - 1 for nome in ('ncg', 'cdg')}
+        tesoura = (contagem['ncg'] > 1) & (contagem['cdg'] > 1) & (crescimento['ncg'] > crescimento['cdg']) & (ultimo['t'] < 0)
+        lucro_retido = ultimo['pl'] - _no_indice(s['pl'], posicoes['pl'][1])
+        ativo_total = ultimo['ativo_total']
+        resumo = pd.DataFrame({
+            'Ano': painel.anos[posicoes['t'][3]],
+            'NCG': ultimo['ncg'],
+            'CDG': ultimo['cdg'],
+            'Tesouraria': ultimo['t'],
+            'Tipo Fleuriet': classificar_tipos(ultimo['cdg'], ultimo['ncg'], ultimo['t']),
+            'Efeito Tesoura': tesoura,
+            'X1': ultimo['cdg'] / ativo_total,
+            'X2': lucro_retido / ativo_total,
+            'X3': ultimo['ebit'] / ativo_total,
+            'X5': ultimo['vendas'] / ativo_total,
+            'Passivo Total': ultimo['passivo_total'],
+        }, index=pd.Index(painel.empresas, name='CD_CVM'))
+    return resumo[validas]
+
+def aplicar_zscore(tabela: pd.DataFrame, market_cap) -> pd.DataFrame:
+    """
+    Acrescenta 'Z-Score' e 'Classificação Risco' a linhas com X1, X2, X3, X5 e Passivo Total
+    (ver resumo_fleuriet), com X4 = market_cap / Passivo Total ('market_cap' alinhado às linhas).
+    """
+    x4 = np.asarray(market_cap, dtype=float) / tabela['Passivo Total'].to_numpy()
+    p1, p2, p3, p4, p5 = PESOS_ZSCORE_PRADO
+    z = p1 * tabela['X1'].to_numpy() + p2 * tabela['X2'].to_numpy() + p3 * tabela['X3'].to_numpy() + p4 * x4 + p5 * tabela['X5'].to_numpy()
+    return tabela.assign(**{'Z-Score': z, 'Classificação Risco': classificar_zscore(z)})
+
+class HistoricoFleuriet:
+    """
+    Tipo de balanço, efeito tesoura e Z-Score de cada empresa em todos os anos carregados,
+    calculados das mesmas séries de calcular_fleuriet (sem nova leitura dos demonstrativos) e
+    guardados em matrizes empresas x anos compactas: 'tipos' (int8, códigos de ROTULOS_TIPOS
+    e -1 nos anos sem dados), 'tesoura' (bool) e 'zscore' (float32). 'market_cap' (índice
+    CD_CVM) define as empresas mantidas; o X4 de todos os anos usa esse valor de mercado atual,
+    o único disponível.
+    """
+
+    def __init__(self, painel: PainelContabil, series: dict, market_cap: pd.Series):
+        linhas = np.searchsorted(painel.empresas, market_cap.index.to_numpy(dtype=np.int64))
+        s = {nome: x[linhas] for nome, x in series.items()}
+        self.empresas, self.anos = painel.empresas[linhas], painel.anos
+
+        com_dados = ~np.isnan(s['t'])
+        self.tipos = np.where(com_dados, codificar_tipos(s['cdg'], s['ncg'], s['t']), -1).astype(np.int8)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Mesma regra do resumo, ano a ano: crescimento sobre o ano anterior de cada série
+            crescimento_ncg = s['ncg'] / _anterior(s['ncg']) - 1
+            crescimento_cdg = s['cdg'] / _anterior(s['cdg']) - 1
+            self.tesoura = (crescimento_ncg > crescimento_cdg) & (s['t'] < 0)
+
+            pl_inicial = _no_indice(s['pl'], _posicoes(s['pl'])[1])[:, None]
+            ativo_total = s['ativo_total']
+            p1, p2, p3, p4, p5 = PESOS_ZSCORE_PRADO
+            x4 = market_cap.to_numpy(dtype=float)[:, None] / s['passivo_total']
+            zscore = (p1 * (s['cdg'] / ativo_total) + p2 * ((s['pl'] - pl_inicial) / ativo_total)
+                      + p3 * (s['ebit'] / ativo_total) + p4 * x4 + p5 * (s['vendas'] / ativo_total))
+        self.zscore = np.where(com_dados & np.isfinite(zscore), zscore, np.nan).astype(np.float32)
+
+    def longo(self) -> pd.DataFrame:
+        """Uma linha por empresa e ano com dados: tipo, efeito tesoura, Z-Score e faixa de risco."""
+        linha, coluna = np.nonzero(self.tipos >= 0)
+        z = self.zscore[linha, coluna].astype(float)
+        return pd.DataFrame({
+            'CD_CVM': self.empresas[linha], 'Ano': self.anos[coluna],
+            'Tipo Fleuriet': np.asarray(ROTULOS_TIPOS, dtype=object)[self.tipos[linha, coluna]],
+            'Efeito Tesoura': self.tesoura[linha, coluna],
+            'Z-Score': z, 'Classificação Risco': np.where(np.isnan(z), None, classificar_zscore(z)),
+        })
+
+    def _pares_consecutivos(self) -> tuple:
+        """Para cada ano com dados que tem um ano anterior com dados: (linha, coluna, coluna anterior)."""
+        com_dados = self.tipos >= 0
+        indice = np.maximum.accumulate(np.where(com_dados, np.arange(len(self.anos)), -1), axis=1)
+        anterior = np.hstack([np.full((len(self.empresas), 1), -1), indice[:, :-1]])
+        linha, coluna = np.nonzero(com_dados & (anterior >= 0))
+        return linha, coluna, anterior[linha, coluna]
+
+    def transicoes(self) -> pd.DataFrame:
+        """Mudanças de tipo entre anos consecutivos da série de cada empresa (ex.: Tipo 2 -> Tipo 3)."""
+        linha, coluna, anterior = self._pares_consecutivos()
+        de, para = self.tipos[linha, anterior], self.tipos[linha, coluna]
+        mudou = de != para
+        rotulos = np.asarray(ROTULOS_TIPOS, dtype=object)
+        return pd.DataFrame({
+            'CD_CVM': self.empresas[linha[mudou]],
+            'Ano Anterior': self.anos[anterior[mudou]], 'Ano': self.anos[coluna[mudou]],
+            'De': rotulos[de[mudou]], 'Para': rotulos[para[mudou]],
+            'Z-Score Anterior': self.zscore[linha[mudou], anterior[mudou]].astype(float),
+            'Z-Score': self.zscore[linha[mudou], coluna[mudou]].astype(float),
+        })
+
+    def matriz_transicoes(self) -> pd.DataFrame:
+        """Contagem de pares de anos consecutivos por tipo de origem (linhas) e de destino (colunas), incluindo a permanência."""
+        linha, coluna, anterior = self._pares_consecutivos()
+        n = len(ROTULOS_TIPOS)
+        contagem = np.bincount(self.tipos[linha, anterior].astype(np.int64) * n + self.tipos[linha, coluna], minlength=n * n).reshape(n, n)
+        rotulos = [rotulo.split(' (')[0] for rotulo in ROTULOS_TIPOS]
+        return pd.DataFrame(contagem, index=pd.Index(rotulos, name='De'), columns=pd.Index(rotulos, name='Para'))
+
+    def inicios_tesoura(self) -> pd.DataFrame:
+        """Anos em que o efeito tesoura começou: presente no ano e ausente no ano anterior com dados."""
+        linha, coluna, anterior = self._pares_consecutivos()
+        inicio = self.tesoura[linha, coluna] & ~self.tesoura[linha, anterior]
+        linha, coluna = linha[inicio], coluna[inicio]
+        return pd.DataFrame({
+            'CD_CVM': self.empresas[linha], 'Ano': self.anos[coluna],
+            'Tipo Fleuriet': np.asarray(ROTULOS_TIPOS, dtype=object)[self.tipos[linha, coluna]],
+            'Z-Score': self.zscore[linha, coluna].astype(float),
+        })
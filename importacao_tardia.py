@@ -0,0 +1,81 @@
+# importacao_tardia.py
+"""
+Importação tardia das bibliotecas pesadas de análise (yfinance, scipy, plotly,
+tenacity).
+
+Cada biblioteca é representada por um ModuloTardio, que só executa o import no primeiro
+acesso a um atributo. Assim a tela de login e a aba de Controle Financeiro não pagam o
+custo de carregar as bibliotecas usadas apenas por Valuation, Fleuriet e Black-Scholes.
+
+Os tempos de cada carga ficam em TEMPOS_IMPORTACAO; relatorio_importacao() os ordena para a
+exibição na barra lateral do app.
+"""
+
+import functools
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Nome do módulo -> segundos gastos no import (preenchido à medida que os módulos são usados)
+TEMPOS_IMPORTACAO = {}
+
+class ModuloTardio:
+    """
+    Substituto de um módulo (ou de um atributo dele, como scipy.stats.norm) que adia o
+    import até o primeiro uso. Depois disso, o acesso é repassado ao objeto real.
+    """
+
+    def __init__(self, nome: str, atributo: str = None):
+        self._nome = nome
+        self._atributo = atributo
+        self._objeto = None
+        self._lock = threading.Lock()
+
+    def _carregar(self):
+        if self._objeto is None:
+            with self._lock:
+                if self._objeto is None:
+                    inicio = time.perf_counter()
+                    modulo = importlib.import_module(self._nome)
+                    TEMPOS_IMPORTACAO.setdefault(self._nome, time.perf_counter() - inicio)
+                    logger.info("Módulo %s carregado em %.0f ms", self._nome, TEMPOS_IMPORTACAO[self._nome] * 1000)
+                    self._objeto = getattr(modulo, self._atributo) if self._atributo else modulo
+        return self._objeto
+
+    def __getattr__(self, nome):
+        return getattr(self._carregar(), nome)
+
+    def __repr__(self):
+        estado = "carregado" if self._objeto is not None else "não carregado"
+        alvo = f"{self._nome}.{self._atributo}" if self._atributo else self._nome
+        return f"<ModuloTardio {alvo} ({estado})>"
+
+def com_retentativas(tentativas: int = 3, multiplicador: float = 1, espera_min: float = 4, espera_max: float = 10):
+    """
+    Equivalente a @retry(wait=wait_exponential(...), stop=stop_after_attempt(...)) do tenacity,
+    mas o tenacity só é importado na primeira chamada da função decorada.
+    """
+    tenacity = ModuloTardio('tenacity')
+
+    def decorador(func):
+        envolvida = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal envolvida
+            if envolvida is None:
+                envolvida = tenacity.retry(
+                    wait=tenacity.wait_exponential(multiplier=multiplicador, min=espera_min, max=espera_max),
+                    stop=tenacity.stop_after_attempt(tentativas),
+                )(func)
+            return envolvida(*args, **kwargs)
+        return wrapper
+    return decorador
+
+def relatorio_importacao() -> list:
+    """Tempos de import já medidos neste processo, do mais lento para o mais rápido (em ms)."""
+    return sorted(((nome, segundos * 1000) for nome, segundos in TEMPOS_IMPORTACAO.items()), key=lambda item: -item[1])
+
@@ -0,0 +1,367 @@
+# indicadores.py
+"""
+Indicadores técnicos incrementais usados pela análise técnica (RSI, MACD, Bandas de
+Bollinger, EMA 9/21, ADX, Estocástico e SAR Parabólico).
+
+Em vez de recalcular a Strategy do pandas_ta sobre todo o histórico para ler a última
+linha, cada indicador guarda o próprio estado e é atualizado barra a barra com custo
+constante (no máximo proporcional à janela do indicador, nunca ao tamanho do histórico).
+As fórmulas e as sementes seguem as do pandas_ta_classic, então as leituras são as mesmas
+da Strategy. O estado é vetorizado por ativo: uma barra de vários ativos é uma única
+atualização do NumPy (calcular_universo). MotorIndicadores mantém o estado por ativo e só
+processa as barras novas.
+
+Não depende do Streamlit. A paridade com o pandas_ta é conferida em tests/test_indicadores.py
+(comparar_com_pandas_ta).
+"""
+
+import pickle
+import sys
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+EPSILON = sys.float_info.epsilon
+
+# Leitura -> coluna equivalente na Strategy do pandas_ta (mesmas chaves usadas na pontuação)
+COLUNAS_PANDAS_TA = {
+    'close': 'close', 'rsi': 'RSI_14', 'macd': 'MACD_12_26_9', 'macd_sinal': 'MACDs_12_26_9',
+    'bb_superior': 'BBU_20_2.0', 'bb_inferior': 'BBL_20_2.0', 'ema_9': 'EMA_9', 'ema_21': 'EMA_21',
+    'adx': 'ADX_14', 'dmp': 'DMP_14', 'dmn': 'DMN_14', 'stoch_k': 'STOCHk_14_3_3',
+    'psar_alta': 'PSARl_0.02_0.2', 'psar_baixa': 'PSARs_0.02_0.2',
+}
+
+class MediaComSemente:
+    """
+    Média exponencial semeada com a média simples dos primeiros 'periodo' valores, como a
+    ema (alfa = 2/(n+1)) e a rma de Wilder (alfa = 1/n) do pandas_ta. NaN até a semente.
+    Guarda uma média por ativo; atualizar(x, m) só mexe nas colunas marcadas em 'm'.
+    """
+
+    def __init__(self, periodo: int, alfa: float, n: int = 1):
+        self.periodo = periodo
+        self.alfa = alfa
+        self.valor = np.full(n, np.nan)
+        self._soma = np.zeros(n)
+        self._contagem = np.zeros(n, dtype=int)
+
+    def atualizar(self, x, m) -> np.ndarray:
+        semeando = m & (self._contagem < self.periodo)
+        self._soma = np.where(semeando, self._soma + x, self._soma)
+        self._contagem += semeando
+        self.valor = np.where(m & ~semeando, self.alfa * x + (1 - self.alfa) * self.valor, self.valor)
+        self.valor = np.where(semeando & (self._contagem == self.periodo), self._soma / self.periodo, self.valor)
+        return self.valor
+
+def ema(periodo: int, n: int = 1) -> MediaComSemente:
+    """EMA do pandas_ta (span = periodo, semente SMA)."""
+    return MediaComSemente(periodo, 2.0 / (periodo + 1), n)
+
+def rma(periodo: int, n: int = 1) -> MediaComSemente:
+    """Média de Wilder do pandas_ta (alfa = 1/periodo, semente SMA)."""
+    return MediaComSemente(periodo, 1.0 / periodo, n)
+
+class SuavizacaoWilder:
+    """
+    Suavização cumulativa de Wilder usada no +DI/-DI do ADX: a semente é a soma dos
+    primeiros periodo-1 valores e depois valor = valor - valor/periodo + x.
+    """
+
+    def __init__(self, periodo: int, n: int = 1):
+        self.periodo = periodo
+        self.valor = np.full(n, np.nan)
+        self._soma = np.zeros(n)
+        self._contagem = np.zeros(n, dtype=int)
+
+    def atualizar(self, x, m) -> np.ndarray:
+        semeando = m & (self._contagem < self.periodo - 1)
+        self._soma = np.where(semeando, self._soma + x, self._soma)
+        self._contagem += semeando
+        self.valor = np.where(m & ~semeando, self.valor - self.valor / self.periodo + x, self.valor)
+        self.valor = np.where(semeando & (self._contagem == self.periodo - 1), self._soma, self.valor)
+        return self.valor
+
+class JanelaMovel:
+    """Últimos 'periodo' valores de cada ativo (buffer circular), para médias, desvios e extremos."""
+
+    def __init__(self, periodo: int, n: int = 1):
+        self.periodo = periodo
+        self.valores = np.full((periodo, n), np.nan)
+        self._posicao = np.zeros(n, dtype=int)
+        self._contagem = np.zeros(n, dtype=int)
+
+    def atualizar(self, x, m):
+        colunas = np.flatnonzero(m)
+        self.valores[self._posicao[colunas], colunas] = x[colunas]
+        self._posicao[colunas] = (self._posicao[colunas] + 1) % self.periodo
+        self._contagem[colunas] = np.minimum(self._contagem[colunas] + 1, self.periodo)
+        return self
+
+    @property
+    def cheia(self) -> np.ndarray:
+        return self._contagem == self.periodo
+
+    def media(self) -> np.ndarray:
+        return np.where(self.cheia, self.valores.mean(axis=0), np.nan)
+
+    def desvio(self) -> np.ndarray:
+        return np.where(self.cheia, self.valores.std(axis=0), np.nan)
+
+    def minimo(self) -> np.ndarray:
+        return np.where(self.cheia, self.valores.min(axis=0), np.nan)
+
+    def maximo(self) -> np.ndarray:
+        return np.where(self.cheia, self.valores.max(axis=0), np.nan)
+
+class IndicadoresIncrementais:
+    """
+    Estado de todos os indicadores de 'n' ativos. atualizar(high, low, close) recebe um
+    valor (ou um array com um valor por ativo; NaN = ativo sem barra nesta data), processa a
+    barra e devolve as leituras dela (chaves de COLUNAS_PANDAS_TA, um array por leitura).
+    Com vários ativos, uma barra do mercado inteiro custa algumas operações do NumPy.
+    As últimas 10 leituras ficam em 'recentes' para a depuração.
+    """
+
+    def __init__(self, n: int = 1):
+        self.n = n
+        self.barras = np.zeros(n, dtype=int)
+        # RSI(14)
+        self.rsi_alta, self.rsi_baixa = rma(14, n), rma(14, n)
+        # MACD(12, 26, 9) e EMAs 9/21
+        self.ema_rapida, self.ema_lenta, self.macd_sinal = ema(12, n), ema(26, n), ema(9, n)
+        self.ema_9, self.ema_21 = ema(9, n), ema(21, n)
+        # Bandas de Bollinger(20, 2)
+        self.bollinger = JanelaMovel(20, n)
+        # Estocástico(14, 3, 3)
+        self.stoch_maximas, self.stoch_minimas = JanelaMovel(14, n), JanelaMovel(14, n)
+        self.stoch_bruto = JanelaMovel(3, n)
+        # ADX(14)
+        self.dm_alta, self.dm_baixa, self.true_range = SuavizacaoWilder(14, n), SuavizacaoWilder(14, n), SuavizacaoWilder(14, n)
+        self.adx = rma(14, n)
+        # SAR Parabólico(0.02, 0.2)
+        self.psar_iniciado = np.zeros(n, dtype=bool)
+        self.psar_caindo = np.zeros(n, dtype=bool)
+        self.psar_sar, self.psar_ep, self.psar_af = np.full(n, np.nan), np.full(n, np.nan), np.full(n, 0.02)
+        # Barra anterior (high, low, close) e a anterior a ela (high, low), usada pelo SAR
+        self.anterior = np.full((3, n), np.nan)
+        self.anterior_2 = np.full((2, n), np.nan)
+        self.recentes = deque(maxlen=10)
+
+    def _atualizar_psar(self, high, low, passo):
+        """Um passo do laço do psar do pandas_ta nas colunas em 'passo'; devolve o SAR da barra."""
+        h_ant, l_ant, c_ant = self.anterior
+        # Início: queda se o -DM da segunda barra for positivo; o SAR parte do fechamento da primeira
+        inicia = passo & ~self.psar_iniciado
+        alta, baixa = high - h_ant, l_ant - low
+        caindo_inicial = (baixa > alta) & (baixa > 0) & (np.abs(baixa) >= EPSILON)
+        caindo = np.where(inicia, caindo_inicial, self.psar_caindo)
+        sar_anterior = np.where(inicia, c_ant, self.psar_sar)
+        ep = np.where(inicia, np.where(caindo_inicial, low, high), self.psar_ep)
+        af = np.where(inicia, 0.02, self.psar_af)
+        self.psar_iniciado |= inicia
+
+        h_ant_2 = np.where(np.isnan(self.anterior_2[0]), h_ant, self.anterior_2[0])
+        l_ant_2 = np.where(np.isnan(self.anterior_2[1]), l_ant, self.anterior_2[1])
+        sar = sar_anterior + af * (ep - sar_anterior)
+        novo_extremo = np.where(caindo, low < ep, high > ep)
+        ep = np.where(novo_extremo, np.where(caindo, low, high), ep)
+        af = np.where(novo_extremo, np.minimum(af + 0.02, 0.2), af)
+        sar = np.where(caindo, np.maximum(np.maximum(h_ant, h_ant_2), sar), np.minimum(np.minimum(l_ant, l_ant_2), sar))
+        reverte = np.where(caindo, high > sar, low < sar)
+        sar = np.where(reverte, ep, sar)
+        af = np.where(reverte, 0.02, af)
+        caindo = caindo ^ reverte
+        ep = np.where(reverte, np.where(caindo, low, high), ep)
+
+        self.psar_caindo = np.where(passo, caindo, self.psar_caindo)
+        self.psar_sar = np.where(passo, sar, self.psar_sar)
+        self.psar_ep = np.where(passo, ep, self.psar_ep)
+        self.psar_af = np.where(passo, af, self.psar_af)
+        return np.where(passo, sar, np.nan)
+
+    def atualizar(self, high, low, close) -> dict:
+        high, low, close = (np.broadcast_to(np.asarray(x, dtype=float), (self.n,)) for x in (high, low, close))
+        m = ~(np.isnan(high) | np.isnan(low) | np.isnan(close))
+        leituras = {'close': close}
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # EMAs e MACD (o sinal só começa quando as duas médias do MACD existem)
+            leituras['ema_9'] = self.ema_9.atualizar(close, m)
+            leituras['ema_21'] = self.ema_21.atualizar(close, m)
+            leituras['macd'] = self.ema_rapida.atualizar(close, m) - self.ema_lenta.atualizar(close, m)
+            leituras['macd_sinal'] = self.macd_sinal.atualizar(leituras['macd'], m & ~np.isnan(leituras['macd']))
+
+            # Bandas de Bollinger: média e desvio populacional da janela
+            self.bollinger.atualizar(close, m)
+            media, desvio = self.bollinger.media(), self.bollinger.desvio()
+            leituras['bb_superior'], leituras['bb_inferior'] = media + 2 * desvio, media - 2 * desvio
+
+            # Estocástico: %K bruto, suavizado por SMA(3)
+            self.stoch_maximas.atualizar(high, m)
+            self.stoch_minimas.atualizar(low, m)
+            minima = self.stoch_minimas.minimo()
+            amplitude = self.stoch_maximas.maximo() - minima
+            self.stoch_bruto.atualizar(100 * (close - minima) / np.where(amplitude != 0, amplitude, EPSILON), m & ~np.isnan(amplitude))
+            leituras['stoch_k'] = self.stoch_bruto.media()
+
+            # RSI: médias de Wilder das altas e das baixas (a partir da segunda barra)
+            h_ant, l_ant, c_ant = self.anterior
+            com_anterior = m & ~np.isnan(c_ant)
+            variacao = close - c_ant
+            media_alta = self.rsi_alta.atualizar(np.maximum(variacao, 0.0), com_anterior)
+            media_baixa = np.abs(self.rsi_baixa.atualizar(np.minimum(variacao, 0.0), com_anterior))
+            leituras['rsi'] = np.where(media_alta + media_baixa != 0, 100 * media_alta / (media_alta + media_baixa), np.nan)
+
+            # ADX: movimentos direcionais e true range suavizados por Wilder; ADX = rma do DX
+            alta, baixa = high - h_ant, l_ant - low
+            dm_alta = np.where((alta > baixa) & (alta > 0) & (np.abs(alta) >= EPSILON), alta, 0.0)
+            dm_baixa = np.where((baixa > alta) & (baixa > 0) & (np.abs(baixa) >= EPSILON), baixa, 0.0)
+            true_range = np.maximum.reduce([np.abs(np.where(high != low, high - low, EPSILON)), np.abs(high - c_ant), np.abs(c_ant - low)])
+            # A barra da semente não é reportada, como no pandas_ta
+            reporta = com_anterior & ~np.isnan(self.true_range.valor)
+            tr = self.true_range.atualizar(true_range, com_anterior)
+            leituras['dmp'] = np.where(reporta, 100 * self.dm_alta.atualizar(dm_alta, com_anterior) / tr, np.nan)
+            leituras['dmn'] = np.where(reporta, 100 * self.dm_baixa.atualizar(dm_baixa, com_anterior) / tr, np.nan)
+            soma = leituras['dmp'] + leituras['dmn']
+            dx = np.where(soma != 0, 100 * np.abs(leituras['dmp'] - leituras['dmn']) / soma, np.nan)
+            leituras['adx'] = np.where(reporta, self.adx.atualizar(dx, reporta & ~np.isnan(dx)), np.nan)
+
+            # SAR: classificado como de alta (abaixo do fechamento) ou de baixa
+            sar = self._atualizar_psar(high, low, com_anterior)
+            leituras['psar_alta'] = np.where(sar < close, sar, np.nan)
+            leituras['psar_baixa'] = np.where(sar >= close, sar, np.nan)
+
+        self.anterior_2 = np.where(m, self.anterior[:2], self.anterior_2)
+        self.anterior = np.where(m, np.stack([high, low, close]), self.anterior)
+        self.barras += m
+        self.ultima_mascara = m
+        self.recentes.append(leituras)
+        return leituras
+
+    def tabela_recentes(self, coluna: int = 0) -> pd.DataFrame:
+        """Últimas leituras de um ativo com os nomes de coluna do pandas_ta (para a depuração)."""
+        return pd.DataFrame([{nome: valor[coluna] for nome, valor in leituras.items()} for leituras in self.recentes]).rename(columns=COLUNAS_PANDAS_TA)
+
+def _copiar(estado: IndicadoresIncrementais) -> IndicadoresIncrementais:
+    """Cópia independente do estado (pickle é bem mais rápido que copy.deepcopy aqui)."""
+    return pickle.loads(pickle.dumps(estado, protocol=pickle.HIGHEST_PROTOCOL))
+
+class MotorIndicadores:
+    """
+    Estado incremental por ativo (chave livre, por exemplo ticker + timeframe). A cada
+    atualizar(chave, df) só as barras posteriores à última processada passam pelos
+    indicadores. Uma revisão da última barra (cotação intradiária) é reaplicada a partir do
+    estado anterior a ela. O início de 'df' pode avançar (um download de "5 anos" começa um
+    pregão depois a cada dia): o estado continua valendo, como se o histórico já processado
+    fizesse parte da série. Um histórico que não bate com o já processado recomeça do zero.
+    """
+
+    def __init__(self):
+        self._estados = {}
+        self._lock = threading.Lock()
+
+    def atualizar(self, chave, df: pd.DataFrame, recentes: bool = False):
+        """
+        Processa as barras novas de 'df' (colunas high, low, close) e devolve as leituras da
+        última. Com recentes=True devolve também a tabela das últimas leituras (tabela_recentes),
+        lida sob o mesmo lock, antes que outra sessão altere o estado.
+        """
+        indice = df.index
+        barra = lambda posicao: (float(df['high'].iat[posicao]), float(df['low'].iat[posicao]), float(df['close'].iat[posicao]))
+        with self._lock:
+            registro = self._estados.get(chave)
+            estado, inicio, primeira_barra = None, 0, indice[0]
+            if registro is not None and registro['primeira_barra'] <= indice[0] <= registro['ultima_barra']:
+                posicao = indice.searchsorted(registro['ultima_barra'])
+                if posicao < len(indice) and indice[posicao] == registro['ultima_barra']:
+                    if barra(posicao) == registro['ultimos_valores']:
+                        if posicao == len(indice) - 1:
+                            leituras = registro['leituras']
+                            return (leituras, registro['estado'].tabela_recentes()) if recentes else leituras
+                        estado, inicio = registro['estado'], posicao + 1
+                    else:
+                        # A última barra vista foi revisada (cotação intradiária): reaplica a partir do estado anterior a ela
+                        estado, inicio = _copiar(registro['estado_anterior']), posicao
+                    primeira_barra = registro['primeira_barra']
+            if estado is None:
+                estado = IndicadoresIncrementais()
+
+            # Só as barras novas são convertidas e processadas
+            valores = df.iloc[inicio:][['high', 'low', 'close']].to_numpy(dtype=float)
+            for valores_barra in valores[:-1]:
+                estado.atualizar(*valores_barra)
+            estado_anterior = _copiar(estado)
+            leituras = {nome: float(valor[0]) for nome, valor in estado.atualizar(*valores[-1]).items()}
+            self._estados[chave] = {
+                'estado': estado, 'estado_anterior': estado_anterior, 'leituras': leituras,
+                'primeira_barra': primeira_barra,
+                'ultima_barra': indice[-1], 'ultimos_valores': tuple(float(x) for x in valores[-1]),
+            }
+            return (leituras, estado.tabela_recentes()) if recentes else leituras
+
+def calcular_historico(df: pd.DataFrame) -> pd.DataFrame:
+    """Leituras de todas as barras de 'df', alimentando os indicadores barra a barra."""
+    estado = IndicadoresIncrementais()
+    valores = df[['high', 'low', 'close']].to_numpy(dtype=float)
+    return pd.DataFrame([{nome: valor[0] for nome, valor in estado.atualizar(*barra).items()} for barra in valores], index=df.index)
+
+def calcular_universo(precos: dict, historico: bool = False):
+    """
+    Indicadores de vários ativos de uma vez. 'precos' mapeia ticker -> DataFrame (high, low,
+    close); as séries são alinhadas no mesmo calendário e cada data do mercado é uma única
+    atualização vetorizada (ativo sem pregão na data = NaN, que não mexe no estado dele).
+    O resultado de cada ativo é o mesmo de processar a série dele sozinha.
+
+    Devolve um DataFrame (ticker x leitura) com as leituras da última barra de cada ativo,
+    mais 'ultima_barra' e 'barras'. Com historico=True devolve também um dicionário
+    leitura -> DataFrame (datas x tickers) com todas as barras (NaN onde o ativo não negociou).
+    """
+    tickers = list(precos)
+    painel = pd.concat({ticker: df.loc[~df.index.duplicated(keep='last'), ['high', 'low', 'close']] for ticker, df in precos.items()},
+                       axis=1).sort_index()
+    high, low, close = (painel.xs(campo, axis=1, level=1)[tickers].to_numpy(dtype=float) for campo in ('high', 'low', 'close'))
+
+    estado = IndicadoresIncrementais(len(tickers))
+    ultimas = {nome: np.full(len(tickers), np.nan) for nome in COLUNAS_PANDAS_TA}
+    ultima_barra = np.full(len(tickers), -1)
+    series = {nome: np.full(high.shape, np.nan) for nome in COLUNAS_PANDAS_TA} if historico else None
+    for posicao in range(len(painel)):
+        leituras = estado.atualizar(high[posicao], low[posicao], close[posicao])
+        m = estado.ultima_mascara
+        ultima_barra[m] = posicao
+        for nome, valor in leituras.items():
+            ultimas[nome] = np.where(m, valor, ultimas[nome])
+            if historico:
+                series[nome][posicao] = np.where(m, valor, np.nan)
+
+    resultado = pd.DataFrame(ultimas, index=tickers)
+    resultado['ultima_barra'] = [painel.index[p] if p >= 0 else pd.NaT for p in ultima_barra]
+    resultado['barras'] = estado.barras
+    if historico:
+        return resultado, {nome: pd.DataFrame(valores, index=painel.index, columns=tickers) for nome, valores in series.items()}
+    return resultado
+
+def comparar_com_pandas_ta(df: pd.DataFrame) -> pd.Series:
+    """
+    Maior diferença absoluta, por leitura, entre os indicadores incrementais e a Strategy do
+    pandas_ta sobre o mesmo histórico (NaN nos dois lados conta como igual).
+    """
+    import pandas_ta_classic as ta
+
+    referencia = df.copy()
+    referencia.ta.cores = 0  # sem multiprocessing: a comparação roda em qualquer ambiente
+    referencia.ta.strategy(ta.Strategy(name="Convergencia_Opcoes", ta=[
+        {"kind": "rsi"}, {"kind": "macd"}, {"kind": "bbands", "length": 20},
+        {"kind": "ema", "length": 9}, {"kind": "ema", "length": 21},
+        {"kind": "adx"}, {"kind": "stoch"}, {"kind": "psar"},
+    ]))
+    incremental = calcular_historico(df)
+    diferencas = {}
+    for leitura, coluna in COLUNAS_PANDAS_TA.items():
+        a, b = incremental[leitura].to_numpy(), referencia[coluna].to_numpy(dtype=float)
+        mesmo_nan = np.isnan(a) == np.isnan(b)
+        diferencas[leitura] = np.inf if not mesmo_nan.all() else float(np.nanmax(np.abs(a - b), initial=0.0))
+    return pd.Series(diferencas)
+
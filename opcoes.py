@@ -0,0 +1,595 @@
+# opcoes.py
+"""
+Cálculos vetorizados de opções usados pela aba Black-Scholes.
+
+As funções recebem escalares ou arrays (strikes, tipos, prazos) e tratam a cadeia
+inteira em uma única passada do NumPy, sem laços por opção. Não dependem do Streamlit.
+"""
+
+import numpy as np
+import pandas as pd
+
+from importacao_tardia import ModuloTardio
+
+# scipy.special.ndtr é a CDF normal padrão em C; carregada só no primeiro cálculo
+special = ModuloTardio('scipy.special')
+
+def _pdf_normal(x):
+    """Densidade da normal padrão."""
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+def eh_call(tipo) -> np.ndarray:
+    """Máscara booleana de CALLs a partir de um tipo ou array de tipos ('CALL'/'PUT', sem diferenciar maiúsculas)."""
+    return np.char.lower(np.asarray(tipo, dtype=str)) == 'call'
+
+def eh_put(tipo) -> np.ndarray:
+    """Máscara booleana de PUTs a partir de um tipo ou array de tipos."""
+    return np.char.lower(np.asarray(tipo, dtype=str)) == 'put'
+
+def eh_ativo(tipo) -> np.ndarray:
+    """Máscara das pernas no próprio ativo-objeto (tipo 'ATIVO'), usadas em estratégias como o collar."""
+    return np.char.lower(np.asarray(tipo, dtype=str)) == 'ativo'
+
+def black_scholes_vetorizado(S, K, T, r, sigma, tipo) -> dict:
+    """
+    Preço e Greeks de Black-Scholes para todas as opções de uma vez.
+
+    S, K, T, r e sigma podem ser escalares ou arrays compatíveis por broadcasting; 'tipo'
+    indica CALL ou PUT por opção. Devolve um dicionário de arrays com 'preco', 'delta',
+    'gamma', 'vega' (por 1% de vol), 'theta' (por dia) e 'rho' (por 1% de juros).
+    Opções vencidas, com vol não positiva ou de tipo desconhecido valem zero, como na
+    versão escalar.
+    """
+    S, K, T, r, sigma = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (S, K, T, r, sigma)))
+    call = np.broadcast_to(eh_call(tipo), S.shape)
+    put = np.broadcast_to(eh_put(tipo), S.shape)
+    validas = (T > 0) & (sigma > 0) & (call | put)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raiz_T = np.sqrt(np.where(validas, T, 1.0))
+        vol = np.where(validas, sigma, 1.0)
+        d1 = (np.log(S / K) + (r + 0.5 * vol ** 2) * raiz_T ** 2) / (vol * raiz_T)
+        d2 = d1 - vol * raiz_T
+        desconto = np.exp(-r * raiz_T ** 2)
+        pdf_d1 = _pdf_normal(d1)
+        # Para PUTs usa N(-d): o sinal inverte d1/d2 e o resto da fórmula é o mesmo
+        sinal = np.where(call, 1.0, -1.0)
+        n_d1 = special.ndtr(sinal * d1)
+        n_d2 = special.ndtr(sinal * d2)
+
+        preco = sinal * (S * n_d1 - K * desconto * n_d2)
+        delta = sinal * n_d1
+        gamma = pdf_d1 / (S * vol * raiz_T)
+        vega = S * pdf_d1 * raiz_T / 100
+        theta = (-S * pdf_d1 * vol / (2 * raiz_T) - sinal * r * K * desconto * n_d2) / 365
+        rho = sinal * K * raiz_T ** 2 * desconto * n_d2 / 100
+
+    return {nome: np.where(validas, valor, 0.0)
+            for nome, valor in (('preco', preco), ('delta', delta), ('gamma', gamma),
+                                ('vega', vega), ('theta', theta), ('rho', rho))}
+
+def volatilidade_implicita(preco, S, K, T, r, tipo, vol_min: float = 1e-4, vol_max: float = 5.0,
+                           tolerancia: float = 1e-8, max_iteracoes: int = 100) -> np.ndarray:
+    """
+    Inverte black_scholes_vetorizado para cada preço de mercado ao mesmo tempo.
+
+    Usa Newton-Raphson protegido: cada opção mantém um intervalo [baixo, alto] que contém a
+    solução, e quando o passo de Newton sai dele (ou o vega é quase zero, longe do dinheiro)
+    o passo vira uma bisseção. Só as opções ainda não convergidas entram em cada iteração.
+    Preços fora dos limites de arbitragem ou fora de [vol_min, vol_max] devolvem NaN.
+    """
+    preco, S, K, T, r = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (preco, S, K, T, r)))
+    tipo = np.broadcast_to(np.asarray(tipo, dtype=str), preco.shape)
+    call = eh_call(tipo)
+    iv = np.full(preco.shape, np.nan)
+
+    # Limites de arbitragem: o valor intrínseco descontado e o próprio ativo (ou strike descontado)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        desconto = np.exp(-r * T)
+        piso = np.where(call, np.maximum(S - K * desconto, 0.0), np.maximum(K * desconto - S, 0.0))
+        teto = np.where(call, S, K * desconto)
+    validas = (T > 0) & (call | eh_put(tipo)) & np.isfinite(preco) & (preco > piso) & (preco < teto)
+    # A solução precisa estar dentro do intervalo de vol pesquisado
+    validas &= black_scholes_vetorizado(S, K, T, r, vol_max, tipo)['preco'] >= preco
+    validas &= black_scholes_vetorizado(S, K, T, r, vol_min, tipo)['preco'] <= preco
+
+    idx = np.flatnonzero(validas.ravel())
+    if idx.size == 0:
+        return iv
+    alvo, s, k, t, juros, tp = (x.ravel()[idx] for x in (preco, S, K, T, r, tipo))
+    baixo = np.full(idx.size, vol_min)
+    alto = np.full(idx.size, vol_max)
+    # Chute inicial de Brenner-Subrahmanyam (bom perto do dinheiro), limitado ao intervalo
+    sigma = np.clip(np.sqrt(2 * np.pi / t) * alvo / s, 0.05, 2.0)
+    ativas = np.arange(idx.size)
+
+    for _ in range(max_iteracoes):
+        calculo = black_scholes_vetorizado(s[ativas], k[ativas], t[ativas], juros[ativas], sigma[ativas], tp[ativas])
+        erro = calculo['preco'] - alvo[ativas]
+        vega = calculo['vega'] * 100  # vega por unidade de vol (a função devolve por 1%)
+
+        convergiu = np.abs(erro) < tolerancia
+        # Atualiza o intervalo: preço alto demais => a vol está acima da solução
+        alto[ativas] = np.where(erro > 0, sigma[ativas], alto[ativas])
+        baixo[ativas] = np.where(erro < 0, sigma[ativas], baixo[ativas])
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            newton = sigma[ativas] - erro / vega
+        fora = ~np.isfinite(newton) | (newton <= baixo[ativas]) | (newton >= alto[ativas])
+        proximo = np.where(fora, 0.5 * (baixo[ativas] + alto[ativas]), newton)
+        sigma[ativas] = np.where(convergiu, sigma[ativas], proximo)
+
+        # Também para quando o intervalo já é mais estreito que a precisão útil
+        ativas = ativas[~convergiu & (alto[ativas] - baixo[ativas] > 1e-12)]
+        if ativas.size == 0:
+            break
+
+    iv.ravel()[idx] = sigma
+    return iv
+
+def terceiras_sextas(data_base, quantidade: int) -> list:
+    """
+    Próximos vencimentos mensais da B3 (terceira sexta-feira de cada mês), a partir de data_base.
+    Não considera feriados: nesses meses a cadeia simplesmente vem vazia e é descartada.
+    """
+    data_base = pd.Timestamp(data_base).normalize()
+    vencimentos = []
+    mes = data_base.replace(day=1)
+    while len(vencimentos) < quantidade:
+        # Primeira sexta do mês + 14 dias
+        terceira_sexta = mes + pd.Timedelta(days=(4 - mes.weekday()) % 7 + 14)
+        if terceira_sexta > data_base:
+            vencimentos.append(terceira_sexta.date())
+        mes += pd.offsets.MonthBegin(1)
+    return vencimentos
+
+def montar_superficie(df_cadeias, S, r, data_base):
+    """
+    Superfície de volatilidade implícita a partir das cadeias de vários vencimentos
+    (colunas de buscar_opcoes). Usa as opções fora do dinheiro de cada lado (PUTs abaixo
+    do preço atual, CALLs a partir dele), que são as mais líquidas e de preço mais informativo.
+
+    Devolve o DataFrame longo (uma linha por opção, com 'prazo_anos' e 'vol_implicita') e a
+    grade strike × vencimento.
+    """
+    df = df_cadeias.copy()
+    df['tipo'] = df['tipo'].astype(str).str.upper()
+    df = df[((df['tipo'] == 'CALL') & (df['strike'] >= S)) | ((df['tipo'] == 'PUT') & (df['strike'] < S))]
+    vencimentos = pd.to_datetime(df['vencimento'])
+    df = df.assign(prazo_anos=((vencimentos - pd.Timestamp(data_base).normalize()).dt.days / 365.0).to_numpy())
+    df['vol_implicita'] = volatilidade_implicita(df['preco_mercado'].to_numpy(), S, df['strike'].to_numpy(),
+                                                 df['prazo_anos'].to_numpy(), r, df['tipo'].to_numpy())
+    df = df.dropna(subset=['vol_implicita'])
+    grade = df.pivot_table(index='strike', columns='vencimento', values='vol_implicita', aggfunc='mean').sort_index()
+    return df.reset_index(drop=True), grade
+
+def _h_peizer_pratt(z, n):
+    """Inversão de Peizer-Pratt (método 2) usada pelas probabilidades de Leisen-Reimer."""
+    termo = z / (n + 1 / 3 + 0.1 / (n + 1))
+    return 0.5 + np.sign(z) * np.sqrt(0.25 - 0.25 * np.exp(-termo ** 2 * (n + 1 / 6)))
+
+def _parametros_arvore(S, K, T, r, sigma, passos, metodo):
+    """Fatores de subida/descida e probabilidade neutra ao risco de cada opção (arrays coluna)."""
+    dt = T / passos
+    if metodo == 'lr':
+        d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
+        d2 = d1 - sigma * np.sqrt(T)
+        p = _h_peizer_pratt(d2, passos)
+        p_linha = _h_peizer_pratt(d1, passos)
+        u = np.exp(r * dt) * p_linha / p
+        d = (np.exp(r * dt) - p * u) / (1 - p)
+    else:
+        u = np.exp(sigma * np.sqrt(dt))
+        d = 1 / u
+        p = (np.exp(r * dt) - d) / (u - d)
+    return dt, u, d, p
+
+def _induzir_arvore(S, K, T, r, sigma, call, americana, passos, metodo):
+    """
+    Indução retroativa de todas as opções em paralelo. Os argumentos são arrays 1-D (uma
+    posição por opção); as matrizes da árvore são nós × opções, de modo que cada passo
+    opera sobre linhas contíguas. Devolve o valor na raiz e os valores/preços dos nós dos
+    passos 1 e 2 (nós × opções), usados nas Greeks.
+    """
+    dt, u, d, p = _parametros_arvore(S, K, T, r, sigma, passos, metodo)
+    peso_cima = np.exp(-r * dt) * p
+    peso_baixo = np.exp(-r * dt) * (1 - p)
+    # Trabalha com preço e strike já multiplicados pelo sinal (+1 CALL, -1 PUT):
+    # o valor de exercício vira simplesmente preco_sinal - strike_sinal
+    sinal = np.where(call, 1.0, -1.0)
+    strike_sinal = sinal * K
+    j = np.arange(passos + 1)[:, None]
+    # Preço do ativo nos nós finais: S * u^j * d^(n-j)
+    precos_sinal = sinal * S * np.exp(j * np.log(u) + (passos - j) * np.log(d))
+    valores = np.maximum(precos_sinal - strike_sinal, 0.0)
+    exercer = bool(np.any(americana))
+    todas_americanas = bool(np.all(americana))
+    nos = {}
+    # Os arrays são reaproveitados a cada passo: só as primeiras 'passo + 1' linhas importam
+    for passo in range(passos - 1, -1, -1):
+        cima = peso_cima * valores[1:passo + 2]
+        atual = valores[:passo + 1]
+        atual *= peso_baixo
+        atual += cima
+        # Nós do passo anterior: S_{i,j} = S_{i+1,j} / d
+        precos_atuais = precos_sinal[:passo + 1]
+        precos_atuais /= d
+        if todas_americanas:
+            np.maximum(atual, precos_atuais - strike_sinal, out=atual)
+        elif exercer:
+            exercicio = precos_atuais - strike_sinal
+            np.maximum(atual, exercicio, out=exercicio)
+            np.copyto(atual, exercicio, where=americana)
+        if passo in (1, 2):
+            nos[passo] = (atual.copy(), sinal * precos_atuais)
+    return valores[0], nos, dt
+
+def binomial_vetorizado(S, K, T, r, sigma, tipo, americana=True, passos: int = 200, metodo: str = 'lr') -> dict:
+    """
+    Preço e Greeks por árvore binomial para uma cadeia inteira, com exercício antecipado
+    para as séries americanas. metodo='crr' usa Cox-Ross-Rubinstein; metodo='lr' usa
+    Leisen-Reimer (converge bem mais rápido, com número ímpar de passos).
+
+    Delta, gamma e theta saem dos nós dos dois primeiros passos da árvore; vega e rho vêm
+    de árvores com vol e juros deslocados, calculadas na mesma passada. As unidades são as
+    mesmas de black_scholes_vetorizado (vega e rho por 1%, theta por dia).
+    """
+    metodo = metodo.lower()
+    passos = max(int(passos), 3)
+    if metodo == 'lr' and passos % 2 == 0:
+        passos += 1
+    S, K, T, r, sigma, americana = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (S, K, T, r, sigma)),
+                                                       np.asarray(americana, dtype=bool))
+    forma = S.shape
+    tipo = np.broadcast_to(np.asarray(tipo, dtype=str), forma)
+    call, put = eh_call(tipo), eh_put(tipo)
+    validas = ((T > 0) & (sigma > 0) & (call | put)).ravel()
+    resultado = {nome: np.zeros(forma) for nome in ('preco', 'delta', 'gamma', 'vega', 'theta', 'rho')}
+    idx = np.flatnonzero(validas)
+    if idx.size == 0:
+        return resultado
+
+    # Empilha a árvore base e quatro árvores deslocadas (vol ± 1%, juros ± 1%) em uma só indução
+    s, k, t, juros, vol, c, am = (x.ravel()[idx] for x in (S, K, T, r, sigma, call, americana))
+    choque = 0.01
+    deslocamentos = [(0, 0), (choque, 0), (-choque, 0), (0, choque), (0, -choque)]
+    empilhar = lambda x: np.concatenate([x] * len(deslocamentos))
+    vol_empilhada = np.concatenate([np.maximum(vol + dv, 1e-4) for dv, _ in deslocamentos])
+    juros_empilhados = np.concatenate([juros + dr for _, dr in deslocamentos])
+    entradas = (empilhar(s), empilhar(k), empilhar(t), juros_empilhados, vol_empilhada, empilhar(c), empilhar(am))
+    # Processa em blocos de opções para que as matrizes da árvore caibam no cache do processador
+    bloco = max(32, 131072 // (passos + 1))
+    partes = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for inicio in range(0, entradas[0].size, bloco):
+            partes.append(_induzir_arvore(*(x[inicio:inicio + bloco] for x in entradas), passos, metodo))
+    raiz = np.concatenate([parte[0] for parte in partes])
+    dt = np.concatenate([parte[2] for parte in partes])
+    v1, s1, v2, s2 = (np.concatenate([parte[1][passo][i] for parte in partes], axis=1) for passo, i in ((1, 0), (1, 1), (2, 0), (2, 1)))
+    n = idx.size
+    v1, s1, v2, s2, dt = v1[:, :n], s1[:, :n], v2[:, :n], s2[:, :n], dt[:n]
+    base = raiz[:n]
+
+    delta = (v1[1] - v1[0]) / (s1[1] - s1[0])
+    delta_cima = (v2[2] - v2[1]) / (s2[2] - s2[1])
+    delta_baixo = (v2[1] - v2[0]) / (s2[1] - s2[0])
+    gamma = (delta_cima - delta_baixo) / (0.5 * (s2[2] - s2[0]))
+    # O nó central do passo 2 só coincide com S no CRR (u·d = 1); a correção de delta e gamma
+    # desconta a diferença de preço e deixa apenas o efeito do tempo
+    variacao = s2[1] - s
+    theta = (v2[1] - base - delta * variacao - 0.5 * gamma * variacao ** 2) / (2 * dt) / 365
+    vega = (raiz[n:2 * n] - raiz[2 * n:3 * n]) / (2 * choque) / 100
+    rho = (raiz[3 * n:4 * n] - raiz[4 * n:5 * n]) / (2 * choque) / 100
+
+    for nome, valor in (('preco', base), ('delta', delta), ('gamma', gamma),
+                        ('vega', vega), ('theta', theta), ('rho', rho)):
+        resultado[nome].ravel()[idx] = valor
+    return resultado
+
+def preco_black_scholes(S, K, T, r, sigma, tipo) -> np.ndarray:
+    """
+    Apenas o preço de black_scholes_vetorizado, sem as Greeks: metade das operações,
+    para grades grandes de cenários.
+    """
+    S, K, T, r, sigma = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (S, K, T, r, sigma)))
+    sinal = np.broadcast_to(np.where(eh_call(tipo), 1.0, np.where(eh_put(tipo), -1.0, 0.0)), S.shape)
+    validas = (T > 0) & (sigma > 0) & (sinal != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        desvio = np.where(validas, sigma, 1.0) * np.sqrt(np.where(validas, T, 1.0))
+        d1 = (np.log(S / K) + r * T) / desvio + 0.5 * desvio
+        preco = sinal * (S * special.ndtr(sinal * d1) - K * np.exp(-r * T) * special.ndtr(sinal * (d1 - desvio)))
+    return np.where(validas, preco, 0.0)
+
+def valor_opcao(S, K, T, r, sigma, tipo) -> np.ndarray:
+    """
+    Valor teórico de Black-Scholes que, no vencimento (T <= 0), vira o valor intrínseco.
+    É a forma usada para reprecificar posições em cenários que chegam até o vencimento.
+    Pernas do tipo 'ATIVO' valem o próprio preço do ativo (o strike é ignorado).
+    """
+    S, K, T = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (S, K, T)))
+    sinal = np.where(eh_call(tipo), 1.0, np.where(eh_put(tipo), -1.0, 0.0))
+    intrinseco = np.maximum(sinal * (S - K), 0.0)
+    valor = np.where(T > 0, preco_black_scholes(S, K, T, r, sigma, tipo), intrinseco)
+    return np.where(eh_ativo(tipo), S, valor)
+
+class GradeCenarios:
+    """
+    Resultado (P&L) de uma posição em opções sobre uma grade de preço do ativo × choque de
+    volatilidade × dias decorridos. 'pnl' tem a forma (len(precos), len(choques_vol), len(dias)).
+    """
+
+    def __init__(self, precos, choques_vol, dias, pnl):
+        self.precos = precos
+        self.choques_vol = choques_vol
+        self.dias = dias
+        self.pnl = pnl
+
+    def mapa_preco_vol(self, indice_dia: int = 0) -> pd.DataFrame:
+        """P&L por preço (linhas) e choque de vol (colunas) em um dos dias da grade."""
+        return pd.DataFrame(self.pnl[:, :, indice_dia], index=self.precos, columns=self.choques_vol)
+
+    def mapa_preco_dias(self, indice_vol: int = None) -> pd.DataFrame:
+        """P&L por preço (linhas) e dias decorridos (colunas) com um dos choques de vol (padrão: o mais próximo de zero)."""
+        if indice_vol is None:
+            indice_vol = int(np.argmin(np.abs(self.choques_vol)))
+        return pd.DataFrame(self.pnl[:, indice_vol, :], index=self.precos, columns=self.dias)
+
+def grade_cenarios(pernas: pd.DataFrame, precos, choques_vol, dias, r) -> GradeCenarios:
+    """
+    Reprecifica todas as pernas de uma posição em todos os cenários com uma única avaliação
+    vetorizada (pernas × preços × vols × dias).
+
+    'pernas' precisa das colunas 'strike', 'tipo', 'quantidade' (negativa para vendida),
+    'preco_entrada', 'vol' (vol de cada perna, por exemplo a implícita) e 'prazo_anos'
+    (prazo atual até o vencimento); pernas 'ATIVO' representam o ativo-objeto. O choque de vol é somado à vol de cada perna, preservando
+    o sorriso; os dias decorridos reduzem o prazo e, depois do vencimento, valem o intrínseco.
+    """
+    precos = np.asarray(precos, dtype=float)
+    choques_vol = np.asarray(choques_vol, dtype=float)
+    dias = np.asarray(dias, dtype=float)
+    coluna = lambda nome, dtype=float: pernas[nome].to_numpy(dtype=dtype)[:, None, None, None]
+
+    S = precos[None, :, None, None]
+    vol = np.maximum(coluna('vol') + choques_vol[None, None, :, None], 1e-4)
+    prazo = coluna('prazo_anos') - dias[None, None, None, :] / 365.0
+    valores = valor_opcao(S, coluna('strike'), prazo, r, vol, coluna('tipo', str))
+    pnl = np.einsum('p,psvd->svd', pernas['quantidade'].to_numpy(dtype=float),
+                    valores - coluna('preco_entrada'))
+    return GradeCenarios(precos, choques_vol, dias, pnl)
+
+
+# ------------------------------------------------------------------------------
+# Estratégias com várias pernas
+# ------------------------------------------------------------------------------
+
+ESTRATEGIAS = (
+    'Trava de Alta com Call', 'Trava de Baixa com Call', 'Trava de Alta com Put', 'Trava de Baixa com Put',
+    'Straddle Comprado', 'Strangle Comprado', 'Collar', 'Iron Condor Vendido',
+)
+
+def _nos_vencimento(strikes, S, T, r, vol) -> np.ndarray:
+    """
+    Preços em que o P&L no vencimento pode mudar de inclinação (zero e os strikes), mais um
+    ponto distante o bastante para que a probabilidade de o ativo passar dele seja desprezível.
+    """
+    extremo = max(2 * np.max(strikes, initial=S), S * np.exp(r * T + 8 * vol * np.sqrt(max(T, 0.0))))
+    return np.unique(np.r_[0.0, np.asarray(strikes, dtype=float), extremo])
+
+def _cdf_lognormal(x, S, T, r, vol):
+    """P(S_T <= x) com o ativo lognormal (drift r, vol 'vol'), como no próprio Black-Scholes."""
+    desvio = max(vol * np.sqrt(max(T, 0.0)), 1e-12)
+    with np.errstate(divide='ignore'):
+        return special.ndtr((np.log(np.asarray(x, dtype=float) / S) - (r - 0.5 * vol ** 2) * T) / desvio)
+
+def _metricas_vencimento(nos, pnl, inclinacao, S, T, r, vol) -> dict:
+    """
+    Métricas do P&L no vencimento de várias estratégias, a partir dos valores nos nós (forma
+    (estratégias, nós)). Entre dois nós o payoff é linear, então máximo, mínimo, pontos de
+    equilíbrio e probabilidade de lucro são exatos sem grade densa. 'inclinacao' é a derivada
+    do P&L além do último nó (positiva = lucro ilimitado na alta, negativa = perda ilimitada).
+    """
+    a, b = nos[:-1], nos[1:]
+    va, vb = pnl[:, :-1], pnl[:, 1:]
+    positivo_a, positivo_b = va > 0, vb > 0
+    cruza = positivo_a != positivo_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cruzamento = np.where(cruza, a + (b - a) * va / (va - vb), np.nan)
+
+    # Massa de probabilidade da parte positiva de cada intervalo entre nós
+    cdf_a, cdf_b = _cdf_lognormal(a, S, T, r, vol), _cdf_lognormal(b, S, T, r, vol)
+    cdf_cruzamento = _cdf_lognormal(np.where(cruza, cruzamento, a), S, T, r, vol)
+    massa = np.where(positivo_a & positivo_b, cdf_b - cdf_a, 0.0)
+    massa += np.where(cruza & positivo_b, cdf_b - cdf_cruzamento, 0.0)
+    massa += np.where(cruza & positivo_a, cdf_cruzamento - cdf_a, 0.0)
+
+    # Primeiro e último cruzamento do zero (as estratégias prontas têm no máximo dois)
+    tem_cruzamento = cruza.any(axis=1)
+    linhas = np.arange(len(pnl))
+    primeiro = np.where(tem_cruzamento, cruzamento[linhas, np.argmax(cruza, axis=1)], np.nan)
+    ultimo = np.where(tem_cruzamento, cruzamento[linhas, cruza.shape[1] - 1 - np.argmax(cruza[:, ::-1], axis=1)], np.nan)
+    return {
+        'lucro_maximo': np.where(inclinacao > 0, np.inf, pnl.max(axis=1)),
+        'perda_maxima': np.where(inclinacao < 0, -np.inf, pnl.min(axis=1)),
+        'breakeven_inferior': primeiro,
+        'breakeven_superior': ultimo,
+        'prob_lucro': massa.sum(axis=1),
+        'cruzamentos': cruzamento,
+    }
+
+class ResultadoEstrategia:
+    """
+    Avaliação de uma estratégia: P&L no vencimento e hoje (teórico) sobre uma grade densa de
+    preços, custo de montagem (positivo = débito), Greeks agregadas, pontos de equilíbrio,
+    lucro e perda máximos (infinitos quando ilimitados), probabilidade de lucro e valor
+    esperado com a volatilidade informada. O valor esperado é o valor teórico (esperança
+    neutra ao risco descontada) menos o custo: o ativo-objeto entra com valor esperado zero.
+    """
+
+    def __init__(self, precos, pnl_vencimento, pnl_hoje, custo, gregas, breakevens, lucro_maximo, perda_maxima,
+                 prob_lucro, valor_esperado):
+        self.precos = precos
+        self.pnl_vencimento = pnl_vencimento
+        self.pnl_hoje = pnl_hoje
+        self.custo = custo
+        self.gregas = gregas
+        self.breakevens = breakevens
+        self.lucro_maximo = lucro_maximo
+        self.perda_maxima = perda_maxima
+        self.prob_lucro = prob_lucro
+        self.valor_esperado = valor_esperado
+
+def avaliar_estrategia(pernas: pd.DataFrame, S: float, r: float, vol: float, pontos: int = 401) -> ResultadoEstrategia:
+    """
+    Avalia uma estratégia montada livremente. 'pernas' segue o formato de grade_cenarios
+    (strike, tipo, quantidade, preco_entrada, vol, prazo_anos; tipo 'ATIVO' para o ativo-objeto)
+    e todas as opções devem ter o mesmo vencimento. 'vol' é a volatilidade usada na
+    probabilidade de lucro e no valor esperado; o valor de hoje usa a vol de cada perna.
+    """
+    K = pernas['strike'].to_numpy(dtype=float)[:, None]
+    tipo = pernas['tipo'].to_numpy(dtype=str)[:, None]
+    quantidade = pernas['quantidade'].to_numpy(dtype=float)
+    entrada = pernas['preco_entrada'].to_numpy(dtype=float)[:, None]
+    vol_pernas = pernas['vol'].to_numpy(dtype=float)[:, None]
+    prazo = pernas['prazo_anos'].to_numpy(dtype=float)[:, None]
+    T = float(prazo.max())
+    opcoes = ~eh_ativo(tipo[:, 0])
+
+    # Métricas exatas a partir dos nós do payoff; a grade densa serve só para o gráfico
+    nos = _nos_vencimento(K[opcoes, 0], S, T, r, vol)
+    pnl_nos = quantidade @ (valor_opcao(nos, K, 0.0, r, vol_pernas, tipo) - entrada)
+    inclinacao = quantidade @ (eh_call(tipo[:, 0]) | eh_ativo(tipo[:, 0]))
+    metricas = _metricas_vencimento(nos, pnl_nos[None, :], np.array([inclinacao]), S, T, r, vol)
+
+    strikes_visiveis = K[opcoes, 0][(K[opcoes, 0] > 0.5 * S) & (K[opcoes, 0] < 1.5 * S)]
+    precos = np.unique(np.r_[np.linspace(0.5 * S, 1.5 * S, pontos), strikes_visiveis])
+    pnl_vencimento = quantidade @ (valor_opcao(precos, K, 0.0, r, vol_pernas, tipo) - entrada)
+    pnl_hoje = quantidade @ (valor_opcao(precos, K, prazo, r, vol_pernas, tipo) - entrada)
+
+    calculo = black_scholes_vetorizado(S, K[:, 0], prazo[:, 0], r, vol_pernas[:, 0], tipo[:, 0])
+    gregas = {grega: float(quantidade @ calculo[grega]) for grega in ('delta', 'gamma', 'vega', 'theta', 'rho')}
+    gregas['delta'] += float(quantidade[~opcoes].sum())
+
+    cruzamentos = metricas['cruzamentos'][0]
+    valor_esperado = quantidade @ (valor_opcao(S, K[:, 0], prazo[:, 0], r, vol, tipo[:, 0]) - entrada[:, 0])
+    return ResultadoEstrategia(
+        precos, pnl_vencimento, pnl_hoje, float(quantidade @ entrada[:, 0]), gregas,
+        cruzamentos[~np.isnan(cruzamentos)].tolist(), float(metricas['lucro_maximo'][0]), float(metricas['perda_maxima'][0]),
+        float(metricas['prob_lucro'][0]), float(valor_esperado),
+    )
+
+def _combinacoes_estrategias(kc, kp, estrategias) -> tuple:
+    """
+    Gera as pernas de todas as estratégias candidatas com índices, sem laços sobre as
+    combinações. kc e kp são os strikes (crescentes) das calls e das puts; as puts são
+    indexadas depois das calls. Devolve os nomes, os índices das opções (C, 4; -1 = perna
+    vazia), as quantidades (C, 4) e a quantidade do ativo-objeto (C,).
+    """
+    nc = len(kc)
+    ci, cj = np.triu_indices(len(kc), 1)
+    pi, pj = np.triu_indices(len(kp), 1)
+    strangle_p, strangle_c = np.nonzero(kp[:, None] < kc[None, :])
+    _, straddle_c, straddle_p = np.intersect1d(kc, kp, return_indices=True)
+    # Iron condor: trava de put abaixo de uma trava de call
+    condor_p, condor_c = np.nonzero(kp[pj][:, None] < kc[ci][None, :])
+
+    modelos = {
+        'Trava de Alta com Call': ([ci, cj], [1, -1], 0),
+        'Trava de Baixa com Call': ([ci, cj], [-1, 1], 0),
+        'Trava de Alta com Put': ([nc + pi, nc + pj], [1, -1], 0),
+        'Trava de Baixa com Put': ([nc + pi, nc + pj], [-1, 1], 0),
+        'Straddle Comprado': ([straddle_c, nc + straddle_p], [1, 1], 0),
+        'Strangle Comprado': ([nc + strangle_p, strangle_c], [1, 1], 0),
+        'Collar': ([nc + strangle_p, strangle_c], [1, -1], 1),
+        'Iron Condor Vendido': ([nc + pi[condor_p], nc + pj[condor_p], ci[condor_c], cj[condor_c]], [1, -1, -1, 1], 0),
+    }
+    nomes, indices, quantidades, ativo = [], [], [], []
+    for nome in estrategias:
+        pernas, sinais, qtd_ativo = modelos[nome]
+        n = len(pernas[0])
+        bloco = np.full((n, 4), -1, dtype=int)
+        bloco[:, :len(pernas)] = np.column_stack(pernas)
+        qtd = np.zeros((n, 4))
+        qtd[:, :len(sinais)] = sinais
+        nomes.append(np.full(n, nome, dtype=object))
+        indices.append(bloco)
+        quantidades.append(qtd)
+        ativo.append(np.full(n, float(qtd_ativo)))
+    return np.concatenate(nomes), np.concatenate(indices), np.concatenate(quantidades), np.concatenate(ativo)
+
+def ranquear_estrategias(df_opcoes: pd.DataFrame, S: float, T: float, r: float, vol: float, estrategias=ESTRATEGIAS,
+                         criterio: str = 'retorno_risco', max_strikes: int = 20, limite: int = 20) -> pd.DataFrame:
+    """
+    Monta e avalia todas as estratégias candidatas de uma cadeia (formato de buscar_opcoes:
+    ticker, tipo, strike, preco_mercado) e devolve as melhores segundo o critério:
+    'retorno_risco' (valor esperado / perda máxima), 'prob_lucro' ou 'valor_esperado'.
+
+    Usa os 'max_strikes' strikes mais próximos do preço atual em cada tipo. As métricas vêm de
+    matrizes (candidatas × nós do payoff) montadas por indexação, sem laço por combinação, e as
+    Greeks e o valor esperado são combinações lineares das Greeks de cada opção, calculadas uma
+    única vez. A coluna 'Pernas' traz as pernas no formato de avaliar_estrategia/grade_cenarios.
+    """
+    cadeia = df_opcoes[(df_opcoes['preco_mercado'] > 0) & (df_opcoes['strike'] > 0)]
+    tipos = cadeia['tipo'].to_numpy()
+    lados = []
+    for mascara in (eh_call(tipos), eh_put(tipos)):
+        lado = cadeia[mascara].sort_values('strike').drop_duplicates('strike')
+        proximos = np.argsort(np.abs(lado['strike'].to_numpy() - S), kind='stable')[:max_strikes]
+        lados.append(lado.iloc[np.sort(proximos)])
+    calls, puts = lados
+    opcoes = pd.concat([calls, puts], ignore_index=True)
+    nomes, indices, quantidades, ativo = _combinacoes_estrategias(calls['strike'].to_numpy(float), puts['strike'].to_numpy(float), estrategias)
+    if len(nomes) == 0:
+        return pd.DataFrame()
+
+    K = opcoes['strike'].to_numpy(dtype=float)
+    tipo = opcoes['tipo'].to_numpy(dtype=str)
+    premio = opcoes['preco_mercado'].to_numpy(dtype=float)
+    nos = _nos_vencimento(K, S, T, r, vol)
+    calculo = black_scholes_vetorizado(S, K, T, r, vol, tipo)
+
+    # Uma linha de zeros no fim: o índice -1 das pernas vazias aponta para ela
+    por_opcao = {
+        'pnl_nos': np.vstack([valor_opcao(nos[None, :], K[:, None], 0.0, r, vol, tipo[:, None]) - premio[:, None], np.zeros(len(nos))]),
+        'inclinacao': np.r_[eh_call(tipo).astype(float), 0.0],
+        'premio': np.r_[premio, 0.0],
+        'valor_esperado': np.r_[calculo['preco'] - premio, 0.0],
+        **{grega: np.r_[calculo[grega], 0.0] for grega in ('delta', 'gamma', 'vega', 'theta')},
+    }
+    combinar = lambda valores: np.einsum('cl,cl...->c...', quantidades, valores[indices])
+    pnl_nos = combinar(por_opcao['pnl_nos']) + ativo[:, None] * (nos - S)
+    metricas = _metricas_vencimento(nos, pnl_nos, combinar(por_opcao['inclinacao']) + ativo, S, T, r, vol)
+    valor_esperado = combinar(por_opcao['valor_esperado'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retorno_risco = np.where(np.isfinite(metricas['perda_maxima']) & (metricas['perda_maxima'] < 0),
+                                 valor_esperado / -metricas['perda_maxima'], np.nan)
+    score = {'retorno_risco': retorno_risco, 'prob_lucro': metricas['prob_lucro'], 'valor_esperado': valor_esperado}[criterio]
+    ordem = np.argsort(-np.nan_to_num(score, nan=-np.inf), kind='stable')[:limite]
+
+    tickers = opcoes['ticker'].to_numpy(dtype=str)
+    def montagem(c):
+        partes = [f"{quantidades[c, l]:+.0f} {tickers[indices[c, l]]} ({tipo[indices[c, l]][0].upper()} {K[indices[c, l]]:.2f})"
+                  for l in range(4) if quantidades[c, l] != 0]
+        return (["+1 ATIVO"] if ativo[c] else []) + partes
+    def pernas(c):
+        registros = [{'ticker': 'ATIVO', 'strike': 0.0, 'tipo': 'ATIVO', 'quantidade': ativo[c], 'preco_entrada': S, 'vol': vol, 'prazo_anos': T}] if ativo[c] else []
+        return registros + [{'ticker': tickers[indices[c, l]], 'strike': K[indices[c, l]], 'tipo': tipo[indices[c, l]],
+                             'quantidade': quantidades[c, l], 'preco_entrada': premio[indices[c, l]], 'vol': vol, 'prazo_anos': T}
+                            for l in range(4) if quantidades[c, l] != 0]
+
+    custo = combinar(por_opcao['premio']) + ativo * S
+    return pd.DataFrame({
+        'Estratégia': nomes[ordem],
+        'Montagem': [' / '.join(montagem(c)) for c in ordem],
+        'Custo (R$)': custo[ordem],
+        'Lucro Máximo (R$)': metricas['lucro_maximo'][ordem],
+        'Perda Máxima (R$)': metricas['perda_maxima'][ordem],
+        'Breakeven Inferior': metricas['breakeven_inferior'][ordem],
+        'Breakeven Superior': metricas['breakeven_superior'][ordem],
+        'Prob. Lucro (%)': metricas['prob_lucro'][ordem] * 100,
+        'Valor Esperado (R$)': valor_esperado[ordem],
+        'Retorno/Risco': retorno_risco[ordem],
+        **{grega.capitalize(): combinar(por_opcao[grega])[ordem] + (ativo[ordem] if grega == 'delta' else 0.0)
+           for grega in ('delta', 'gamma', 'vega', 'theta')},
+        'Pernas': [pernas(c) for c in ordem],
+    })
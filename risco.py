@@ -0,0 +1,80 @@
+# risco.py
+"""
+Beta e correlação móveis dos ativos contra o Ibovespa, para a análise de valuation e o
+relatório de deriva de beta do mercado.
+
+Os retornos mensais de todos os ativos formam uma matriz meses x tickers. As janelas móveis
+(12, 24 e 36 meses) saem de somas acumuladas de x, m, x², m² e x·m: a soma de cada janela é a
+diferença de duas somas acumuladas, então todas as janelas de todos os ativos custam O(meses x
+tickers), sem recalcular cada janela. Não depende do Streamlit.
+"""
+
+import numpy as np
+import pandas as pd
+
+JANELAS_BETA = (12, 24, 36)
+
+def retornos_mensais(fechamentos) -> pd.DataFrame:
+    """Retornos simples mês a mês a partir do último fechamento de cada mês (datas x tickers ou Series)."""
+    mensais = fechamentos.groupby(fechamentos.index.to_period('M')).last()
+    mensais.index = mensais.index.to_timestamp(how='end').normalize()
+    return mensais.pct_change(fill_method=None).iloc[1:]
+
+def beta_correlacao_moveis(retornos: pd.DataFrame, mercado: pd.Series, janelas=JANELAS_BETA, minimo: float = 0.75) -> dict:
+    """
+    Beta e correlação de cada ativo (colunas de 'retornos') contra 'mercado' em janelas móveis
+    de 'janelas' meses. Cada janela usa só os meses em que o ativo e o mercado têm retorno e
+    exige pelo menos 'minimo' x janela desses meses (senão NaN). Devolve janela ->
+    {'beta': DataFrame, 'correlacao': DataFrame}, com o mesmo índice e colunas de 'retornos'.
+    """
+    x = retornos.to_numpy(dtype=float)
+    m = np.broadcast_to(mercado.reindex(retornos.index).to_numpy(dtype=float)[:, None], x.shape)
+    valido = ~np.isnan(x) & ~np.isnan(m)
+    x, m = np.where(valido, x, 0.0), np.where(valido, m, 0.0)
+    zeros = np.zeros((1, x.shape[1]))
+    acumuladas = {nome: np.vstack([zeros, np.cumsum(valores, axis=0)])
+                  for nome, valores in (('n', valido), ('x', x), ('m', m), ('xx', x * x), ('mm', m * m), ('xm', x * m))}
+
+    resultado = {}
+    for janela in janelas:
+        if janela > len(x):
+            vazio = pd.DataFrame(np.nan, index=retornos.index, columns=retornos.columns)
+            resultado[janela] = {'beta': vazio, 'correlacao': vazio.copy()}
+            continue
+        # Soma da janela que termina no mês t = acumulada(t) - acumulada(t - janela)
+        soma = {nome: valores[janela:] - valores[:-janela] for nome, valores in acumuladas.items()}
+        n = soma['n']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covariancia = (soma['xm'] - soma['x'] * soma['m'] / n) / (n - 1)
+            variancia_ativo = (soma['xx'] - soma['x'] ** 2 / n) / (n - 1)
+            variancia_mercado = (soma['mm'] - soma['m'] ** 2 / n) / (n - 1)
+            suficiente = (n >= max(np.ceil(minimo * janela), 3)) & (variancia_mercado > 0)
+            beta = np.where(suficiente, covariancia / variancia_mercado, np.nan)
+            correlacao = np.where(suficiente & (variancia_ativo > 0), covariancia / np.sqrt(variancia_ativo * variancia_mercado), np.nan)
+        preenchimento = np.full((janela - 1, x.shape[1]), np.nan)
+        resultado[janela] = {
+            'beta': pd.DataFrame(np.vstack([preenchimento, beta]), index=retornos.index, columns=retornos.columns),
+            'correlacao': pd.DataFrame(np.vstack([preenchimento, correlacao]), index=retornos.index, columns=retornos.columns),
+        }
+    return resultado
+
+def _ultimo_valido(df: pd.DataFrame, defasagem: int = 0) -> pd.Series:
+    """Último valor de cada coluna, ou o de 'defasagem' meses antes do último mês."""
+    return df.iloc[:len(df) - defasagem].ffill().iloc[-1] if len(df) > defasagem else pd.Series(np.nan, index=df.columns)
+
+def relatorio_deriva_beta(moveis: dict, janela_deriva: int = 12, meses: int = 12) -> pd.DataFrame:
+    """
+    Um ativo por linha: beta e correlação atuais em cada janela, o beta da 'janela_deriva'
+    de 'meses' meses atrás, a variação entre os dois e o intervalo (mínimo/máximo) do beta
+    nesse período, ordenado pela maior variação absoluta.
+    """
+    relatorio = pd.DataFrame({f'Beta {janela}m': _ultimo_valido(series['beta']) for janela, series in moveis.items()})
+    for janela, series in moveis.items():
+        relatorio[f'Correlação {janela}m'] = _ultimo_valido(series['correlacao'])
+    beta = moveis[janela_deriva]['beta']
+    relatorio[f'Beta {janela_deriva}m há {meses} meses'] = _ultimo_valido(beta, meses)
+    relatorio[f'Variação Beta {janela_deriva}m'] = relatorio[f'Beta {janela_deriva}m'] - relatorio[f'Beta {janela_deriva}m há {meses} meses']
+    recente = beta.iloc[-(meses + 1):]
+    relatorio[f'Beta {janela_deriva}m Mínimo'] = recente.min()
+    relatorio[f'Beta {janela_deriva}m Máximo'] = recente.max()
+    return relatorio.sort_values(f'Variação Beta {janela_deriva}m', key=np.abs, ascending=False)
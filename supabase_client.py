@@ -1,17 +1,30 @@
 # supabase_client.py
 
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+from armazenamento import BackendArmazenamento, BackendSupabase, BackendSQLite, dias_locais
 
 # Etapa 1: Inicializar a conexão com o Supabase (esta parte não muda)
 @st.cache_resource
-def init_connection() -> Client:
+def init_connection() -> "Client":
     """
     Inicializa e retorna o cliente Supabase.
     As credenciais (URL e chave) são lidas dos segredos do Streamlit.
+    O pacote supabase só é importado aqui, então o backend local não paga o custo dele.
     """
     try:
+        from supabase import create_client
         url = st.secrets["supabase"]["url"]
         key = st.secrets["supabase"]["key"]
         return create_client(url, key)
@@ -19,46 +32,605 @@ def init_connection() -> Client:
         st.error(f"Erro ao conectar com o Supabase: {e}")
         return None
 
-# Instancia o cliente para ser usado pelas outras funções no arquivo
-supabase_client = init_connection()
+def _configuracao_armazenamento() -> dict:
+    """
+    Lê a seção [storage] dos segredos do Streamlit, por exemplo:
+        [storage]
+        backend = "sqlite"          # ou "supabase" (padrão)
+        caminho = "financas.db"
+    Sem segredos, usa as variáveis de ambiente ARMAZENAMENTO_BACKEND e ARMAZENAMENTO_CAMINHO.
+    """
+    try:
+        config = dict(st.secrets["storage"])
+    except Exception:
+        config = {}
+    return {
+        'backend': str(config.get('backend', os.environ.get('ARMAZENAMENTO_BACKEND', 'supabase'))).lower(),
+        'caminho': config.get('caminho', os.environ.get('ARMAZENAMENTO_CAMINHO', 'financas.db')),
+    }
+
+@st.cache_resource
+def init_backend() -> BackendArmazenamento:
+    """
+    Cria o backend de armazenamento configurado. O Supabase só é conectado quando é ele o escolhido.
+    """
+    config = _configuracao_armazenamento()
+    if config['backend'] == 'sqlite':
+        try:
+            return BackendSQLite(config['caminho'])
+        except Exception as e:
+            st.error(f"Erro ao abrir o banco local: {e}")
+            return None
+    client = init_connection()
+    return BackendSupabase(client) if client is not None else None
+
+# Instancia o backend e o cliente para serem usados pelas outras funções no arquivo
+backend = init_backend()
+supabase_client = backend.client if isinstance(backend, BackendSupabase) else None
+
+# Com um banco local não há autenticação: o app roda como um único usuário fixo
+USUARIO_LOCAL = SimpleNamespace(user=SimpleNamespace(id='local', email='usuario@local'))
+
+def armazenamento_local() -> bool:
+    """Indica se o app está usando um banco embutido (sem login do Supabase)."""
+    return backend is not None and not isinstance(backend, BackendSupabase)
+
+# --- Etapa 2: Operações síncronas na tabela 'transactions' ---
+# Estas funções delegam ao backend configurado e levantam exceções em caso de falha.
+# Elas são chamadas apenas pela fila de escrita (Etapa 4), fora do script do Streamlit.
+
+# Colunas que existem apenas no DataFrame local e nunca devem ser enviadas ao banco
+COLUNAS_SOMENTE_LOCAIS = ['id', 'created_at', 'Excluir']
+
+# Tipos compactos do DataFrame de transações: textos repetitivos viram categorias
+TIPO_LANCAMENTO = pd.CategoricalDtype(['Receita', 'Despesa', 'Investimento'])
+COLUNAS_CATEGORICAS = ['Categoria', 'Subcategoria ARCA', 'user_id']
+
+def normalizar_transacoes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converte o DataFrame de transações para uma representação compacta:
+    categorias para 'Tipo', 'Categoria', 'Subcategoria ARCA' e 'user_id',
+    float64 para 'Valor' e datetime64 para as datas.
+    """
+    if df.empty:
+        return df
+    df = df.copy(deep=False)
+    if 'id' in df.columns:
+        df['id'] = pd.to_numeric(df['id'], errors='coerce').astype('int64')
+    if 'Data' in df.columns:
+        df['Data'] = pd.to_datetime(df['Data'], format='ISO8601')
+    if 'created_at' in df.columns:
+        df['created_at'] = pd.to_datetime(df['created_at'], format='ISO8601', errors='coerce')
+    if 'Valor' in df.columns:
+        df['Valor'] = pd.to_numeric(df['Valor'], errors='coerce').astype('float64')
+    if 'Tipo' in df.columns:
+        df['Tipo'] = df['Tipo'].astype(TIPO_LANCAMENTO)
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna in df.columns:
+            df[coluna] = df[coluna].astype('category')
+    return df
+
+def _incluir_categorias(df: pd.DataFrame, valores: dict) -> pd.DataFrame:
+    """
+    Acrescenta às colunas categóricas os valores novos que estão para ser gravados nelas.
+    """
+    for coluna, valor in valores.items():
+        if coluna in df.columns and isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            if pd.notna(valor) and valor not in df[coluna].cat.categories:
+                df[coluna] = df[coluna].cat.add_categories([valor])
+    return df
+
+def _alinhar_tipos(nova: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ajusta as linhas novas aos tipos do DataFrame existente para que a concatenação
+    preserve as categorias e o fuso das datas.
+    """
+    for coluna in nova.columns:
+        if coluna not in df.columns or nova[coluna].dtype == df[coluna].dtype:
+            continue
+        if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            nova[coluna] = nova[coluna].astype(df[coluna].dtype)
+        elif isinstance(df[coluna].dtype, pd.DatetimeTZDtype) and nova[coluna].dtype.kind == 'M':
+            nova[coluna] = nova[coluna].dt.tz_localize(df[coluna].dt.tz)
+    return nova
+
+def _buscar_transacoes_remotas(user_id: str) -> pd.DataFrame:
+    """
+    Busca as transações de um usuário diretamente no banco.
+    """
+    return normalizar_transacoes(backend.buscar_transacoes(user_id))
+
+def _preparar_payload(data: dict) -> dict:
+    """
+    Converte um dicionário de lançamento para o formato aceito pelo banco (datas em ISO).
+    """
+    payload = {k: v for k, v in data.items() if k not in COLUNAS_SOMENTE_LOCAIS}
+    if 'Data' in payload and payload['Data'] is not None:
+        payload['Data'] = pd.to_datetime(payload['Data']).isoformat()
+    return payload
+
+def _inserir_transacoes(linhas: list) -> list:
+    """
+    Insere várias transações em uma única requisição e devolve as linhas gravadas (com 'id').
+    """
+    return backend.inserir_transacoes(linhas)
+
+def _atualizar_transacao(transaction_id: int, data: dict, user_id: str):
+    """
+    Atualiza uma transação existente, verificando a posse do usuário.
+    """
+    return backend.atualizar_transacao(transaction_id, data, user_id)
+
+def _excluir_transacoes(transaction_ids: list, user_id: str):
+    """
+    Exclui várias transações em uma única requisição, verificando a posse do usuário.
+    """
+    return backend.excluir_transacoes(transaction_ids, user_id)
+
+# --- Etapa 3: Totais agregados (rollups) mantidos incrementalmente ---
+
+TIPOS_LANCAMENTO = list(TIPO_LANCAMENTO.categories)
+
+class RollupsTransacoes:
+    """
+    Totais diários e mensais por tipo de lançamento de um usuário.
+
+    As tabelas são atualizadas por deltas a cada inclusão, edição ou exclusão, junto
+    com uma contagem de lançamentos por chave (um dia ou mês sem lançamentos deixa de
+    existir, como no agrupamento original). Os gráficos leem daqui, de modo que o custo
+    de renderização depende do número de dias/meses e não do número de lançamentos.
+    """
+
+    def __init__(self, df: pd.DataFrame = None):
+        self._diario = defaultdict(float)
+        self._mensal = defaultdict(float)
+        self._contagem_diaria = defaultdict(int)
+        self._contagem_mensal = defaultdict(int)
+        self._tabelas = {}
+        if df is not None and not df.empty:
+            self.aplicar(df, +1)
+
+    def copia(self) -> 'RollupsTransacoes':
+        """Cópia independente dos totais; as tabelas já materializadas são reaproveitadas."""
+        copia = RollupsTransacoes()
+        copia._diario, copia._mensal = self._diario.copy(), self._mensal.copy()
+        copia._contagem_diaria, copia._contagem_mensal = self._contagem_diaria.copy(), self._contagem_mensal.copy()
+        copia._tabelas = dict(self._tabelas)
+        return copia
+
+    @classmethod
+    def de_totais_diarios(cls, totais: pd.DataFrame) -> 'RollupsTransacoes':
+        """
+        Monta os rollups a partir das somas e contagens por dia e tipo calculadas pelo backend
+        ('Dia', 'Tipo', 'Valor', 'Quantidade'), sem passar pelas linhas individuais.
+        """
+        rollups = cls()
+        if totais.empty:
+            return rollups
+        dias = pd.to_datetime(totais['Dia'])
+        for dia, tipo, soma, quantidade in zip(dias, totais['Tipo'], totais['Valor'], totais['Quantidade']):
+            mes = dia + pd.offsets.MonthEnd(0)
+            rollups._diario[(dia, tipo)] += soma
+            rollups._contagem_diaria[(dia, tipo)] += int(quantidade)
+            rollups._mensal[(mes, tipo)] += soma
+            rollups._contagem_mensal[(mes, tipo)] += int(quantidade)
+        return rollups
+
+    def aplicar(self, linhas: pd.DataFrame, sinal: int):
+        """Soma (sinal=+1) ou subtrai (sinal=-1) a contribuição das linhas informadas."""
+        if linhas.empty:
+            return
+        validas = linhas['Valor'].notna() & linhas['Tipo'].notna() & linhas['Data'].notna()
+        if not validas.any():
+            return
+        dias = dias_locais(linhas['Data'][validas])
+        tipos = linhas['Tipo'][validas].astype(str).to_numpy()
+        # Agrupa antes de aplicar: uma carga completa vira uma única passada por (dia, tipo)
+        grupos = linhas['Valor'][validas].groupby([dias.to_numpy(), tipos]).agg(['sum', 'count'])
+        for (dia, tipo), (soma, quantidade) in grupos.iterrows():
+            mes = dia + pd.offsets.MonthEnd(0)
+            for totais, contagens, chave in ((self._diario, self._contagem_diaria, (dia, tipo)),
+                                             (self._mensal, self._contagem_mensal, (mes, tipo))):
+                totais[chave] += sinal * soma
+                contagens[chave] += sinal * int(quantidade)
+                if contagens[chave] <= 0:
+                    del totais[chave], contagens[chave]
+        self._tabelas = {}
 
-# --- Etapa 2: Funções CRUD atualizadas para a tabela 'transactions' ---
+    def _tabela(self, nome: str, totais: dict) -> pd.DataFrame:
+        """Materializa um dicionário de totais como DataFrame (datas × tipos), com cache."""
+        if nome not in self._tabelas:
+            if totais:
+                serie = pd.Series(totais)
+                tabela = serie.unstack(fill_value=0.0).sort_index()
+                tabela.index = pd.DatetimeIndex(tabela.index)
+            else:
+                tabela = pd.DataFrame(columns=TIPOS_LANCAMENTO, dtype=float, index=pd.DatetimeIndex([]))
+            self._tabelas[nome] = tabela.reindex(columns=TIPOS_LANCAMENTO, fill_value=0.0)
+        return self._tabelas[nome]
+
+    def tabela_diaria(self) -> pd.DataFrame:
+        """Totais por dia (índice) e tipo (colunas), apenas dias com lançamentos."""
+        return self._tabela('diario', self._diario)
+
+    def tabela_mensal(self) -> pd.DataFrame:
+        """Totais por mês (índice no último dia do mês) e tipo (colunas)."""
+        return self._tabela('mensal', self._mensal)
+
+    def totais_mensais(self, data_inicio, data_fim) -> pd.DataFrame:
+        """
+        Totais mensais restritos a [data_inicio, data_fim]. Os meses internos vêm direto da
+        tabela mensal; apenas os meses das pontas são recortados na tabela diária.
+        """
+        inicio, fim = pd.Timestamp(data_inicio).normalize(), pd.Timestamp(data_fim).normalize()
+        mensal, diario = self.tabela_mensal(), self.tabela_diaria()
+        resultado = mensal.loc[inicio + pd.offsets.MonthEnd(0):fim + pd.offsets.MonthEnd(0)].copy()
+        for fim_mes in {inicio + pd.offsets.MonthEnd(0), fim + pd.offsets.MonthEnd(0)}:
+            if fim_mes in resultado.index:
+                recorte = diario.loc[max(inicio, fim_mes.replace(day=1)):min(fim, fim_mes)]
+                if recorte.empty:
+                    resultado = resultado.drop(fim_mes)
+                else:
+                    resultado.loc[fim_mes] = recorte.sum()
+        return resultado
+
+    def total_antes(self, data, tipo: str) -> float:
+        """Soma de um tipo de lançamento em todas as datas anteriores a 'data'."""
+        data = pd.Timestamp(data).normalize()
+        inicio_mes = data.replace(day=1)
+        meses_anteriores = self.tabela_mensal().loc[:inicio_mes - pd.Timedelta(days=1), tipo].sum()
+        dias_do_mes = self.tabela_diaria().loc[inicio_mes:data - pd.Timedelta(days=1), tipo].sum()
+        return float(meses_anteriores + dias_do_mes)
+
+    def serie_diaria(self, tipo: str, data_inicio, data_fim) -> pd.Series:
+        """
+        Série diária contínua de um tipo, do primeiro ao último dia com lançamentos
+        dentro de [data_inicio, data_fim], com zero nos dias sem movimento.
+        """
+        inicio, fim = pd.Timestamp(data_inicio).normalize(), pd.Timestamp(data_fim).normalize()
+        recorte = self.tabela_diaria().loc[inicio:fim, tipo]
+        recorte = recorte[[(dia, tipo) in self._contagem_diaria for dia in recorte.index]]
+        if recorte.empty:
+            return recorte
+        return recorte.asfreq('D', fill_value=0.0)
+
+# --- Etapa 4: Fila de escrita assíncrona (write-behind) com atualização otimista ---
+
+class FilaEscrita:
+    """
+    Mantém em memória o DataFrame de transações de um usuário, seus rollups e uma fila de alterações.
+
+    Cada inclusão, edição ou exclusão é aplicada imediatamente ao DataFrame local
+    (a interface não espera pela rede) e enfileirada. Uma thread em segundo plano
+    descarrega a fila no banco em lotes, com novas tentativas e espera exponencial.
+    Operações que esgotam as tentativas ficam registradas como falhas até que o
+    usuário decida reprocessá-las ou descartá-las.
+    """
+
+    def __init__(self, user_id: str, tamanho_lote: int = 50, max_tentativas: int = 5,
+                 janela_agrupamento: float = 0.3, ttl_segundos: int = 300):
+        self.user_id = user_id
+        self.tamanho_lote = tamanho_lote
+        self.max_tentativas = max_tentativas
+        self.janela_agrupamento = janela_agrupamento
+        self.ttl_segundos = ttl_segundos
+
+        self._lock = threading.RLock()
+        self._evento = threading.Event()
+        self._pendentes = deque()
+        self._em_voo = 0
+        self._falhas = []
+        self._ids_reais = {}  # id temporário (negativo) -> id gerado pelo banco
+        self._proximo_id_temp = -1
+        self._df = None
+        self._rollups = RollupsTransacoes()
+        self._rollups_publicados = False  # já entregues a leitores: a próxima alteração trabalha numa cópia
+        self._versao = 0  # incrementada a cada alteração local, evita sobrescrever o otimismo na recarga
+        self._carregado_em = 0.0
+        self._recarregar = False
+        self._thread = None
+
+    # --- Leitura ---
+
+    def dataframe(self) -> pd.DataFrame:
+        """
+        Devolve o DataFrame local, carregando-o do banco na primeira chamada ou quando
+        o cache expira (somente se não houver alterações a caminho).
+        """
+        with self._lock:
+            ocioso = not self._pendentes and self._em_voo == 0
+            expirado = time.monotonic() - self._carregado_em > self.ttl_segundos
+            precisa_carregar = self._df is None or (ocioso and (expirado or self._recarregar))
+            # Lida junto com a verificação: uma alteração feita depois dela invalida a recarga
+            versao = self._versao
+        if precisa_carregar:
+            df = _buscar_transacoes_remotas(self.user_id)
+            # Backends embutidos agregam no próprio banco; os remotos reaproveitam o DataFrame baixado
+            totais = backend.totais_diarios(self.user_id, df)
+            with self._lock:
+                # Se houve alteração local durante a consulta, mantém o DataFrame otimista
+                if self._df is None or versao == self._versao:
+                    self._df = df
+                    self._rollups = RollupsTransacoes.de_totais_diarios(totais)
+                    self._rollups_publicados = False
+                self._carregado_em = time.monotonic()
+                self._recarregar = False
+        return self._df
+
+    def rollups(self) -> RollupsTransacoes:
+        """
+        Totais diários/mensais consistentes com o DataFrame devolvido por dataframe().
+        O objeto devolvido não é mais alterado: as mutações seguintes passam a uma cópia.
+        """
+        self.dataframe()
+        with self._lock:
+            self._rollups_publicados = True
+            return self._rollups
+
+    def _rollups_mutaveis(self) -> RollupsTransacoes:
+        """Rollups que podem ser alterados sem afetar leitores de outras sessões (chamar com o lock)."""
+        if self._rollups_publicados:
+            self._rollups = self._rollups.copia()
+            self._rollups_publicados = False
+        return self._rollups
+
+    def status(self) -> dict:
+        """Resumo do estado de sincronização para exibição na interface."""
+        with self._lock:
+            return {
+                'pendentes': len(self._pendentes) + self._em_voo,
+                'falhas': [dict(op) for op in self._falhas],
+            }
+
+    # --- Mutações otimistas ---
+
+    def adicionar(self, data: dict) -> int:
+        """Inclui o lançamento no DataFrame local e enfileira a gravação. Devolve o id temporário."""
+        payload = _preparar_payload(data)
+        payload['user_id'] = self.user_id
+        with self._lock:
+            self._versao += 1
+            id_temp = self._proximo_id_temp
+            self._proximo_id_temp -= 1
+            linha = {**payload, 'id': id_temp, 'created_at': None}
+            linha['Data'] = self._como_timestamp(linha.get('Data'))
+            nova = normalizar_transacoes(pd.DataFrame([linha]))
+            if self._df is None or self._df.empty:
+                self._df = nova
+            else:
+                # Cópia rasa: só as colunas categóricas ganham categorias novas
+                df = _incluir_categorias(self._df.copy(deep=False), linha)
+                nova = _alinhar_tipos(nova, df)
+                colunas = list(df.columns) + [c for c in nova.columns if c not in df.columns]
+                self._df = pd.concat([nova, df], ignore_index=True)[colunas]
+            self._rollups_mutaveis().aplicar(nova, +1)
+            self._pendentes.append({'acao': 'inserir', 'id': id_temp, 'dados': payload, 'tentativas': 0})
+        self._acordar()
+        return id_temp
+
+    def atualizar(self, transaction_id: int, data: dict):
+        """Aplica a edição no DataFrame local e enfileira a atualização."""
+        payload = _preparar_payload(data)
+        payload.pop('user_id', None)
+        with self._lock:
+            # Id temporário já trocado pelo id real na descarga: a linha local agora tem o id real
+            transaction_id = self._ids_reais.get(transaction_id, transaction_id)
+            self._versao += 1
+            if self._df is not None and not self._df.empty:
+                df = _incluir_categorias(self._df.copy(), payload)
+                mascara = df['id'] == transaction_id
+                antes = df.loc[mascara, ['Data', 'Tipo', 'Valor']]
+                for coluna, valor in payload.items():
+                    if coluna == 'Data':
+                        valor = self._como_timestamp(valor)
+                    df.loc[mascara, coluna] = valor
+                self._df = df
+                if {'Data', 'Tipo', 'Valor'} & payload.keys():
+                    rollups = self._rollups_mutaveis()
+                    rollups.aplicar(antes, -1)
+                    rollups.aplicar(df.loc[mascara, ['Data', 'Tipo', 'Valor']], +1)
+            # Se a inclusão ainda não saiu da fila, basta mesclar os novos valores nela
+            insercao = self._insercao_pendente(transaction_id)
+            if insercao is not None:
+                insercao['dados'].update(payload)
+            else:
+                self._pendentes.append({'acao': 'atualizar', 'id': transaction_id, 'dados': payload, 'tentativas': 0})
+        self._acordar()
+
+    def excluir(self, transaction_id: int):
+        """Remove o lançamento do DataFrame local e enfileira a exclusão."""
+        with self._lock:
+            transaction_id = self._ids_reais.get(transaction_id, transaction_id)
+            self._versao += 1
+            if self._df is not None and not self._df.empty:
+                mascara = self._df['id'] == transaction_id
+                self._rollups_mutaveis().aplicar(self._df[mascara], -1)
+                self._df = self._df[~mascara].reset_index(drop=True)
+            # Lançamento que nunca chegou ao banco: basta cancelar as operações pendentes dele
+            if self._insercao_pendente(transaction_id) is not None:
+                self._pendentes = deque(op for op in self._pendentes if op['id'] != transaction_id)
+                return
+            self._pendentes.append({'acao': 'excluir', 'id': transaction_id, 'dados': None, 'tentativas': 0})
+        self._acordar()
+
+    # --- Tratamento de falhas ---
+
+    def reprocessar_falhas(self):
+        """Devolve as operações com falha para a fila, zerando o contador de tentativas."""
+        with self._lock:
+            for op in self._falhas:
+                op['tentativas'] = 0
+                op.pop('erro', None)
+            self._pendentes.extendleft(reversed(self._falhas))
+            self._falhas = []
+        self._acordar()
+
+    def descartar_falhas(self):
+        """Descarta as operações com falha e agenda uma recarga do banco para desfazer o otimismo."""
+        with self._lock:
+            self._falhas = []
+            self._recarregar = True
+
+    # --- Descarga em segundo plano ---
+
+    def _acordar(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name=f"fila-escrita-{self.user_id}", daemon=True)
+                self._thread.start()
+        self._evento.set()
+
+    def _executar(self):
+        espera = 0.0
+        while True:
+            self._evento.wait()
+            # Pequena janela para que uma sequência de cliques vire um único lote
+            time.sleep(max(self.janela_agrupamento, espera))
+            self._evento.clear()
+            sucesso = self._descarregar()
+            espera = 0.0 if sucesso else min(30.0, 0.5 * 2 ** self._maior_tentativa())
+            with self._lock:
+                if self._pendentes:
+                    self._evento.set()
+
+    def _descarregar(self) -> bool:
+        with self._lock:
+            lote = [self._pendentes.popleft() for _ in range(min(len(self._pendentes), self.tamanho_lote))]
+            self._em_voo = len(lote)
+        try:
+            grupos = self._agrupar(lote)
+            for i, grupo in enumerate(grupos):
+                try:
+                    self._aplicar_remoto(grupo)
+                except Exception as e:
+                    restantes = [op for g in grupos[i + 1:] for op in g]
+                    self._registrar_falha(grupo, restantes, e)
+                    return False
+            return True
+        finally:
+            with self._lock:
+                self._em_voo = 0
+
+    @staticmethod
+    def _agrupar(lote: list) -> list:
+        """Junta inclusões e exclusões consecutivas; atualizações seguem uma a uma."""
+        grupos = []
+        for op in lote:
+            if grupos and op['acao'] != 'atualizar' and grupos[-1][0]['acao'] == op['acao']:
+                grupos[-1].append(op)
+            else:
+                grupos.append([op])
+        return grupos
+
+    def _aplicar_remoto(self, grupo: list):
+        acao = grupo[0]['acao']
+        if acao == 'inserir':
+            linhas = _inserir_transacoes([op['dados'] for op in grupo])
+            with self._lock:
+                for op, linha in zip(grupo, linhas):
+                    self._ids_reais[op['id']] = linha['id']
+                self._substituir_ids_locais(linhas, grupo)
+        elif acao == 'excluir':
+            _excluir_transacoes([self._resolver_id(op['id']) for op in grupo], self.user_id)
+        else:
+            op = grupo[0]
+            _atualizar_transacao(self._resolver_id(op['id']), op['dados'], self.user_id)
+
+    def _registrar_falha(self, grupo: list, restantes: list, erro: Exception):
+        with self._lock:
+            devolver = []
+            for op in grupo:
+                op['tentativas'] += 1
+                op['erro'] = str(erro)
+                if op['tentativas'] >= self.max_tentativas:
+                    self._falhas.append(op)
+                else:
+                    devolver.append(op)
+            # Mantém a ordem original: o grupo que falhou volta à frente dos demais
+            self._pendentes.extendleft(reversed(devolver + restantes))
+
+    def _maior_tentativa(self) -> int:
+        with self._lock:
+            return max((op['tentativas'] for op in self._pendentes), default=0)
+
+    # --- Utilitários ---
+
+    def _insercao_pendente(self, transaction_id: int):
+        if transaction_id >= 0:
+            return None
+        return next((op for op in self._pendentes if op['acao'] == 'inserir' and op['id'] == transaction_id), None)
+
+    def _resolver_id(self, transaction_id: int) -> int:
+        if transaction_id >= 0:
+            return transaction_id
+        with self._lock:
+            if transaction_id not in self._ids_reais:
+                raise RuntimeError("O lançamento de origem ainda não foi gravado no banco.")
+            return self._ids_reais[transaction_id]
+
+    def _substituir_ids_locais(self, linhas: list, grupo: list):
+        if self._df is None or self._df.empty:
+            return
+        mapa = {op['id']: linha['id'] for op, linha in zip(grupo, linhas)}
+        df = self._df.copy()
+        mascara = df['id'].isin(list(mapa))
+        df.loc[mascara, 'id'] = df.loc[mascara, 'id'].map(mapa)
+        if 'created_at' in df.columns:
+            criados = pd.to_datetime(df.loc[mascara, 'id'].map({linha['id']: linha.get('created_at') for linha in linhas}), format='ISO8601', errors='coerce')
+            criados = _alinhar_tipos(criados.to_frame('created_at'), df)['created_at']
+            if criados.dtype == df['created_at'].dtype:
+                df.loc[mascara, 'created_at'] = criados
+        self._df = df
+
+    def _como_timestamp(self, valor):
+        """Converte a data para Timestamp no mesmo fuso da coluna 'Data' já carregada."""
+        ts = pd.to_datetime(valor)
+        if self._df is not None and not self._df.empty and 'Data' in self._df.columns:
+            fuso = getattr(self._df['Data'].dtype, 'tz', None)
+            if fuso is not None and ts.tzinfo is None:
+                ts = ts.tz_localize(fuso)
+        return ts
+
+
+@st.cache_resource(show_spinner=False)
+def _obter_fila(user_id: str) -> FilaEscrita:
+    """Uma fila por usuário, compartilhada entre reruns e sessões do mesmo usuário."""
+    return FilaEscrita(user_id)
+
+# --- Etapa 5: Funções CRUD usadas pela interface ---
 
 def fetch_transactions(user_id: str) -> pd.DataFrame:
     """
-    Busca as transações de um usuário específico do banco de dados.
+    Devolve as transações do usuário a partir do cache local (já com as alterações
+    ainda não sincronizadas aplicadas). O banco só é consultado na primeira carga.
     """
-    if supabase_client is None: return pd.DataFrame()
+    if backend is None: return pd.DataFrame()
     try:
-        # A query agora filtra pela coluna 'user_id' para buscar apenas os dados do usuário logado
-        response = supabase_client.table("transactions").select("*").eq("user_id", user_id).order("Data", desc=True).execute()
-        
-        if response.data:
-            df = pd.DataFrame(response.data)
-            df['Data'] = pd.to_datetime(df['Data'])
-            return df
-        else:
-            return pd.DataFrame()
-            
+        return _obter_fila(user_id).dataframe()
     except Exception as e:
         st.error(f"Erro ao buscar transações: {e}")
         return pd.DataFrame()
 
+def fetch_rollups(user_id: str) -> RollupsTransacoes:
+    """
+    Devolve os totais diários e mensais do usuário, mantidos incrementalmente
+    por add_transaction, update_transaction e delete_transaction.
+    """
+    if backend is None: return RollupsTransacoes()
+    try:
+        return _obter_fila(user_id).rollups()
+    except Exception as e:
+        st.error(f"Erro ao buscar transações: {e}")
+        return RollupsTransacoes()
+
 def add_transaction(data: dict, user_id: str):
     """
     Adiciona uma nova transação, associando-a a um user_id.
+    A gravação no banco acontece em segundo plano; devolve o id temporário local.
     """
-    if supabase_client is None: return None
+    if backend is None: return None
     try:
-        # Garante que a data está no formato de texto correto (ISO)
-        data['Data'] = pd.to_datetime(data['Data']).isoformat()
-        # Adiciona o ID do usuário ao dicionário de dados antes de inserir no banco
-        data['user_id'] = user_id
-        
-        response = supabase_client.table("transactions").insert(data).execute()
-        # Limpa o cache para forçar a busca de novos dados
-        st.cache_data.clear()
-        return response
+        return _obter_fila(user_id).adicionar(data)
     except Exception as e:
         st.error(f"Erro ao adicionar transação: {e}")
         return None
@@ -67,19 +639,9 @@ def update_transaction(transaction_id: int, data: dict, user_id: str):
     """
     Atualiza uma transação existente, verificando a posse do usuário.
     """
-    if supabase_client is None: return None
+    if backend is None: return None
     try:
-        # Garante que o formato da data está correto, se ela for alterada
-        if 'Data' in data and hasattr(data['Data'], 'isoformat'):
-            data['Data'] = pd.to_datetime(data['Data']).isoformat()
-        
-        # A query de update agora tem duas condições:
-        # 1. O 'id' da transação deve corresponder.
-        # 2. O 'user_id' da transação deve corresponder ao do usuário logado.
-        response = supabase_client.table("transactions").update(data).eq("id", transaction_id).eq("user_id", user_id).execute()
-        
-        st.cache_data.clear()
-        return response
+        return _obter_fila(user_id).atualizar(transaction_id, data)
     except Exception as e:
         st.error(f"Erro ao atualizar transação: {e}")
         return None
@@ -88,13 +650,24 @@ def delete_transaction(transaction_id: int, user_id: str):
     """
     Exclui uma transação, verificando a posse do usuário.
     """
-    if supabase_client is None: return None
+    if backend is None: return None
     try:
-        # A query de delete também verifica o ID da transação e a posse do usuário
-        response = supabase_client.table("transactions").delete().eq("id", transaction_id).eq("user_id", user_id).execute()
-        
-        st.cache_data.clear()
-        return response
+        return _obter_fila(user_id).excluir(transaction_id)
     except Exception as e:
         st.error(f"Erro ao excluir transação: {e}")
         return None
+
+def status_sincronizacao(user_id: str) -> dict:
+    """Quantidade de alterações aguardando envio e lista das que falharam."""
+    if backend is None: return {'pendentes': 0, 'falhas': []}
+    return _obter_fila(user_id).status()
+
+def reprocessar_falhas(user_id: str):
+    """Tenta novamente enviar as alterações que falharam."""
+    if backend is None: return None
+    _obter_fila(user_id).reprocessar_falhas()
+
+def descartar_falhas(user_id: str):
+    """Descarta as alterações que falharam e recarrega os dados do banco."""
+    if backend is None: return None
+    _obter_fila(user_id).descartar_falhas()
@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+from armazenamento import BackendArmazenamento, BackendSQLite, agregar_totais_diarios
+
+
+def test_backend_incompleto_falha_ao_instanciar():
+    class SoLeitura(BackendArmazenamento):
+        def buscar_transacoes(self, user_id):
+            return pd.DataFrame()
+
+    with pytest.raises(TypeError):
+        SoLeitura()
+
+
+def test_totais_sqlite_iguais_aos_calculados_em_memoria():
+    backend = BackendSQLite(":memory:")
+    backend.gerar_ledger_sintetico("carga", 20_000, anos=2)
+    backend.gerar_ledger_sintetico("outro", 500, anos=1, seed=1)
+    transacoes = backend.buscar_transacoes("carga")
+    assert len(transacoes) == 20_000
+
+    chaves = ['Dia', 'Tipo']
+    sql = backend.totais_diarios("carga").sort_values(chaves).reset_index(drop=True)
+    memoria = agregar_totais_diarios(transacoes).sort_values(chaves).reset_index(drop=True)
+    pd.testing.assert_frame_equal(sql, memoria, check_dtype=False)
+
+    mensais = backend.totais_mensais("carga").sort_values(['Mes', 'Tipo']).reset_index(drop=True)
+    meses = (memoria['Dia'] + pd.offsets.MonthEnd(0)).rename('Mes')
+    base = memoria.groupby([meses, 'Tipo'])[['Valor', 'Quantidade']].sum().reset_index()
+    pd.testing.assert_frame_equal(mensais, base, check_dtype=False)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicadores import COLUNAS_PANDAS_TA, MotorIndicadores, calcular_historico, comparar_com_pandas_ta
+
+pytest.importorskip("pandas_ta_classic")
+
+TOLERANCIA = 1e-8
+
+
+def serie_sintetica(n, seed):
+    rng = np.random.default_rng(seed)
+    close = 30 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    high = close * (1 + np.abs(rng.normal(0, 0.01, n)))
+    low = close * (1 - np.abs(rng.normal(0, 0.01, n)))
+    return pd.DataFrame({'open': (high + low) / 2, 'high': high, 'low': low, 'close': close,
+                         'volume': rng.integers(100_000, 1_000_000, n).astype(float)},
+                        index=pd.bdate_range('2023-01-02', periods=n))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_leituras_iguais_as_do_pandas_ta(seed):
+    diferencas = comparar_com_pandas_ta(serie_sintetica(400, seed))
+    assert set(diferencas.index) == set(COLUNAS_PANDAS_TA)
+    assert (diferencas <= TOLERANCIA).all(), diferencas[diferencas > TOLERANCIA].to_dict()
+
+
+def test_motor_incremental_e_revisao_da_ultima_barra():
+    df = serie_sintetica(300, 7)
+    esperado = calcular_historico(df).iloc[-1]
+    motor = MotorIndicadores()
+    motor.atualizar('TESTE', df.iloc[:-1])
+    leituras = motor.atualizar('TESTE', df)
+    for nome, valor in leituras.items():
+        assert valor == pytest.approx(esperado[nome], abs=TOLERANCIA, nan_ok=True)
+
+    # Cotação intradiária: a última barra muda sem mudar a data
+    revisado = df.copy()
+    revisado.iloc[-1, revisado.columns.get_loc('close')] *= 1.03
+    revisado.iloc[-1, revisado.columns.get_loc('high')] = revisado['close'].iat[-1] * 1.01
+    esperado = calcular_historico(revisado).iloc[-1]
+    leituras = motor.atualizar('TESTE', revisado)
+    for nome, valor in leituras.items():
+        assert valor == pytest.approx(esperado[nome], abs=TOLERANCIA, nan_ok=True)
+
+
+def test_motor_mantem_o_estado_quando_a_janela_avanca():
+    df = serie_sintetica(301, 11)
+    motor = MotorIndicadores()
+    motor.atualizar('TESTE', df.iloc[:-1])
+    estado = motor._estados['TESTE']['estado']
+
+    # Um novo pregão com o início da série um pregão adiante (download de período fixo)
+    leituras, recentes = motor.atualizar('TESTE', df.iloc[1:], recentes=True)
+    assert motor._estados['TESTE']['estado'] is estado
+    esperado = calcular_historico(df).iloc[-1]
+    for nome, valor in leituras.items():
+        assert valor == pytest.approx(esperado[nome], abs=TOLERANCIA, nan_ok=True)
+    assert recentes['close'].iat[-1] == pytest.approx(df['close'].iat[-1])
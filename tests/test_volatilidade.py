@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from volatilidade import DIAS_UTEIS_ANO, _verossimilhanca_garch, ajustar_garch, estimar_volatilidades, painel_ohlc
+
+# (alfa, beta, tolerância de alfa, tolerância de beta): com baixa persistência o beta é mal
+# identificado mesmo com 5000 retornos, mas a grade antiga não descia de beta = 0,5
+PARAMETROS_GARCH = [(0.08, 0.90, 0.03, 0.05), (0.05, 0.93, 0.03, 0.05), (0.10, 0.20, 0.05, 0.2)]
+
+
+def simular_garch(parametros, n, seed, variancia=1e-4):
+    rng = np.random.default_rng(seed)
+    alfa, beta = np.array([p[:2] for p in parametros]).T
+    h = np.full(len(parametros), variancia)
+    r = np.empty((n, len(parametros)))
+    for t in range(n):
+        r[t] = np.sqrt(h) * rng.standard_normal(len(parametros))
+        h = variancia * (1 - alfa - beta) + alfa * r[t] ** 2 + beta * h
+    return r
+
+
+@pytest.fixture(scope='module')
+def retornos_garch():
+    return simular_garch(PARAMETROS_GARCH, 5000, 0)
+
+
+def test_garch_recupera_os_parametros_simulados(retornos_garch):
+    ajuste = ajustar_garch({'retorno': retornos_garch})
+    for (alfa, beta, tol_alfa, tol_beta), (_, linha) in zip(PARAMETROS_GARCH, ajuste.iterrows()):
+        assert linha['alfa'] == pytest.approx(alfa, abs=tol_alfa)
+        assert linha['beta'] == pytest.approx(beta, abs=tol_beta)
+    assert (ajuste['observacoes'] == len(retornos_garch)).all()
+
+
+def test_garch_nao_perde_para_uma_grade_densa(retornos_garch):
+    r = retornos_garch[:2000].copy()
+    r[np.random.default_rng(1).random(r.shape) < 0.01] = np.nan
+    ajuste = ajustar_garch({'retorno': r})
+
+    alfas, betas = np.meshgrid(np.arange(0, 0.41, 0.01), np.arange(0, 1, 0.01))
+    estaveis = alfas + betas < 0.999
+    centrado = r - np.nanmean(r, axis=0)
+    variancia_amostral = np.nanmean(centrado ** 2, axis=0)
+    for i in range(r.shape[1]):
+        grade = estaveis.sum()
+        log_verossimilhanca, _ = _verossimilhanca_garch(np.repeat(centrado[:, i:i + 1], grade, axis=1),
+                                                       np.full(grade, variancia_amostral[i]),
+                                                       alfas[estaveis][None], betas[estaveis][None])
+        assert ajuste['log_verossimilhanca'].iloc[i] >= np.nanmax(log_verossimilhanca) - 1e-9
+
+
+def barras_construidas(gap, corpo, pavio, n=41):
+    """
+    Barras com gap noturno ln(O/C anterior) = ±gap e corpo ln(C/O) = ±corpo alternados e
+    pavios ln(H/max(O, C)) = ln(min(O, C)/L) = pavio: todos os estimadores têm forma fechada.
+    """
+    sinal = np.where(np.arange(n) % 2 == 0, 1.0, -1.0)
+    log_open, log_close = np.zeros(n), np.zeros(n)
+    for t in range(1, n):
+        log_open[t] = log_close[t - 1] + sinal[t] * gap
+        log_close[t] = log_open[t] + sinal[t] * corpo
+    log_high = np.maximum(log_open, log_close) + pavio
+    log_low = np.minimum(log_open, log_close) - pavio
+    return pd.DataFrame(np.exp(np.column_stack([log_open, log_high, log_low, log_close])),
+                        columns=['open', 'high', 'low', 'close'], index=pd.bdate_range('2024-01-01', periods=n))
+
+
+@pytest.mark.parametrize("gap, corpo, pavio", [(0.01, 0.02, 0.005), (0.0, 0.015, 0.01), (0.02, 0.0, 0.003)])
+def test_estimadores_ohlc_em_forma_fechada(gap, corpo, pavio):
+    n = 40
+    painel = painel_ohlc({'A': barras_construidas(gap, corpo, pavio, n + 1), 'B': barras_construidas(0.005, 0.01, 0.002, n + 1)})
+    vols = estimar_volatilidades(painel, janela=None).loc['A']
+
+    amplitude = corpo + 2 * pavio
+    k = 0.34 / (1.34 + (n + 1) / (n - 1))
+    assert vols['parkinson'] == pytest.approx(np.sqrt(DIAS_UTEIS_ANO * amplitude ** 2 / (4 * np.log(2))))
+    assert vols['garman_klass'] == pytest.approx(np.sqrt(DIAS_UTEIS_ANO * (0.5 * amplitude ** 2 - (2 * np.log(2) - 1) * corpo ** 2)))
+    # Gap e corpo alternam de sinal com média zero: variância amostral n x² / (n - 1)
+    yang_zhang = n * gap ** 2 / (n - 1) + k * n * corpo ** 2 / (n - 1) + (1 - k) * 2 * pavio * (corpo + pavio)
+    assert vols['yang_zhang'] == pytest.approx(np.sqrt(DIAS_UTEIS_ANO * yang_zhang))
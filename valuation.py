@@ -0,0 +1,213 @@
+# valuation.py
+"""
+Valuation por EVA/EFV a partir de insumos já coletados.
+
+A coleta (séries anuais da CVM, dados de mercado do Yahoo Finance e beta contra o Ibovespa)
+fica em cache no app. Este módulo só faz as contas sobre ela: WACC, EVA, EFV, preço justo e
+indicadores operacionais. Assim, mudar a taxa de crescimento na perpetuidade, os anos da média
+ou o período do beta refaz o valuation em milissegundos, sem consultar a CVM nem o Yahoo
+Finance de novo. As grades de sensibilidade avaliam o preço justo por EVA em todas as
+combinações de parâmetros de uma vez, por broadcasting (uma empresa ou o mercado inteiro).
+Não depende do Streamlit.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Séries anuais da CVM usadas pelo valuation (chaves de CONFIG['CONTAS_CVM'])
+CONTAS_VALUATION = (
+    'EBIT', 'IMPOSTO_DE_RENDA_CSLL', 'LUCRO_ANTES_IMPOSTOS', 'RECEITA_LIQUIDA', 'LUCRO_LIQUIDO',
+    'CONTAS_A_RECEBER', 'ESTOQUES', 'FORNECEDORES', 'ATIVO_IMOBILIZADO', 'ATIVO_INTANGIVEL',
+    'DIVIDA_CURTO_PRAZO', 'DIVIDA_LONGO_PRAZO', 'DESPESAS_FINANCEIRAS', 'PATRIMONIO_LIQUIDO',
+    'DEPRECIACAO_AMORTIZACAO',
+)
+# Valores de uma empresa usados nas grades de sensibilidade (ver base_sensibilidade)
+CAMPOS_SENSIBILIDADE = ('preco_atual', 'n_acoes', 'market_cap', 'capital_empregado', 'nopat', 'divida', 'kd_liquido',
+                        'risk_free', 'premio', 'beta', 'crescimento', 'wacc')
+# Variáveis do gráfico de tornado -> rótulo
+VARIAVEIS_TORNADO = {
+    'crescimento': 'Crescimento na Perpetuidade',
+    'beta': 'Beta',
+    'premio': 'Prêmio de Risco',
+    'risk_free': 'Taxa Livre de Risco',
+    'kd_liquido': 'Custo da Dívida (líquido)',
+    'nopat': 'NOPAT',
+    'capital_empregado': 'Capital Empregado',
+}
+
+def series_valuation(historicos: dict) -> tuple:
+    """
+    Parte do valuation que não depende dos parâmetros: alíquota efetiva, NOPAT, FCO, capital
+    empregado e as séries anuais alinhadas (anos com todas as contas). 'historicos' mapeia as
+    chaves de CONTAS_VALUATION -> Series anual. Devolve (insumos, mensagem), com insumos None
+    quando os dados não bastam.
+    """
+    h = historicos
+    if h['LUCRO_ANTES_IMPOSTOS'].sum() == 0 or h['EBIT'].empty:
+        return None, "Dados de Lucro/EBIT insuficientes para calcular a alíquota de imposto."
+
+    aliquota_efetiva = abs(h['IMPOSTO_DE_RENDA_CSLL'].sum()) / abs(h['LUCRO_ANTES_IMPOSTOS'].sum()) if h['LUCRO_ANTES_IMPOSTOS'].sum() != 0 else 0
+
+    hist_nopat = h['EBIT'] * (1 - aliquota_efetiva)
+    hist_fco = hist_nopat.add(h['DEPRECIACAO_AMORTIZACAO'], fill_value=0)
+    hist_ncg = h['CONTAS_A_RECEBER'].add(h['ESTOQUES'], fill_value=0).subtract(h['FORNECEDORES'], fill_value=0)
+    hist_capital_empregado = hist_ncg.add(h['ATIVO_IMOBILIZADO'], fill_value=0).add(h['ATIVO_INTANGIVEL'], fill_value=0)
+
+    df_series = pd.concat([hist_nopat, hist_fco, hist_capital_empregado, h['DIVIDA_CURTO_PRAZO'], h['DIVIDA_LONGO_PRAZO'], abs(h['DESPESAS_FINANCEIRAS']),
+                           h['PATRIMONIO_LIQUIDO'], h['RECEITA_LIQUIDA'], h['LUCRO_LIQUIDO'], h['CONTAS_A_RECEBER'], h['ESTOQUES'], h['FORNECEDORES'],
+                           h['EBIT'], h['DEPRECIACAO_AMORTIZACAO']], axis=1).dropna()
+    df_series.columns = ['NOPAT', 'FCO', 'Capital Empregado', 'Divida CP', 'Divida LP', 'Despesas Financeiras', 'PL', 'Receita Liquida', 'Lucro Liquido', 'Contas a Receber', 'Estoques', 'Fornecedores', 'EBIT', 'Dep_Amort']
+
+    if df_series.empty:
+        return None, "Séries históricas incompletas para os cálculos anuais."
+    return {'aliquota_efetiva': aliquota_efetiva, 'series': df_series, 'hist_nopat': hist_nopat, 'hist_fco': hist_fco}, "Séries coletadas."
+
+def beta_hamada(beta_mercado, imposto, divida_total, market_cap):
+    """Beta desalavancado e realavancado pela estrutura de capital atual (modelo de Hamada)."""
+    if (market_cap + divida_total) == 0 or market_cap == 0:
+        return beta_mercado
+    divida_patrimonio = divida_total / market_cap
+    beta_desalavancado = beta_mercado / (1 + (1 - imposto) * divida_patrimonio)
+    return beta_desalavancado * (1 + (1 - imposto) * divida_patrimonio)
+
+def calcular_valuation(insumos: dict, mercado: dict, beta_mercado, risk_free_rate, premio_risco_mercado, params: dict) -> tuple:
+    """
+    Valuation de uma empresa a partir dos insumos de series_valuation, dos dados de mercado
+    ('mercado': ticker, nome, market_cap, preco_atual, n_acoes) e do beta de mercado. 'params'
+    traz taxa_crescimento_perpetuidade e media_anos_calculo. Devolve (resultados, mensagem).
+    """
+    df_series, aliquota_efetiva = insumos['series'], insumos['aliquota_efetiva']
+    market_cap, preco_atual, n_acoes = mercado['market_cap'], mercado['preco_atual'], mercado['n_acoes']
+
+    hist_divida_total = df_series['Divida CP'] + df_series['Divida LP']
+    hist_roic = (df_series['NOPAT'] / df_series['Capital Empregado'])
+
+    divida_total_ultimo_ano = hist_divida_total.iloc[-1]
+
+    beta = beta_hamada(beta_mercado, aliquota_efetiva, divida_total_ultimo_ano, market_cap)
+    ke = risk_free_rate + beta * premio_risco_mercado
+    ev_mercado = market_cap + divida_total_ultimo_ano
+    wacc_medio = ((market_cap / ev_mercado) * ke) + ((divida_total_ultimo_ano / ev_mercado) * (df_series['Despesas Financeiras'].mean() / divida_total_ultimo_ano) * (1 - aliquota_efetiva)) if ev_mercado > 0 and divida_total_ultimo_ano > 0 else ke
+
+    if wacc_medio <= params['taxa_crescimento_perpetuidade'] or pd.isna(wacc_medio):
+        return None, "WACC inválido ou menor/igual à taxa de crescimento na perpetuidade. Ajuste os parâmetros."
+
+    hist_wacc = pd.Series([wacc_medio] * len(df_series.index), index=df_series.index)
+
+    hist_eva = (hist_roic - hist_wacc) * df_series['Capital Empregado']
+    hist_riqueza_atual = hist_eva / hist_wacc
+
+    riqueza_futura_esperada_ultimo = market_cap + divida_total_ultimo_ano - df_series['Capital Empregado'].iloc[-1]
+    efv_ultimo = riqueza_futura_esperada_ultimo - hist_riqueza_atual.iloc[-1]
+
+    hist_riqueza_futura_percentual = ((pd.Series([riqueza_futura_esperada_ultimo] * len(df_series.index), index=df_series.index) / df_series['Capital Empregado']) - 1) * 100
+    hist_riqueza_atual_percentual = (hist_riqueza_atual / df_series['Capital Empregado']) * 100
+    hist_efv_percentual = (hist_riqueza_futura_percentual - hist_riqueza_atual_percentual)
+    hist_eva_percentual = (hist_eva / df_series['Capital Empregado']) * 100
+
+    resultados = {
+        'Empresa': mercado['nome_empresa'], 'Ticker': mercado['ticker'], 'Preço Atual (R$)': preco_atual,
+        'Preço Justo (R$)': (riqueza_futura_esperada_ultimo + df_series['Capital Empregado'].iloc[-1] - divida_total_ultimo_ano) / n_acoes if n_acoes > 0 else 0,
+        'Margem Segurança (%)': ((riqueza_futura_esperada_ultimo + df_series['Capital Empregado'].iloc[-1] - divida_total_ultimo_ano) / n_acoes / preco_atual - 1) * 100 if n_acoes > 0 and preco_atual > 0 else -100,
+        'Market Cap (R$)': market_cap, 'Capital Empregado (R$)': df_series['Capital Empregado'].iloc[-1],
+        'Dívida Total (R$)': divida_total_ultimo_ano, 'NOPAT Médio (R$)': df_series['NOPAT'].tail(params['media_anos_calculo']).mean(),
+        'ROIC (%)': hist_roic.iloc[-1] * 100, 'Beta': beta, 'Custo do Capital (WACC %)': wacc_medio * 100,
+        'Spread (ROIC-WACC %)': (hist_roic.iloc[-1] - hist_wacc.iloc[-1]) * 100, 'EVA (R$)': hist_eva.iloc[-1], 'EFV (R$)': efv_ultimo,
+        'Crescimento Vendas (%)': df_series['Receita Liquida'].pct_change().iloc[-1] * 100 if len(df_series['Receita Liquida']) > 1 else 0,
+        'Margem de Lucro (%)': (df_series['Lucro Liquido'].iloc[-1] / df_series['Receita Liquida'].iloc[-1]) * 100 if df_series['Receita Liquida'].iloc[-1] != 0 else 0,
+        'Dívida/Patrimônio': divida_total_ultimo_ano / df_series['PL'].iloc[-1] if df_series['PL'].iloc[-1] > 0 else np.nan,
+        'Prazo Cobrança (dias)': (df_series['Contas a Receber'].iloc[-1] / df_series['Receita Liquida'].iloc[-1]) * 365 if df_series['Receita Liquida'].iloc[-1] != 0 else np.nan,
+        'Prazo Pagamento (dias)': (df_series['Fornecedores'].iloc[-1] / (df_series['EBIT'].iloc[-1] + df_series['Dep_Amort'].iloc[-1] - df_series['Lucro Liquido'].iloc[-1])) * 365 if (df_series['EBIT'].iloc[-1] + df_series['Dep_Amort'].iloc[-1] - df_series['Lucro Liquido'].iloc[-1]) != 0 else np.nan,
+        'Giro Estoques (vezes)': df_series['Receita Liquida'].iloc[-1] / df_series['Estoques'].iloc[-1] if df_series['Estoques'].iloc[-1] != 0 else np.nan,
+        'ke': ke, 'kd': df_series['Despesas Financeiras'].mean() / divida_total_ultimo_ano if divida_total_ultimo_ano > 0 else 0,
+        'hist_nopat': insumos['hist_nopat'], 'hist_fco': insumos['hist_fco'], 'hist_roic': hist_roic * 100, 'wacc_series': hist_wacc * 100,
+        'hist_riqueza_futura_percentual': hist_riqueza_futura_percentual, 'hist_riqueza_atual_percentual': hist_riqueza_atual_percentual,
+        'hist_efv_percentual': hist_efv_percentual, 'hist_eva_percentual': hist_eva_percentual
+    }
+
+    return resultados, "Análise concluída com sucesso."
+
+def base_sensibilidade(insumos: dict, mercado: dict, beta_mercado, risk_free_rate, premio_risco_mercado, params: dict):
+    """
+    Valores do último ano que entram no preço justo por EVA (ver preco_justo_eva), calculados
+    dos mesmos insumos de calcular_valuation. Devolve None sem ações ou preço positivos.
+    """
+    df_series, aliquota_efetiva = insumos['series'], insumos['aliquota_efetiva']
+    if not mercado['n_acoes'] or mercado['n_acoes'] <= 0 or not mercado['preco_atual'] or mercado['preco_atual'] <= 0:
+        return None
+    divida = float(df_series['Divida CP'].iloc[-1] + df_series['Divida LP'].iloc[-1])
+    base = {
+        'preco_atual': float(mercado['preco_atual']), 'n_acoes': float(mercado['n_acoes']), 'market_cap': float(mercado['market_cap']),
+        'capital_empregado': float(df_series['Capital Empregado'].iloc[-1]), 'nopat': float(df_series['NOPAT'].iloc[-1]), 'divida': divida,
+        'kd_liquido': float(df_series['Despesas Financeiras'].mean() / divida * (1 - aliquota_efetiva)) if divida > 0 else 0.0,
+        'risk_free': float(risk_free_rate), 'premio': float(premio_risco_mercado),
+        'beta': float(beta_hamada(beta_mercado, aliquota_efetiva, divida, mercado['market_cap'])),
+        'crescimento': float(params['taxa_crescimento_perpetuidade']),
+    }
+    base['wacc'] = float(wacc_capm(base, base['beta'], base['premio']))
+    return base
+
+def wacc_capm(base: dict, beta, premio) -> np.ndarray:
+    """WACC com ke = rf + beta x prêmio, ponderado pelo valor de mercado e pela dívida (como em calcular_valuation)."""
+    ke = base['risk_free'] + beta * premio
+    ev = base['market_cap'] + base['divida']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where((ev > 0) & (base['divida'] > 0), base['market_cap'] / ev * ke + base['divida'] / ev * base['kd_liquido'], ke)
+
+def preco_justo_eva(base: dict, crescimento, wacc) -> np.ndarray:
+    """
+    Preço justo pelo EVA na perpetuidade: (Capital Empregado + EVA x (1 + g) / (WACC - g) -
+    Dívida) / ações, com EVA = NOPAT - WACC x Capital Empregado. Com g = 0 é o Capital
+    Empregado mais a Riqueza Atual (EVA / WACC). NaN onde WACC <= g. Aceita arrays em qualquer
+    argumento (inclusive nos valores de 'base'), combinados por broadcasting.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        eva = base['nopat'] - wacc * base['capital_empregado']
+        valor = base['capital_empregado'] + eva * (1 + crescimento) / (wacc - crescimento)
+        return np.where(wacc > crescimento, (valor - base['divida']) / base['n_acoes'], np.nan)
+
+def margem_seguranca(base: dict, preco) -> np.ndarray:
+    """Margem de segurança (%) de um preço justo contra o preço atual."""
+    return (preco / base['preco_atual'] - 1) * 100
+
+def grade_crescimento_wacc(base: dict, crescimentos, waccs) -> np.ndarray:
+    """Preço justo em cada combinação de crescimento (linhas) e WACC (colunas)."""
+    return preco_justo_eva(base, np.asarray(crescimentos)[:, None], np.asarray(waccs)[None, :])
+
+def grade_beta_premio(base: dict, betas, premios) -> np.ndarray:
+    """Preço justo em cada combinação de beta (linhas) e prêmio de risco (colunas), com o crescimento da base."""
+    wacc = wacc_capm(base, np.asarray(betas)[:, None], np.asarray(premios)[None, :])
+    return preco_justo_eva(base, base['crescimento'], wacc)
+
+def tornado(base: dict, variacao: float = 0.2) -> pd.DataFrame:
+    """
+    Preço justo com cada variável de VARIAVEIS_TORNADO reduzida e aumentada em 'variacao'
+    (relativa), mantidas as demais; ordenado da maior para a menor amplitude. Todos os
+    cenários são avaliados juntos, como vetores.
+    """
+    nomes = list(VARIAVEIS_TORNADO)
+    cenarios = {chave: np.full(2 * len(nomes), valor, dtype=float) for chave, valor in base.items()}
+    for i, nome in enumerate(nomes):
+        cenarios[nome][2 * i] = base[nome] * (1 - variacao)
+        cenarios[nome][2 * i + 1] = base[nome] * (1 + variacao)
+    precos = preco_justo_eva(cenarios, cenarios['crescimento'], wacc_capm(cenarios, cenarios['beta'], cenarios['premio'])).reshape(-1, 2)
+    resultado = pd.DataFrame(precos, index=[VARIAVEIS_TORNADO[nome] for nome in nomes], columns=['Redução', 'Aumento'])
+    resultado['Amplitude'] = (resultado['Aumento'] - resultado['Redução']).abs()
+    return resultado.sort_values('Amplitude', ascending=False, na_position='last')
+
+def grade_mercado(bases: pd.DataFrame, crescimentos, deslocamentos_wacc, deslocamentos_beta=None, premios=None) -> np.ndarray:
+    """
+    Margem de segurança (%) de todas as empresas ('bases': uma linha por empresa, colunas de
+    base_sensibilidade) numa grade grosseira, como matriz empresas x eixo 1 x eixo 2. Com
+    'crescimentos' e 'deslocamentos_wacc', o WACC de cada empresa é deslocado (em valor
+    absoluto) e o crescimento é comum. Com 'deslocamentos_beta' e 'premios' (e crescimentos=None),
+    o beta de cada empresa é deslocado e o prêmio de risco é comum.
+    """
+    b = {coluna: bases[coluna].to_numpy(dtype=float)[:, None, None] for coluna in bases.columns if coluna in CAMPOS_SENSIBILIDADE}
+    if crescimentos is not None:
+        wacc = b['wacc'] + np.asarray(deslocamentos_wacc)[None, None, :]
+        preco = preco_justo_eva(b, np.asarray(crescimentos)[None, :, None], wacc)
+    else:
+        wacc = wacc_capm(b, b['beta'] + np.asarray(deslocamentos_beta)[None, :, None], np.asarray(premios)[None, None, :])
+        preco = preco_justo_eva(b, b['crescimento'], wacc)
+    return margem_seguranca(b, preco)
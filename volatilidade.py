@@ -0,0 +1,303 @@
+# volatilidade.py
+"""
+Estimadores de volatilidade a partir de barras OHLC, usados pela aba Black-Scholes e pelo
+scanner de mercado.
+
+Todas as funções recebem um painel (campo -> DataFrame datas x tickers, ver painel_ohlc) e
+calculam o universo inteiro de uma vez: cada estimador é uma redução do NumPy sobre as
+últimas barras de cada ativo, e o GARCH(1,1) é ajustado para todos os ativos juntos por
+máxima verossimilhança (grade refinada por Newton). Datas sem pregão do ativo (NaN) são
+ignoradas. Todas as volatilidades são anualizadas (252 pregões). Não depende do Streamlit.
+"""
+
+import numpy as np
+import pandas as pd
+
+DIAS_UTEIS_ANO = 252
+CAMPOS_OHLC = ('open', 'high', 'low', 'close')
+ESTIMADORES = {
+    'close': 'Close-to-Close',
+    'ewma': 'EWMA (λ = 0,94)',
+    'parkinson': 'Parkinson',
+    'garman_klass': 'Garman-Klass',
+    'yang_zhang': 'Yang-Zhang',
+    'garch': 'GARCH(1,1)',
+}
+
+def painel_ohlc(precos: dict) -> dict:
+    """Alinha ticker -> DataFrame (open, high, low, close) em campo -> DataFrame (datas x tickers)."""
+    tickers = list(precos)
+    painel = pd.concat({ticker: df.loc[~df.index.duplicated(keep='last')].reindex(columns=list(CAMPOS_OHLC))
+                        for ticker, df in precos.items()}, axis=1).sort_index()
+    return {campo: painel.xs(campo, axis=1, level=1)[tickers] for campo in CAMPOS_OHLC}
+
+def _ultimas_barras(painel: dict, barras: int = None) -> dict:
+    """
+    Últimas 'barras' barras com fechamento de cada ativo, empilhadas no fim de arrays
+    (barras x tickers): ativos com menos barras ficam com NaN no início. Assim os retornos de
+    cada coluna ligam pregões consecutivos do próprio ativo, pulando as datas sem negócio.
+    """
+    valores = {campo: painel[campo].to_numpy(dtype=float) for campo in CAMPOS_OHLC}
+    valido = ~np.isnan(valores['close'])
+    ordem = np.argsort(valido, axis=0, kind='stable')
+    valido = np.take_along_axis(valido, ordem, axis=0)
+    empilhados = {campo: np.where(valido, np.take_along_axis(v, ordem, axis=0), np.nan) for campo, v in valores.items()}
+    if barras is not None:
+        empilhados = {campo: v[-barras:] for campo, v in empilhados.items()}
+    return empilhados
+
+def _anualizar(variancia) -> np.ndarray:
+    return np.sqrt(np.asarray(variancia) * DIAS_UTEIS_ANO)
+
+def _contagem(x) -> np.ndarray:
+    return (~np.isnan(x)).sum(axis=0)
+
+def _media(x) -> np.ndarray:
+    """Média por coluna ignorando NaN (NaN, sem aviso, se a coluna não tiver valores)."""
+    n = _contagem(x)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, np.nansum(x, axis=0) / n, np.nan)
+
+def _variancia(x) -> np.ndarray:
+    """Variância amostral (ddof = 1) por coluna ignorando NaN."""
+    n = _contagem(x)
+    desvio = x - _media(x)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 1, np.nansum(desvio * desvio, axis=0) / (n - 1), np.nan)
+
+def _log_precos(barras: dict) -> tuple:
+    """Retornos logarítmicos de fechamento e as razões de preço usadas pelos estimadores OHLC."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        o, h, l, c = (np.log(barras[campo]) for campo in CAMPOS_OHLC)
+    return {
+        'retorno': np.diff(c, axis=0),
+        'noturno': o[1:] - c[:-1],
+        'abertura_fechamento': (c - o)[1:],
+        'maxima_minima': (h - l)[1:],
+        'rogers_satchell': ((h - c) * (h - o) + (l - c) * (l - o))[1:],
+    }
+
+def volatilidade_close(log_precos: dict) -> np.ndarray:
+    """Desvio-padrão dos retornos logarítmicos de fechamento (o estimador clássico)."""
+    return _anualizar(_variancia(log_precos['retorno']))
+
+def volatilidade_ewma(log_precos: dict, lambda_: float = 0.94) -> np.ndarray:
+    """
+    EWMA do RiskMetrics: média dos retornos ao quadrado com peso lambda^k para o k-ésimo
+    retorno mais antigo (média zero), normalizada pelos pesos das barras existentes.
+    """
+    r = log_precos['retorno']
+    pesos = lambda_ ** np.arange(len(r) - 1, -1, -1, dtype=float)[:, None] * ~np.isnan(r)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return _anualizar(np.nansum(pesos * r * r, axis=0) / pesos.sum(axis=0))
+
+def volatilidade_parkinson(log_precos: dict) -> np.ndarray:
+    """Parkinson: só a amplitude máxima/mínima de cada barra, ln(H/L)² / (4 ln 2)."""
+    return _anualizar(_media(log_precos['maxima_minima'] ** 2) / (4 * np.log(2)))
+
+def volatilidade_garman_klass(log_precos: dict) -> np.ndarray:
+    """Garman-Klass: 0,5 ln(H/L)² - (2 ln 2 - 1) ln(C/O)²; não considera o gap de abertura."""
+    return _anualizar(_media(0.5 * log_precos['maxima_minima'] ** 2 - (2 * np.log(2) - 1) * log_precos['abertura_fechamento'] ** 2))
+
+def volatilidade_yang_zhang(log_precos: dict) -> np.ndarray:
+    """
+    Yang-Zhang: variância do gap noturno + k x variância abertura-fechamento + (1 - k) x
+    Rogers-Satchell, com k = 0,34 / (1,34 + (n + 1)/(n - 1)). Robusto a gaps e a tendência.
+    """
+    n = _contagem(log_precos['abertura_fechamento'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k = 0.34 / (1.34 + (n + 1) / (n - 1))
+    return _anualizar(_variancia(log_precos['noturno']) + k * _variancia(log_precos['abertura_fechamento'])
+                      + (1 - k) * _media(log_precos['rogers_satchell']))
+
+def _verossimilhanca_garch(r, variancia_amostral, alfa, beta) -> np.ndarray:
+    """
+    Log-verossimilhança gaussiana do GARCH(1,1) com alvo de variância (omega = s² (1 - alfa -
+    beta)) para todas as combinações de uma vez: r é (T x N) e alfa/beta são (G x N). Retornos
+    ausentes não entram na soma e mantêm a variância condicional no valor esperado.
+    """
+    omega = variancia_amostral * (1 - alfa - beta)
+    variancia = np.broadcast_to(variancia_amostral, alfa.shape).copy()
+    log_verossimilhanca = np.zeros(alfa.shape)
+    for r_t in r:
+        quadrado = r_t * r_t
+        ausente = np.isnan(quadrado)
+        log_verossimilhanca -= 0.5 * np.where(ausente, 0.0, np.log(variancia) + quadrado / variancia)
+        variancia = omega + alfa * np.where(ausente, variancia, quadrado) + beta * variancia
+    return log_verossimilhanca, variancia
+
+def _derivadas_garch(r, variancia_amostral, alfa, beta) -> tuple:
+    """
+    Log-verossimilhança do GARCH(1,1) com alvo de variância e as derivadas dela em relação a
+    (alfa, beta) para cada ativo, em uma passada: as derivadas da variância condicional seguem
+    a mesma recursão. Devolve (log-verossimilhança (N,), gradiente (2, N), hessiana (2, 2, N)).
+    Retornos ausentes tratam o quadrado como igual à variância, como em _verossimilhanca_garch.
+    """
+    s2 = variancia_amostral
+    zeros = np.zeros(alfa.shape)
+    h = np.broadcast_to(s2, alfa.shape).copy()
+    h_a, h_b, h_aa, h_ab, h_bb = zeros.copy(), zeros.copy(), zeros.copy(), zeros.copy(), zeros.copy()
+    log_verossimilhanca, g_a, g_b, H_aa, H_ab, H_bb = (zeros.copy() for _ in range(6))
+    persistencia = alfa + beta
+    for r_t in r:
+        q = r_t * r_t
+        presente = ~np.isnan(q)
+        q = np.where(presente, q, h)
+        # dl/dh e d²l/dh², zerados nos retornos ausentes
+        u = np.where(presente, -0.5 * (h - q) / (h * h), 0.0)
+        du = np.where(presente, -0.5 * (2 * q - h) / (h * h * h), 0.0)
+        log_verossimilhanca -= np.where(presente, 0.5 * (np.log(h) + q / h), 0.0)
+        g_a += u * h_a
+        g_b += u * h_b
+        H_aa += u * h_aa + du * h_a * h_a
+        H_ab += u * h_ab + du * h_a * h_b
+        H_bb += u * h_bb + du * h_b * h_b
+        # h' = s²(1 - a - b) + a q + b h, com q = h quando o retorno falta
+        fator = np.where(presente, beta, persistencia)
+        h_aa, h_ab, h_bb = (
+            fator * h_aa + np.where(presente, 0.0, 2 * h_a),
+            fator * h_ab + h_a + np.where(presente, 0.0, h_b),
+            fator * h_bb + 2 * h_b,
+        )
+        h_a, h_b = -s2 + q + fator * h_a, -s2 + h + fator * h_b
+        h = s2 * (1 - persistencia) + alfa * q + beta * h
+    return log_verossimilhanca, np.stack([g_a, g_b]), np.array([[H_aa, H_ab], [H_ab, H_bb]])
+
+def _viavel(alfa, beta) -> tuple:
+    """Projeta (alfa, beta) na região estacionária: ambos não negativos e alfa + beta <= 0,999."""
+    alfa, beta = np.clip(alfa, 0.0, 0.999), np.clip(beta, 0.0, 0.999)
+    excesso = np.maximum(alfa + beta - 0.999, 0.0)
+    return alfa - excesso / 2, beta - excesso / 2
+
+GRADE_GARCH_ALFA = np.array([0.0025, 0.005, 0.01, 0.02, 0.03, 0.05, 0.07, 0.10, 0.13, 0.17, 0.22, 0.28, 0.35])
+GRADE_GARCH_BETA = np.array([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.98, 0.99])
+
+def _passo_newton(gradiente, hessiana, alfa, beta) -> np.ndarray:
+    """
+    Passo de Newton (2, N) para maximizar a verossimilhança. Um parâmetro em zero com o
+    gradiente apontando para fora fica fixo e o passo é de Newton só no outro; onde a hessiana
+    (ou a segunda derivada, no caso de um parâmetro) não é côncava, o passo é de subida pelo
+    gradiente escalado pela diagonal.
+    """
+    (g_a, g_b), ((H_aa, H_ab), (_, H_bb)) = gradiente, hessiana
+    livre_a, livre_b = ~((alfa <= 0) & (g_a < 0)), ~((beta <= 0) & (g_b < 0))
+    determinante = H_aa * H_bb - H_ab ** 2
+    dois = livre_a & livre_b & (H_aa < 0) & (determinante > 0)
+    so_alfa, so_beta = livre_a & ~livre_b & (H_aa < 0), livre_b & ~livre_a & (H_bb < 0)
+    subida = ~(dois | so_alfa | so_beta)
+    d_alfa = np.where(dois, -(H_bb * g_a - H_ab * g_b) / determinante, np.where(so_alfa, -g_a / H_aa, 0.0))
+    d_beta = np.where(dois, -(H_aa * g_b - H_ab * g_a) / determinante, np.where(so_beta, -g_b / H_bb, 0.0))
+    d_alfa = np.where(subida & livre_a, g_a / np.abs(H_aa), d_alfa)
+    d_beta = np.where(subida & livre_b, g_b / np.abs(H_bb), d_beta)
+    return np.nan_to_num(np.stack([d_alfa, d_beta]), posinf=0.0, neginf=0.0)
+
+def ajustar_garch(log_precos: dict, refinamentos: int = 1, iteracoes_newton: int = 10) -> pd.DataFrame:
+    """
+    GARCH(1,1) de todos os ativos por máxima verossimilhança: uma grade grossa de (alfa, beta)
+    sobre toda a região estacionária avaliada para o universo inteiro, grades locais cada vez
+    mais finas em volta do melhor ponto de cada ativo com beta < 0,8 e do melhor com beta >= 0,8
+    (a verossimilhança pode ter um máximo em cada região) e, por fim, passos de Newton
+    projetados (gradiente e hessiana analíticos, todos os ativos juntos) que só são aceitos
+    quando aumentam a verossimilhança. Devolve por ativo (na ordem das colunas) omega, alfa,
+    beta, persistência, vol de longo prazo, vol condicional do próximo pregão,
+    log-verossimilhança e número de retornos.
+    """
+    r = log_precos['retorno']
+    r = r - _media(r)
+    variancia_amostral = np.nanmean(r * r, axis=0) if len(r) else np.full(r.shape[1], np.nan)
+    N = r.shape[1]
+
+    # Grade grossa mais densa onde a verossimilhança é mais estreita: alfa pequeno e beta alto
+    alfas, betas = np.meshgrid(GRADE_GARCH_ALFA, GRADE_GARCH_BETA)
+    estaveis = (alfas + betas < 0.999) & (alfas > 0)
+    persistente = betas[estaveis] >= 0.8
+    deslocamentos = np.array([(i, j) for i in (-1, -0.5, 0, 0.5, 1) for j in (-1, -0.5, 0, 0.5, 1)])
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        # Com alfa = 0 a variância fica constante e a verossimilhança não depende de beta: essa
+        # borda é avaliada à parte e a grade (e o refinamento) só cobre alfa > 0
+        verossimilhanca_constante = _verossimilhanca_garch(r, variancia_amostral, np.zeros((1, N)), np.zeros((1, N)))[0][0]
+        log_verossimilhanca, _ = _verossimilhanca_garch(r, variancia_amostral, np.repeat(alfas[estaveis][:, None], N, axis=1), np.repeat(betas[estaveis][:, None], N, axis=1))
+        log_verossimilhanca = np.where(np.isnan(log_verossimilhanca), -np.inf, log_verossimilhanca)
+        partida = [np.argmax(np.where(regiao[:, None], log_verossimilhanca, -np.inf), axis=0) for regiao in (~persistente, persistente)]
+
+        # Daqui em diante cada ativo aparece duas vezes, uma por ponto de partida
+        r, variancia_amostral = np.concatenate([r, r], axis=1), np.concatenate([variancia_amostral, variancia_amostral])
+        colunas = np.arange(2 * N)
+        alfa_otimo, beta_otimo = alfas[estaveis][np.concatenate(partida)], betas[estaveis][np.concatenate(partida)]
+        passo_alfa, passo_beta = 0.02, 0.04
+        for _ in range(refinamentos):
+            # Grade local em volta do melhor ponto de cada ativo, com metade do passo anterior
+            alfa, beta = _viavel(alfa_otimo + deslocamentos[:, :1] * passo_alfa, beta_otimo + deslocamentos[:, 1:] * passo_beta)
+            log_verossimilhanca, _ = _verossimilhanca_garch(r, variancia_amostral, alfa, beta)
+            melhor = np.argmax(np.where(np.isnan(log_verossimilhanca), -np.inf, log_verossimilhanca), axis=0)
+            alfa_otimo, beta_otimo = alfa[melhor, colunas], beta[melhor, colunas]
+            passo_alfa, passo_beta = passo_alfa / 2, passo_beta / 2
+
+        # Newton projetado: a cada passada, o candidato de cada ativo é aceito se melhorar a
+        # verossimilhança (e dá o próximo passo) ou tem o passo reduzido à metade
+        verossimilhanca_otima, gradiente, hessiana = _derivadas_garch(r, variancia_amostral, alfa_otimo, beta_otimo)
+        direcao = _passo_newton(gradiente, hessiana, alfa_otimo, beta_otimo)
+        fracao = np.ones(2 * N)
+        for _ in range(iteracoes_newton):
+            if not np.any(direcao):
+                break
+            alfa_candidato, beta_candidato = _viavel(alfa_otimo + fracao * direcao[0], beta_otimo + fracao * direcao[1])
+            verossimilhanca, gradiente_c, hessiana_c = _derivadas_garch(r, variancia_amostral, alfa_candidato, beta_candidato)
+            aceito = verossimilhanca > verossimilhanca_otima
+            alfa_otimo, beta_otimo = np.where(aceito, alfa_candidato, alfa_otimo), np.where(aceito, beta_candidato, beta_otimo)
+            verossimilhanca_otima = np.where(aceito, verossimilhanca, verossimilhanca_otima)
+            direcao = np.where(aceito, _passo_newton(gradiente_c, hessiana_c, alfa_candidato, beta_candidato), direcao)
+            fracao = np.where(aceito, 1.0, fracao / 2)
+            # Convergiu (passo desprezível) ou desistiu (passo reduzido demais sem melhora)
+            direcao = np.where((fracao < 1e-3) | (np.abs(fracao * direcao).max(axis=0) < 1e-8), 0.0, direcao)
+
+        # Fica a melhor das duas partidas, ou variância constante se nenhuma a superar
+        segunda = np.nan_to_num(verossimilhanca_otima[N:], nan=-np.inf) > np.nan_to_num(verossimilhanca_otima[:N], nan=-np.inf)
+        alfa_otimo, beta_otimo = np.where(segunda, alfa_otimo[N:], alfa_otimo[:N]), np.where(segunda, beta_otimo[N:], beta_otimo[:N])
+        verossimilhanca_otima = np.where(segunda, verossimilhanca_otima[N:], verossimilhanca_otima[:N])
+        r, variancia_amostral = r[:, :N], variancia_amostral[:N]
+        constante = verossimilhanca_constante > verossimilhanca_otima
+        alfa_otimo, beta_otimo = np.where(constante, 0.0, alfa_otimo), np.where(constante, 0.0, beta_otimo)
+        log_verossimilhanca, variancia_seguinte = _verossimilhanca_garch(r, variancia_amostral, alfa_otimo[None], beta_otimo[None])
+    persistencia = alfa_otimo + beta_otimo
+    return pd.DataFrame({
+        'omega': variancia_amostral * (1 - persistencia), 'alfa': alfa_otimo, 'beta': beta_otimo, 'persistencia': persistencia,
+        'vol_longo_prazo': _anualizar(variancia_amostral), 'vol_condicional': _anualizar(variancia_seguinte[0]),
+        'log_verossimilhanca': log_verossimilhanca[0], 'observacoes': _contagem(r),
+    })
+
+def previsao_garch(ajuste: pd.DataFrame, dias) -> np.ndarray:
+    """
+    Volatilidade média anualizada prevista pelo GARCH para os próximos 'dias' pregões (a que
+    entra no preço de uma opção com esse prazo): a variância converge para a de longo prazo
+    à taxa da persistência, sigma²(k) = V + p^(k-1) (sigma²(1) - V).
+    """
+    dias = np.maximum(np.asarray(dias, dtype=float), 1)
+    p = ajuste['persistencia'].to_numpy()
+    longo_prazo = ajuste['vol_longo_prazo'].to_numpy() ** 2 / DIAS_UTEIS_ANO
+    seguinte = ajuste['vol_condicional'].to_numpy() ** 2 / DIAS_UTEIS_ANO
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fator_medio = np.where(p < 1, (1 - p ** dias) / ((1 - p) * dias), 1.0)
+    return _anualizar(longo_prazo + fator_medio * (seguinte - longo_prazo))
+
+def estimar_volatilidades(painel: dict, janela: int = DIAS_UTEIS_ANO, lambda_ewma: float = 0.94,
+                          dias_garch: int = 21, barras_garch: int = 4 * DIAS_UTEIS_ANO) -> pd.DataFrame:
+    """
+    Todos os estimadores (colunas = chaves de ESTIMADORES) para todos os ativos do painel
+    (linhas). Os estimadores de janela usam os últimos 'janela' retornos de cada ativo (None =
+    todo o painel); o GARCH é ajustado com até 'barras_garch' retornos e a coluna 'garch' é a
+    vol média prevista para 'dias_garch' pregões. O ajuste completo sai em .attrs['garch'].
+    """
+    log_precos = _log_precos(_ultimas_barras(painel, None if janela is None else janela + 1))
+    ajuste = ajustar_garch(_log_precos(_ultimas_barras(painel, None if barras_garch is None else barras_garch + 1)))
+    ajuste.index = painel['close'].columns
+    resultado = pd.DataFrame({
+        'close': volatilidade_close(log_precos),
+        'ewma': volatilidade_ewma(log_precos, lambda_ewma),
+        'parkinson': volatilidade_parkinson(log_precos),
+        'garman_klass': volatilidade_garman_klass(log_precos),
+        'yang_zhang': volatilidade_yang_zhang(log_precos),
+        'garch': previsao_garch(ajuste, dias_garch),
+    }, index=painel['close'].columns)
+    resultado.attrs['garch'] = ajuste
+    return resultado